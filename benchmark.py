@@ -0,0 +1,287 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+import numpy as np
+import httpx
+import generate_data
+
+# ⏱ ベンチマーク：/graph/*（メニュー・結果ページ）、/api/v1/*（集計JSON）、/api/receive_*（取込）を
+# ASGIアプリに直接（ソケットなしで）投げ、ルートごとの p50/p95 レイテンシ・スループット・ピークRSS を出す。
+# 作業用の一時ディレクトリに main.py・テンプレート・データをコピーして動かすため、data/ は書き換えない。
+#
+#   python generate_data.py --out bench_data --kousu-rows 1000000
+#   python benchmark.py --data bench_data --requests 50 --concurrency 8
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def prepare_workdir(data_dir):
+    work = tempfile.mkdtemp(prefix="kousu-bench-")
+    for name in ["templates", "static"]:
+        shutil.copytree(os.path.join(APP_DIR, name), os.path.join(work, name))
+    shutil.copy(os.path.join(APP_DIR, "main.py"), work)
+    os.makedirs(os.path.join(work, "data"))
+    for name in ["工数データ.csv", "検査工数データ.csv", "一般工事売上データ.csv"]:
+        shutil.copy(os.path.join(data_dir, name), os.path.join(work, "data", name))
+    return work
+
+
+def reset_peak_rss():
+    # VmHWM（プロセスのピークRSS）をルートごとに測るため、現在値にリセットする（Linuxのみ）
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # /proc が無い環境はプロセス開始からのピーク（macOSはバイト、Linuxはキロバイト）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def csv_bytes(df, encoding):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    return buf.getvalue().encode(encoding)
+
+
+# ▼ シナリオ：(ルート名, メソッド, パス, 引数の生成関数)。引数は選択肢を順に回して毎回少しずつ変える。
+def build_scenarios(main, ingest_rows, seed):
+    kousu = main.get_kousu_options()
+    general = main.get_general_options()
+    rng = np.random.default_rng(seed)
+    work_type_sets = [kousu["work_types"][:1], kousu["work_types"][:3], kousu["work_types"]]
+    terms = itertools.cycle(kousu["terms"])
+    months = itertools.cycle([(y, m) for y in kousu["years"] for m in kousu["months"]])
+    users = itertools.cycle(kousu["person_users"] or [""])
+    kinds = itertools.cycle(work_type_sets)
+    periods = itertools.cycle(general["periods"])
+    persons = itertools.cycle(general["persons"] or [""])
+    general_months = general["months"] or ["2024年1月"]
+    month_pairs = itertools.cycle([(general_months[i], general_months[min(len(general_months) - 1, i + 11)]) for i in range(0, len(general_months), 3)])
+    detail_types = itertools.cycle(["estimate", "decision"])
+
+    def year_month():
+        y, m = next(months)
+        return {"year": y, "month": m}
+
+    def kousu_term():
+        return {"term": next(terms), "work_types": next(kinds)}
+
+    def kousu_month():
+        return {**year_month(), "work_types": next(kinds)}
+
+    def person_type():
+        return {**year_month(), "user": next(users)}
+
+    def person_period():
+        y, m = next(months)
+        return {"start_year": y, "start_month": 1, "end_year": y, "end_month": 12, "user": next(users), "work_types": next(kinds)}
+
+    def estimate_term():
+        return {"term": next(periods), "person": next(persons)}
+
+    def estimate_term_detail():
+        term = next(periods)
+        year = int(term[:4])
+        return {"term": term, "person": next(persons), "year": year, "month": 10, "type": next(detail_types)}
+
+    def estimate_period():
+        start, end = next(month_pairs)
+        return {"start_month": start, "end_month": end, "person": next(persons)}
+
+    def estimate_period_detail():
+        start, end = next(month_pairs)
+        year, month = re.match(r"(\d+)年(\d+)月", start).groups()
+        return {"start": start, "end": end, "year": int(year), "month": int(month), "person": next(persons), "type": next(detail_types)}
+
+    def total_term():
+        return {"term": next(periods)}
+
+    # 取込は既存と重ならない作業ID・見積No.で毎回新しい行を追加する
+    ids = itertools.count(800_000_000, ingest_rows)
+    days = np.sort(rng.integers(0, 365, size=ingest_rows))
+    workers = np.array(kousu["person_users"] or ["平野司"], dtype=object)
+    staff = np.array(general["persons"] or ["森本健"], dtype=object)
+    # 宛名・建物名は generate_data と同じ作り方（見積数に応じた件数）にする
+    clients = generate_data.client_names(max(1, ingest_rows // 5) // 3)
+    buildings = generate_data.building_names(max(1, ingest_rows // 5) // 2)
+
+    def kousu_upload():
+        chunk = generate_data.kousu_chunk(rng, next(ids), ingest_rows, days, "2024-05-01", workers)
+        return {"files": {"records": ("kousu.csv", csv_bytes(chunk, "cp932"), "text/csv")}}
+
+    def kensa_upload():
+        chunk = generate_data.kousu_chunk(rng, next(ids), ingest_rows, days, "2024-05-01", workers)
+        kensa = generate_data.kensa_chunk(rng, chunk, 1.0)
+        return {"files": {"records": ("kensa.csv", csv_bytes(kensa, "utf-8-sig"), "text/csv")}}
+
+    def general_upload():
+        estimates = max(1, ingest_rows // 5)
+        chunk = generate_data.general_chunk(rng, next(ids), estimates, days[:estimates], "2024-05-01", staff, clients, buildings, 0.3)
+        return {"files": {"records": ("general.csv", csv_bytes(chunk, "utf-8-sig"), "text/csv")}}
+
+    def query(params):
+        return lambda: {"params": params()}
+
+    def form(params):
+        return lambda: {"data": params()}
+
+    menus = [
+        "/", "/graph/menu", "/graph/all", "/graph/term", "/graph/month", "/graph/person", "/graph/person/type",
+        "/graph/person/period", "/graph/general", "/graph/estimate/menu", "/graph/estimate/person",
+        "/graph/estimate/total", "/graph/estimate/person/term", "/graph/estimate/person/period",
+        "/graph/estimate/total/term", "/graph/estimate/total/compare"
+    ]
+    scenarios = [(f"GET {path}", "GET", path, dict) for path in menus]
+    scenarios += [
+        ("POST /graph/term/result", "POST", "/graph/term/result", form(kousu_term)),
+        ("POST /graph/month/result", "POST", "/graph/month/result", form(kousu_month)),
+        ("POST /graph/person/type/result", "POST", "/graph/person/type/result", form(person_type)),
+        ("POST /graph/person/period/result", "POST", "/graph/person/period/result", form(person_period)),
+        ("POST /graph/estimate/person/term/result", "POST", "/graph/estimate/person/term/result", form(estimate_term)),
+        ("GET /graph/estimate/person/term/detail", "GET", "/graph/estimate/person/term/detail", query(estimate_term_detail)),
+        ("POST /graph/estimate/person/period/result", "POST", "/graph/estimate/person/period/result", form(estimate_period)),
+        ("GET /graph/estimate/person/period/detail", "GET", "/graph/estimate/person/period/detail", query(estimate_period_detail)),
+        ("POST /graph/estimate/total/term/result", "POST", "/graph/estimate/total/term/result", form(total_term)),
+        ("POST /graph/estimate/total/compare/result", "POST", "/graph/estimate/total/compare/result", form(total_term)),
+        ("GET /api/v1/kousu/term", "GET", "/api/v1/kousu/term", query(kousu_term)),
+        ("GET /api/v1/kousu/month", "GET", "/api/v1/kousu/month", query(kousu_month)),
+        ("GET /api/v1/kousu/person/type", "GET", "/api/v1/kousu/person/type", query(person_type)),
+        ("GET /api/v1/kousu/person/period", "GET", "/api/v1/kousu/person/period", query(person_period)),
+        ("GET /api/v1/estimate/person/term", "GET", "/api/v1/estimate/person/term", query(estimate_term)),
+        ("GET /api/v1/estimate/person/term/detail", "GET", "/api/v1/estimate/person/term/detail", query(estimate_term_detail)),
+        ("GET /api/v1/estimate/person/period", "GET", "/api/v1/estimate/person/period", query(estimate_period)),
+        ("GET /api/v1/estimate/person/period/detail", "GET", "/api/v1/estimate/person/period/detail", query(estimate_period_detail)),
+        ("GET /api/v1/estimate/total/term", "GET", "/api/v1/estimate/total/term", query(total_term)),
+        ("GET /api/v1/estimate/total/compare", "GET", "/api/v1/estimate/total/compare", query(total_term)),
+        # 取込はデータセットの版を進めるため最後に流す
+        ("POST /api/receive_kousu_data", "POST", "/api/receive_kousu_data", kousu_upload),
+        ("POST /api/receive_data", "POST", "/api/receive_data", kensa_upload),
+        ("POST /api/receive_general_construction", "POST", "/api/receive_general_construction", general_upload)
+    ]
+    return scenarios
+
+
+async def run_route(client, method, path, make_kwargs, requests, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(kwargs):
+        nonlocal errors
+        async with limit:
+            started = time.perf_counter()
+            res = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if res.status_code >= 400:
+                errors += 1
+
+    # リクエスト内容（取込CSVの生成を含む）は計測の前に作っておく
+    payloads = [make_kwargs() for _ in range(requests)]
+    started = time.perf_counter()
+    await asyncio.gather(*(one(kwargs) for kwargs in payloads))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run(args):
+    import main
+    measurable = reset_peak_rss()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # 初回の読み込み（CSV→キャッシュ）は別枠で測る
+            started = time.perf_counter()
+            await main.worker_pool.run(main.get_kousu_options)
+            await main.worker_pool.run(main.get_general_options)
+            print(f"✅ データ読み込み: {time.perf_counter() - started:.2f}s / ピークRSS {peak_rss_mib():.0f}MiB")
+
+            scenarios = build_scenarios(main, args.ingest_rows, args.seed)
+            pattern = re.compile(args.routes) if args.routes else None
+            results = []
+            for name, method, path, make_kwargs in scenarios:
+                if pattern and not pattern.search(name):
+                    continue
+                count = args.ingest_requests if "/api/receive_" in path else args.requests
+                reset_peak_rss()
+                latencies, errors, elapsed = await run_route(client, method, path, make_kwargs, count, args.concurrency)
+                ms = np.array(latencies) * 1000
+                row = {
+                    "route": name,
+                    "requests": count,
+                    "errors": errors,
+                    "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                    "p95_ms": round(float(np.percentile(ms, 95)), 2),
+                    "max_ms": round(float(ms.max()), 2),
+                    "rps": round(count / elapsed, 1),
+                    "peak_rss_mib": round(peak_rss_mib(), 1)
+                }
+                results.append(row)
+                mark = "✅" if errors == 0 else "❌"
+                print(f"{mark} {name:<48} p50 {row['p50_ms']:>9.2f}ms  p95 {row['p95_ms']:>9.2f}ms  {row['rps']:>8.1f} req/s  RSS {row['peak_rss_mib']:>7.1f}MiB  エラー {errors}")
+    if not measurable:
+        print("⚠️ /proc/self/clear_refs が使えないため、ピークRSSはプロセス開始からの最大値です")
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="各ルートのレイテンシ・スループット・ピークRSSを計測する")
+    parser.add_argument("--data", default="bench_data", help="generate_data.py の出力ディレクトリ")
+    parser.add_argument("--requests", type=int, default=50, help="ルートごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--routes", default="", help="対象ルートの絞り込み（正規表現。例: 'api/v1|receive'）")
+    parser.add_argument("--ingest-requests", type=int, default=5, help="取込ルートごとのリクエスト数")
+    parser.add_argument("--ingest-rows", type=int, default=1000, help="取込1回あたりの行数")
+    parser.add_argument("--no-cache", action="store_true", help="応答キャッシュを無効にして毎回集計させる")
+    parser.add_argument("--storage", default="csv", choices=["csv", "sqlite", "postgres"], help="保存先（STORAGE_BACKEND。postgres は DATABASE_URL も設定する）")
+    parser.add_argument("--json", default="", help="結果をJSONで保存するパス")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data)
+    json_path = os.path.abspath(args.json) if args.json else ""
+    work = prepare_workdir(data_dir)
+    # GitHub同期は到達しない宛先に向け、計測中に送信しない（終了時の送信も再試行なし）
+    os.environ["GITHUB_API_URL"] = "http://127.0.0.1:9"
+    os.environ["GITHUB_SYNC_DEBOUNCE"] = "3600"
+    os.environ["GITHUB_SYNC_MAX_DELAY"] = "3600"
+    os.environ["GITHUB_SYNC_MAX_RETRIES"] = "0"
+    # リクエストごとの処理区間ログは出さない（区間は Server-Timing ヘッダーに残る）
+    os.environ["REQUEST_TIMING_LOG"] = "0"
+    os.environ["STORAGE_BACKEND"] = args.storage
+    if args.no_cache:
+        os.environ["REPORT_CACHE_MAX_ENTRIES"] = "0"
+    os.chdir(work)
+    sys.path.insert(0, work)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(APP_DIR)
+        shutil.rmtree(work, ignore_errors=True)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果を保存しました: {json_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
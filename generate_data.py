@@ -0,0 +1,189 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# 🧪 ベンチマーク用の合成データ生成（工数・検査工数・一般工事売上）
+# 実データと同じ列構成・文字コードで、件数だけを任意に増やしたCSVを作る。
+# 行は日付順に一定行数ずつ生成して追記するため、1,000万行でもメモリ使用量は一定。
+#
+#   python generate_data.py --out bench_data --kousu-rows 10000000
+
+KOUSU_COLUMNS = ["作業ID", "作業日", "作業実施者", "作業種別", "作業時間"]
+KENSA_COLUMNS = ["作業ID", "作業項目(箇所)", "作業日", "作業実施者", "作業時間"]
+GENERAL_COLUMNS = [
+    "工事見積No.", "明細キー", "作成日", "決定日", "宛名", "建物名", "担当者名", "詳細",
+    "小計", "消費税", "合計", "原価小計", "原価率", "利益率", "管理番号"
+]
+
+# 実データの作業種別の構成比（点検及び検査が約9割）
+WORK_TYPES = ["点検及び検査", "※故障対応※", "リニューアル工事", "改修工事", "調査", "その他", "調整", "下見", "立ち合い"]
+WORK_TYPE_WEIGHTS = [0.89, 0.077, 0.012, 0.011, 0.003, 0.003, 0.002, 0.001, 0.001]
+KENSA_ITEMS = ["法定検査", "カゴ内", "昇降路", "カゴ上", "機械室", "乗場", "社内検査", "ピット"]
+KENSA_ITEM_WEIGHTS = [0.48, 0.115, 0.11, 0.08, 0.06, 0.055, 0.05, 0.05]
+
+SURNAMES = ["平野", "楠本", "山浦", "山口", "森本", "川原", "森", "久保山", "田中", "中村", "松尾", "井上", "福田", "吉田", "前田", "坂本"]
+GIVEN_NAMES = ["司", "敏紀", "友康", "裕介", "健", "拓朗", "勝正", "優翔", "誠", "大輔", "翔太", "亮", "浩二", "直樹", "和也", "修"]
+CLIENT_WORDS = ["医療法人", "株式会社", "有限会社", "社会福祉法人", "管理組合"]
+BUILDING_WORDS = ["病院", "ビル", "マンション", "ホテル", "センター", "会館", "庁舎", "ハイツ"]
+PARTS = ["モータ制御基板", "セメント抵抗器", "ロープ交換", "ブレーキライニング", "ドアスイッチ", "インバータ", "リレー", "乗場ボタン", "かご照明", "非常電源", "調速機", "着床装置"]
+
+
+def people(rng, count, deleted_ratio):
+    # 氏名の組み合わせから担当者を作り、一部を「（削除済み）」にする
+    names = []
+    for i in range(count):
+        name = SURNAMES[i % len(SURNAMES)] + GIVEN_NAMES[(i * 7 + i // len(SURNAMES)) % len(GIVEN_NAMES)]
+        names.append(f"{name}（削除済み）" if rng.random() < deleted_ratio else name)
+    return np.array(names, dtype=object)
+
+
+def client_names(count):
+    return np.array([f"{CLIENT_WORDS[i % len(CLIENT_WORDS)]}{SURNAMES[i % len(SURNAMES)]}{i}" for i in range(max(1, count))], dtype=object)
+
+
+def building_names(count):
+    return np.array([f"{SURNAMES[i % len(SURNAMES)]}{BUILDING_WORDS[i % len(BUILDING_WORDS)]}{i}" for i in range(max(1, count))], dtype=object)
+
+
+def chunk_days(rng, rows, chunk_index, chunk_count, total_days):
+    # 日付順の行を作るため、チャンクごとに期間を等分して昇順に並べる
+    lo = total_days * chunk_index // chunk_count
+    hi = max(lo + 1, total_days * (chunk_index + 1) // chunk_count)
+    return np.sort(rng.integers(lo, hi, size=rows))
+
+
+def format_dates(start, days):
+    return (pd.Timestamp(start) + pd.to_timedelta(days, unit="D")).strftime("%Y/%m/%d")
+
+
+def kousu_chunk(rng, first_id, rows, days, start, workers):
+    # 工数データ（作業ID・作業日・作業実施者・作業種別・作業時間(分)）
+    minutes = np.clip(rng.lognormal(3.8, 0.6, size=rows), 1, 1440).astype(np.int64)
+    return pd.DataFrame({
+        "作業ID": [f"TE-{n:09d}" for n in range(first_id, first_id + rows)],
+        "作業日": format_dates(start, days),
+        "作業実施者": rng.choice(workers, size=rows),
+        "作業種別": rng.choice(WORK_TYPES, size=rows, p=WORK_TYPE_WEIGHTS),
+        "作業時間": minutes
+    }, columns=KOUSU_COLUMNS)
+
+
+def kensa_chunk(rng, kousu, ratio):
+    # 検査工数データ：点検及び検査の作業の一部に、検査項目ごとの時間を付ける（作業ID×項目は一意）
+    inspections = kousu[kousu["作業種別"] == "点検及び検査"]
+    picked = inspections.sample(frac=min(1.0, ratio), random_state=int(rng.integers(1 << 31)))
+    items = rng.choice(KENSA_ITEMS, size=len(picked), p=KENSA_ITEM_WEIGHTS)
+    kensa = pd.DataFrame({
+        "作業ID": picked["作業ID"].to_numpy(),
+        "作業項目(箇所)": items,
+        "作業日": picked["作業日"].to_numpy(),
+        "作業実施者": picked["作業実施者"].to_numpy(),
+        "作業時間": np.clip(rng.normal(52, 25, size=len(picked)), 7, 460).astype(np.int64)
+    }, columns=KENSA_COLUMNS)
+    return kensa.drop_duplicates(subset=["作業ID", "作業項目(箇所)"]).sort_values(["作業日", "作業ID"], kind="stable")
+
+
+def general_chunk(rng, first_no, estimates, days, start, staff, clients, buildings, decided_ratio):
+    # 一般工事売上データ：見積1件に複数の明細行（工事見積No.が明細の数だけ重複する）
+    # 作成日・決定日・担当者・宛名・建物名・金額は見積単位で同じ値、詳細と明細キーだけが行ごとに変わる
+    lines = np.clip(rng.geometric(0.2, size=estimates), 1, 85)
+    subtotal = np.round(rng.lognormal(12.5, 1.2, size=estimates), -2).astype(np.int64)
+    cost_rate = np.round(rng.uniform(0.5, 0.9, size=estimates), 2)
+    decided = rng.random(estimates) < decided_ratio
+    decision_days = days + rng.integers(0, 120, size=estimates)
+    header = pd.DataFrame({
+        "工事見積No.": [f"KM-{n:09d}" for n in range(first_no, first_no + estimates)],
+        "作成日": format_dates(start, days),
+        "決定日": np.where(decided, format_dates(start, decision_days), ""),
+        "宛名": rng.choice(clients, size=estimates),
+        "建物名": rng.choice(buildings, size=estimates),
+        "担当者名": rng.choice(staff, size=estimates),
+        "小計": subtotal,
+        "消費税": subtotal // 10,
+        "合計": subtotal + subtotal // 10,
+        "原価小計": (subtotal * cost_rate).astype(np.int64),
+        "原価率": cost_rate,
+        "利益率": np.round(1 - cost_rate, 2),
+        "管理番号": ""
+    })
+    rows = header.loc[header.index.repeat(lines)].reset_index(drop=True)
+    line_no = rows.groupby("工事見積No.", sort=False).cumcount() + 1
+    rows["明細キー"] = rows["工事見積No."] + "-" + line_no.astype(str)
+    rows["詳細"] = rng.choice(PARTS, size=len(rows))
+    return rows[GENERAL_COLUMNS]
+
+
+def write_chunks(path, encoding, chunks):
+    # 1つのファイルハンドルに追記する（utf-8-sig のBOMは先頭に1回だけ）
+    total = 0
+    with open(path, "w", encoding=encoding, newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, index=False, header=(i == 0))
+            total += len(chunk)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成CSVを生成する")
+    parser.add_argument("--out", default="bench_data")
+    parser.add_argument("--kousu-rows", type=int, default=35000)
+    parser.add_argument("--kensa-ratio", type=float, default=0.2, help="点検及び検査のうち検査工数を持つ割合")
+    parser.add_argument("--general-rows", type=int, default=9500, help="一般工事売上の明細行数（目安）")
+    parser.add_argument("--decided-ratio", type=float, default=0.3)
+    parser.add_argument("--start", default="2023-05-01")
+    parser.add_argument("--months", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=27)
+    parser.add_argument("--staff", type=int, default=24)
+    parser.add_argument("--chunk-rows", type=int, default=500000)
+    parser.add_argument("--kousu-encoding", default="cp932", choices=["cp932", "utf-8-sig"])
+    parser.add_argument("--encoding", default="utf-8-sig", choices=["cp932", "utf-8-sig"], help="検査工数・一般工事売上の文字コード")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    total_days = (pd.Timestamp(args.start) + pd.DateOffset(months=args.months) - pd.Timestamp(args.start)).days
+    workers = people(rng, args.workers, 0.1)
+    staff = people(rng, args.staff, 0.18)
+    estimates = max(1, args.general_rows // 5)
+    clients = client_names(estimates // 3)
+    buildings = building_names(estimates // 2)
+
+    # ▼ 工数・検査工数（同じチャンクから作り、作業IDと日付・作業者を一致させる）
+    kousu_path = os.path.join(args.out, "工数データ.csv")
+    kensa_path = os.path.join(args.out, "検査工数データ.csv")
+    general_path = os.path.join(args.out, "一般工事売上データ.csv")
+    kousu_chunks = max(1, -(-args.kousu_rows // args.chunk_rows))
+    kensa_count = 0
+    with open(kousu_path, "w", encoding=args.kousu_encoding, newline="") as kousu_file, \
+            open(kensa_path, "w", encoding=args.encoding, newline="") as kensa_file:
+        for i in range(kousu_chunks):
+            rows = min(args.chunk_rows, args.kousu_rows - i * args.chunk_rows)
+            days = chunk_days(rng, rows, i, kousu_chunks, total_days)
+            kousu = kousu_chunk(rng, 13 + i * args.chunk_rows, rows, days, args.start, workers)
+            kensa = kensa_chunk(rng, kousu, args.kensa_ratio)
+            kousu.to_csv(kousu_file, index=False, header=(i == 0))
+            kensa.to_csv(kensa_file, index=False, header=(i == 0))
+            kensa_count += len(kensa)
+    print(f"✅ 工数データ: {args.kousu_rows:,}行 → {kousu_path}（{args.kousu_encoding}）")
+    print(f"✅ 検査工数データ: {kensa_count:,}行 → {kensa_path}（{args.encoding}）")
+
+    # ▼ 一般工事売上（見積単位で生成し、明細行に展開）
+    general_chunks = max(1, -(-estimates * 5 // args.chunk_rows))
+
+    def general_iter():
+        per_chunk = -(-estimates // general_chunks)
+        for i in range(general_chunks):
+            count = min(per_chunk, estimates - i * per_chunk)
+            if count <= 0:
+                break
+            days = chunk_days(rng, count, i, general_chunks, total_days)
+            yield general_chunk(rng, 6 + i * per_chunk, count, days, args.start, staff, clients, buildings, args.decided_ratio)
+
+    count = write_chunks(general_path, args.encoding, general_iter())
+    print(f"✅ 一般工事売上データ: {count:,}行（見積{estimates:,}件）→ {general_path}（{args.encoding}）")
+
+
+if __name__ == "__main__":
+    main()
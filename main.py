@@ -1,24 +1,2312 @@
-from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, Form, UploadFile, File, Query
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from typing import List
 import pandas as pd
+import numpy as np
 import os
 import io
 import base64
-import requests
+import hashlib
+import json
+import pickle
+import gzip
+import codecs
+import httpx
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import re
+import time
+import asyncio
+import itertools
+import bisect
+import contextvars
+import threading
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from fastapi.responses import RedirectResponse
 from pathlib import Path
+from urllib.parse import urlencode, parse_qsl
+from email.utils import formatdate
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match
 
 # === 基本設定 ===
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    http_client.client()
+    if sqlite_store is not None:
+        await sqlite_store.start(worker_pool.run)
+    if postgres_store is not None:
+        await postgres_store.start()
+    if STORAGE_BACKEND in ("sqlite", "postgres"):
+        # CSVの取り込み（初回・外での差し替え時）は最初の要求を待たせないよう起動時に済ませる
+        for name in ingest_logs:
+            await worker_pool.run(ingest_logs[name].import_csv)
+    yield
+    # 終了時は未反映のGitHub同期を可能な範囲で送り切ってから接続を閉じる
+    await github_sync.drain()
+    await http_client.aclose()
+    for name in ingest_logs:
+        await worker_pool.run(compact_dataset, name)
+    if postgres_store is not None:
+        await postgres_store.close()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
 CSV_PATH = os.path.join("data", "工数データ.csv")
+KENSA_CSV_PATH = os.path.join("data", "検査工数データ.csv")
+GENERAL_CSV_PATH = os.path.join("data", "一般工事売上データ.csv")
+
+
+# === 応答の圧縮（brotli / gzip） ===
+# 一定サイズ以上のHTML・JSON・JS・CSSは Accept-Encoding に応じて圧縮して返す（br を優先、無ければ gzip）。
+# brotli パッケージが無い環境では gzip のみ。分割送信（ストリーミング）の応答はそのまま流す。
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+def negotiate_encoding(accept_encoding):
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        try:
+            offered[name.strip().lower()] = float(q[2:]) if q.startswith("q=") else 1.0
+        except ValueError:
+            continue
+    for encoding in (["br"] if BROTLI_AVAILABLE else []) + ["gzip"]:
+        if offered.get(encoding, offered.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def should_compress(body, content_type, minimum_size=COMPRESS_MIN_BYTES):
+    return len(body) >= minimum_size and (content_type or "").startswith(COMPRESSIBLE_TYPES)
+
+
+def compress_body(body, encoding):
+    with timed("compress"):
+        if encoding == "br":
+            return brotli.compress(body, quality=5)
+        return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            response_start, start = start, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=response_start["headers"])
+            compressible = (
+                not message.get("more_body", False)
+                and "content-encoding" not in headers
+                and should_compress(body, headers.get("content-type"), self.minimum_size)
+            )
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is not None:
+                    body = compress_body(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    # 表現（符号化）が変わるので強いETagは弱いETagにする（If-None-Match の照合は W/ を無視）
+                    etag = headers.get("etag")
+                    if etag and not etag.startswith("W/"):
+                        headers["ETag"] = f"W/{etag}"
+                    message = {**message, "body": body}
+            await send(response_start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+
+# === 処理区間の計測（Server-Timing・構造化ログ） ===
+# リクエストごとに CSV読込・型変換・派生テーブル作成・絞り込み・集計・描画・圧縮などの所要時間を区間名ごとに積算し、
+# Server-Timing ヘッダーと1行のJSONログ（経路・条件・データ版・行数）で出す。
+# 計測先はコンテキスト変数で持ち、ワーカースレッドにはコンテキストごと引き継ぐ（要求の外から呼ばれた処理は計測しない）。
+REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "1") != "0"
+request_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.fields = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, value):
+        with self._lock:
+            self.fields[name] = self.fields.get(name, 0) + value
+
+    def note(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def header(self):
+        with self._lock:
+            phases = list(self.phases.items())
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases + [("total", self.elapsed())])
+
+
+@contextmanager
+def timed(name):
+    timing = request_timing.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - started)
+
+
+def timing_note(**fields):
+    timing = request_timing.get()
+    if timing is not None:
+        timing.note(**fields)
+
+
+def timing_count(name, value):
+    timing = request_timing.get()
+    if timing is not None:
+        timing.count(name, value)
+
+
+def timed_call(name, func, *args):
+    # ワーカーで実行する処理全体を1区間として測る
+    with timed(name):
+        return func(*args)
+
+
+class TimedTemplates(Jinja2Templates):
+    def TemplateResponse(self, *args, **kwargs):
+        with timed("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+templates = TimedTemplates(directory="templates")
+
+
+def route_path(scope):
+    # 経路はパスの型（/graph/term/result 等）で扱う。どのルートにも一致しなければ None
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial
+
+
+def query_fields(scope):
+    params = {}
+    for key, value in parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True):
+        params.setdefault(key, []).append(value)
+    return {key: values[0] if len(values) == 1 else values for key, values in params.items()}
+
+
+class TimingMiddleware:
+    # 圧縮も含めて測るため、CompressionMiddleware の外側に置く。経路ごとのメトリクス（処理中の数・応答時間）もここで取る
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = request_timing.set(timing)
+        status = None
+        route = route_path(scope)
+        labels = (scope["method"], route or "unmatched")
+        http_in_flight[labels] += 1
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(raw=message["headers"]).append("Server-Timing", timing.header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            request_timing.reset(token)
+            http_in_flight[labels] -= 1
+            http_request_seconds.observe(timing.elapsed(), *labels, str(status or 500))
+            if REQUEST_TIMING_LOG and not scope["path"].startswith("/static/"):
+                record = {
+                    "time": datetime.now().isoformat(timespec="milliseconds"),
+                    "method": scope["method"],
+                    "route": route or scope["path"],
+                    "status": status,
+                    "duration_ms": round(timing.elapsed() * 1000, 1),
+                    "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in timing.phases.items()},
+                    "params": query_fields(scope),
+                    **timing.fields
+                }
+                print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+app.add_middleware(TimingMiddleware)
+
+
+# === メトリクス（Prometheus テキスト形式） ===
+# /metrics で経路ごとの応答時間ヒストグラム・処理中の要求数・取込・GitHub同期・データセット・応答キャッシュの値を返す。
+# 外部ライブラリは使わず、テキスト形式（version 0.0.4）を直接組み立てる。経路のラベルはパスの型（未一致は unmatched）。
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def metric_labels(names, values):
+    escaped = [str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values]
+    parts = [f'{name}="{value}"' for name, value in zip(names, escaped)]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def metric_lines(name, kind, help_text, label_names, samples):
+    # samples: [(ラベル値のタプル, 値)]
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{metric_labels(label_names, values)} {value}" for values, value in samples]
+    return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def lines(self):
+        with self._lock:
+            items = sorted((values, (list(counts), total, count)) for values, (counts, total, count) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        bucket_names = self.label_names + ("le",)
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{metric_labels(bucket_names, values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{metric_labels(bucket_names, values + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{metric_labels(self.label_names, values)} {total}")
+            lines.append(f"{self.name}_count{metric_labels(self.label_names, values)} {count}")
+        return lines
+
+
+http_in_flight = defaultdict(int)
+http_request_seconds = Histogram("kousu_http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"), LATENCY_BUCKETS)
+ingest_rows_per_call = Histogram("kousu_ingest_rows", "Rows stored per /api/receive_* call.", ("dataset",), ROW_BUCKETS)
+ingest_merge_seconds = Histogram("kousu_ingest_merge_duration_seconds", "Time to parse and append one upload to the ingest log.", ("dataset",), LATENCY_BUCKETS)
+dataset_load_seconds = Histogram("kousu_dataset_load_duration_seconds", "Time to read and normalise a dataset (CSV + ingest segments).", ("dataset",), LATENCY_BUCKETS)
+
+
+# === データセットキャッシュ ===
+# CSV（＋取込ログの差分セグメント）はプロセス内で一度だけ読み込み・型変換し、
+# ファイルの更新（mtime/サイズ・セグメント構成）か取込API完了時のみ再読込する。返すDataFrameは全リクエストで共有するため、
+# 呼び出し側で列の追加・変更をしないこと（フィルタ結果に対して行う）。
+# 文字コードはBOMか先頭サンプルで一度だけ判定し、ファイルの版（mtime/サイズ）ごとに記憶する。
+# 取込ログが書くCSVは常にutf-8-sig（BOM付きUTF-8）に揃える。
+SNIFF_BYTES = 64 * 1024
+file_encodings = {}
+
+
+def sniff_encoding(sample):
+    # BOMか先頭サンプルがUTF-8として読めればUTF-8、読めなければcp932（Excel/楽楽精算の出力）
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp932"
+
+
+def detect_file_encoding(path):
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = file_encodings.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, "rb") as f:
+        encoding = sniff_encoding(f.read(SNIFF_BYTES))
+    file_encodings[path] = (signature, encoding)
+    return encoding
+
+
+def read_csv_auto(path):
+    encoding = detect_file_encoding(path)
+    try:
+        return pd.read_csv(path, encoding=encoding)
+    except UnicodeDecodeError:
+        if encoding == "cp932":
+            raise
+        # 先頭サンプルがASCIIだけでUTF-8に見えた場合に限り、cp932で読み直して判定を記憶し直す
+        file_encodings[path] = (file_encodings[path][0], "cp932")
+        return pd.read_csv(path, encoding="cp932")
+
+
+# キャッシュするフレームは主な日付列の昇順（NaTは末尾・同日は元の順）に並べておき、
+# 期間・月の絞り込みは全行の比較ではなく二分探索で連続スライス（コピーなし）を取る。
+def sort_by_date(df, column):
+    return df.sort_values(column, kind="stable", na_position="last", ignore_index=True)
+
+
+def sorted_slice(df, column, low, high):
+    # column の昇順に並んだフレームから low <= 値 <= high の行を返す
+    keys = df[column].to_numpy()
+    lo = keys.searchsorted(np.asarray(low, dtype=keys.dtype), "left")
+    hi = keys.searchsorted(np.asarray(high, dtype=keys.dtype), "right")
+    timing_count("sliced_rows", int(hi - lo))
+    return df.iloc[lo:hi]
+
+
+# 人名・作業種別・顧客名などの文字列列はカテゴリ（辞書符号化）で持ち、比較・絞り込みは整数コードで行う。
+# コード表はカテゴリ値の昇順なので、同じ値の集合なら再読込でも差分反映でも同じコードになる。
+KOUSU_CATEGORY_COLUMNS = ["作業者", "作業種別"]
+
+
+def encode_categories(df, cols):
+    for col in cols:
+        df[col] = df[col].astype("category")
+    return df
+
+
+def align_categories(left, right, cols):
+    # 連結・上書きの前に双方のコード表を和集合（昇順）に揃える。共有フレームは書き換えない
+    for col in cols:
+        categories = left[col].cat.categories.union(right[col].cat.categories)
+        left = left.assign(**{col: left[col].cat.set_categories(categories)})
+        right = right.assign(**{col: right[col].cat.set_categories(categories)})
+    return left, right
+
+
+def category_flags(series, pattern):
+    # カテゴリごとに一度だけ判定し、行へはコードで引く（欠損はFalse）
+    flags = np.append(np.asarray(series.cat.categories.str.contains(pattern), dtype=bool), False)
+    return flags[series.cat.codes.to_numpy()]
+
+
+def normalize_kousu(df):
+    df.columns = [col.strip() for col in df.columns]
+    df = df.rename(columns={"作業日": "日付", "作業実施者": "作業者", "作業時間": "時間"})
+    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
+    df["時間"] = pd.to_numeric(df["時間"], errors="coerce")
+    return sort_by_date(encode_categories(df, KOUSU_CATEGORY_COLUMNS), "日付")
+
+
+def normalize_kensa(df):
+    df.columns = [col.strip() for col in df.columns]
+    df = df.rename(columns={
+        "作業日": "日付",
+        "作業実施者": "作業者",
+        "作業項目(箇所)": "項目",
+        "作業時間": "時間"
+    })
+    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
+    df["時間"] = pd.to_numeric(df["時間"], errors="coerce")
+    return sort_by_date(encode_categories(df, ["作業者", "項目"]), "日付")
+
+
+def normalize_general(df):
+    df.columns = [col.strip() for col in df.columns]
+    df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
+    df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
+    df["小計"] = pd.to_numeric(df["小計"], errors="coerce")
+    return sort_by_date(encode_categories(df, ["担当者名", "宛名", "建物名"]), "作成日")
+
+
+class DatasetEntry:
+    def __init__(self, frame, version, signature, modified):
+        self.frame = frame
+        self.version = version
+        self.signature = signature
+        self.derived = {}
+        self.modified = modified  # 保存先での最終更新時刻（Last-Modified に使う）
+        self._nbytes = None
+
+    def nbytes(self):
+        # メモリ上の大きさ（文字列列は中身まで数えるので重い。版ごとに一度だけ）
+        if self._nbytes is None:
+            self._nbytes = int(self.frame.memory_usage(deep=True).sum())
+        return self._nbytes
+
+
+class DatasetRegistry:
+    def __init__(self):
+        self._specs = {}
+        self._entries = {}
+        self._locks = {}
+        self._versions = itertools.count(1)
+
+    def register(self, name, source, normalizer):
+        self._specs[name] = (source, normalizer)
+        self._locks[name] = threading.Lock()
+
+    def entry(self, name):
+        source, normalizer = self._specs[name]
+        signature = source.signature()
+        entry = self._entries.get(name)
+        if entry is not None and entry.signature == signature:
+            return entry
+        with self._locks[name]:
+            entry = self._entries.get(name)
+            if entry is None or entry.signature != signature:
+                started = time.perf_counter()
+                loaded = source.load()
+                with timed(f"coerce-{name}"):
+                    frame = normalizer(loaded)
+                dataset_load_seconds.observe(time.perf_counter() - started, name)
+                entry = DatasetEntry(frame, next(self._versions), signature, source.modified())
+                # 保存先が読込と同時に作った派生テーブル（サーバー側集計）があれば、そのまま使う
+                preloaded = getattr(source, "preloaded", None)
+                if preloaded is not None:
+                    entry.derived.update(preloaded(frame))
+                self._entries[name] = entry
+            return entry
+
+    def get(self, name):
+        return self.entry(name).frame
+
+    def peek(self, name):
+        # 読込済みの版がファイルと一致していれば返す（stat のみで判定。未読込・更新ありは None）
+        source, _ = self._specs[name]
+        entry = self._entries.get(name)
+        if entry is not None and entry.signature == source.signature():
+            return entry
+        return None
+
+    def replace(self, name, frame, signature, derived=None):
+        # 取込APIが差分反映済みのフレームを直接登録する（ファイル再読込を省く）
+        # 署名は書き込み時に求めたものを使う（登録までの間に外で更新されていれば、次の参照で読み直す）
+        source, _ = self._specs[name]
+        with self._locks[name]:
+            entry = DatasetEntry(frame, next(self._versions), signature, source.modified())
+            entry.derived.update(derived or {})
+            self._entries[name] = entry
+            return entry
+
+    def derived(self, name, key, builder):
+        # データ版ごとに一度だけ作る派生テーブル（集計キューブ等）
+        entry = self.entry(name)
+        value = entry.derived.get(key)
+        if value is None:
+            with self._locks[name]:
+                value = entry.derived.get(key)
+                if value is None:
+                    with timed(f"derive-{key}"):
+                        value = builder(entry.frame)
+                    entry.derived[key] = value
+        return value
+
+    def resign(self, name, previous):
+        # 内容を変えない書き換え（コンパクション）の後は、キャッシュを捨てずに署名だけ付け替える
+        source, _ = self._specs[name]
+        with self._locks[name]:
+            entry = self._entries.get(name)
+            if entry is not None and entry.signature == previous:
+                entry.signature = source.signature()
+
+    def invalidate(self, name):
+        self._entries.pop(name, None)
+
+    def loaded(self):
+        # 読込済みの版（ファイル更新の確認はしない）
+        return dict(self._entries)
+
+
+# === 取込ログ（ベースCSV＋差分セグメント） ===
+# 取込APIはCSV全体を書き直さず、取込分だけを差分セグメントとして追記する（1回の取込＝1セグメント。中身はチャンクを続けて書いたCSV）。
+# セグメントはベースCSVと同じ形式（UTF-8のCSV）で持ち、pandasの版が変わっても同じように読める。
+# 読込時はベースCSVにセグメントを古い順に重ね（取込分の空でない値で上書き・新しいキーは追加）、
+# コンパクションでベースCSVへ畳み込む（GitHubへ送る前・セグメントが溜まった時・終了時）。
+SEGMENT_ROOT = os.path.join("data", "_segments")
+INGEST_COMPACT_SEGMENTS = int(os.getenv("INGEST_COMPACT_SEGMENTS", "16"))
+SEGMENT_SUFFIXES = (".csv", ".pkl")
+
+
+def read_segment(path):
+    # セグメント内のチャンクを書いた順に返す
+    if path.endswith(".csv"):
+        return [pd.read_csv(path, encoding="utf-8")]
+    # 以前の形式（pickle）のセグメント。次のコンパクションでベースCSVへ畳み込まれる
+    frames = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                return frames
+
+
+class IngestLog:
+    def __init__(self, name, path, key_cols, columns):
+        self.name = name
+        self.path = path
+        self.key_cols = key_cols
+        self.columns = columns
+        self.segment_dir = os.path.join(SEGMENT_ROOT, name)
+
+    def segments(self):
+        try:
+            names = os.listdir(self.segment_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if n.endswith(SEGMENT_SUFFIXES))
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+            base = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            base = None
+        return (base, tuple(self.segments()))
+
+    def modified(self):
+        # ベースCSV・セグメントのうち最も新しい更新時刻
+        times = []
+        for path in [self.path] + [os.path.join(self.segment_dir, n) for n in self.segments()]:
+            try:
+                times.append(os.path.getmtime(path))
+            except FileNotFoundError:
+                pass
+        return max(times, default=time.time())
+
+    def read_base(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return pd.DataFrame(columns=self.columns)
+        with timed(f"csv-{self.name}"):
+            df = read_csv_auto(self.path)
+        df.columns = [col.strip().replace("（", "(").replace("）", ")") for col in df.columns]
+        return df[[col for col in df.columns if col in self.columns]].reindex(columns=self.columns)
+
+    def _fold(self, base, segments):
+        if not segments:
+            return base
+        with timed(f"fold-{self.name}"):
+            deltas = [delta for n in segments for delta in read_segment(os.path.join(self.segment_dir, n))]
+            # 同じキーが複数セグメントにあれば、列ごとに最後の空でない値を採る（順に上書きしたのと同じ）
+            delta = pd.concat(deltas, ignore_index=True).reindex(columns=self.columns).groupby(self.key_cols, sort=False, dropna=False).last()
+            merged = base.drop_duplicates(subset=self.key_cols, keep="last").set_index(self.key_cols).combine_first(delta)
+            merged.update(delta)
+            return merged.reset_index()
+
+    def load(self):
+        while True:
+            segments = self.segments()
+            base = self.read_base()
+            try:
+                return self._fold(base, segments)
+            except FileNotFoundError:
+                # 読込中にコンパクションでセグメントが消えた場合は読み直す
+                continue
+
+    def append(self, deltas):
+        # 取込分（チャンクの並び）を次の番号のセグメントとして書き出す（呼び出し側で取込ロックを取ること）
+        # 全チャンクを一時ファイルに書き終えてから置き換えるため、途中で失敗すれば何も反映しない
+        # 戻り値は (書き込む前の署名, この書き込みだけを足した署名)。何も書かなければ None
+        os.makedirs(self.segment_dir, exist_ok=True)
+        previous = self.signature()
+        segments = list(previous[1])
+        seq = int(segments[-1].split(".")[0]) + 1 if segments else 1
+        path = os.path.join(self.segment_dir, f"{seq:010d}.csv")
+        tmp_path = f"{path}.tmp"
+        written = 0
+        try:
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                for delta in deltas:
+                    with timed("append"):
+                        delta.to_csv(f, header=not written, index=False)
+                    written += 1
+                with timed("append"):
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if not written:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+        return previous, (previous[0], previous[1] + (os.path.basename(path),))
+
+    def needs_rewrite(self):
+        # cp932の書き出しを直接置いた場合など、ベースCSVがutf-8-sigでなければ書き直す
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        return detect_file_encoding(self.path) != "utf-8-sig"
+
+    def compact(self):
+        # セグメントをベースCSVへ畳み込み、畳み込んだセグメントを消す（呼び出し側で取込ロックを取ること）
+        segments = self.segments()
+        if not segments and not self.needs_rewrite():
+            return False
+        write_csv_durable(self._fold(self.read_base(), segments), self.path)
+        for n in segments:
+            os.remove(os.path.join(self.segment_dir, n))
+        return True
+
+
+# === 保存先（CSV取込ログ / SQLite） ===
+# STORAGE_BACKEND=sqlite の場合は SQLite ファイルを正本にし、取込は UPSERT（取込分の空でない値で上書き・新しいキーは追加）で反映する。
+# CSVは取込・書き出しの形式として残す：起動時やCSVが外から差し替えられた時はCSVの内容を UPSERT で取り込み、
+# GitHubへ送る前・終了時はテーブルをCSVへ書き出す（GitHub同期・update_csv.py はこれまで通りCSVを扱う）。
+# 工数キューブ・見積ヘッダーは読込と同じスナップショットでSQLで集計し、読み込んだフレームに合わせて仕上げる（SQLITE_AGGREGATES）。
+# 明細を返す画面（見積の詳細・一覧）はこれまで通り読み込んだフレームから引く。
+# STORAGE_BACKEND=postgres は複数台構成向け（下の PostgreSQL の節）。
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "csv")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join("data", "kousu.sqlite3"))
+
+DATASET_SCHEMAS = {
+    "kousu": {
+        "path": CSV_PATH,
+        "keys": ["作業ID"],
+        "columns": ["作業ID", "作業日", "作業実施者", "作業種別", "作業時間"],
+        "dates": ["作業日"],
+        "numbers": ["作業時間"],
+        "indexes": [["作業日"], ["作業実施者", "作業日"]]
+    },
+    "kensa": {
+        "path": KENSA_CSV_PATH,
+        "keys": ["作業ID", "作業項目(箇所)"],
+        "columns": ["作業ID", "作業項目(箇所)", "作業日", "作業実施者", "作業時間"],
+        "dates": ["作業日"],
+        "numbers": ["作業時間"],
+        "indexes": [["作業日"], ["作業実施者", "作業日"]]
+    },
+    "general": {
+        "path": GENERAL_CSV_PATH,
+        "keys": ["工事見積No.", "明細キー"],
+        "columns": [
+            "工事見積No.", "明細キー", "作成日", "決定日", "宛名", "建物名", "担当者名", "詳細",
+            "小計", "消費税", "合計", "原価小計", "原価率", "利益率", "管理番号"
+        ],
+        "dates": ["作成日", "決定日"],
+        "numbers": ["小計", "消費税", "合計", "原価小計", "原価率", "利益率"],
+        "indexes": [["作成日"], ["決定日"], ["担当者名", "作成日"]]
+    }
+}
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteStore:
+    # スレッドごとに接続を持つ（WAL：読み込みは書き込み中も待たない）
+    # 版は手元に持ち、自分の書き込みで進める。他の接続（別のスレッド・別のプロセス）のコミットは
+    # PRAGMA data_version で検知し、変わった時だけ store_state を読み直す（signature() のたびに確認するので取りこぼさない）
+    def __init__(self, path):
+        self.path = path
+        self.versions = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self._create(conn)
+                    self._ready = True
+        return conn
+
+    def _create(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS store_state (
+            name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, exported_version INTEGER NOT NULL DEFAULT 0, csv_signature TEXT, modified_at REAL)""")
+        if "modified_at" not in [row[1] for row in conn.execute("PRAGMA table_info(store_state)")]:
+            conn.execute("ALTER TABLE store_state ADD COLUMN modified_at REAL")
+        for name, schema in DATASET_SCHEMAS.items():
+            columns = ", ".join(
+                f"{quote_ident(col)} {'NUMERIC' if col in schema['numbers'] else 'TEXT'}" for col in schema["columns"]
+            )
+            keys = ", ".join(quote_ident(col) for col in schema["keys"])
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns}, UNIQUE ({keys}))")
+            for cols in schema["indexes"]:
+                index = f"{name}_" + "_".join(cols)
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_ident(index)} ON {name} ({', '.join(quote_ident(c) for c in cols)})")
+            conn.execute("INSERT OR IGNORE INTO store_state (name) VALUES (?)", (name,))
+        # 作ったばかり・列を足したばかりの表は今を最終更新時刻にしておく（以後は書き込みのたびに更新）
+        conn.execute("UPDATE store_state SET modified_at = ? WHERE modified_at IS NULL", (time.time(),))
+
+    def state(self, name):
+        row = self.connect().execute("SELECT version, exported_version, csv_signature FROM store_state WHERE name = ?", (name,)).fetchone()
+        self.saw_version(name, row[0])
+        return {"version": row[0], "exported_version": row[1], "csv_signature": row[2]}
+
+    def refresh(self):
+        for name, version in self.connect().execute("SELECT name, version FROM store_state"):
+            self.saw_version(name, version)
+
+    def check(self):
+        # data_version は共有メモリ（WALの索引）を見るだけで読み込みを伴わないため、イベントループ上で呼んでもよい
+        conn = self.connect()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != getattr(self._local, "data_version", None):
+            self._local.data_version = data_version
+            self.refresh()
+
+    def saw_version(self, name, version):
+        # 版は増える一方なので、読み直し・自分の書き込みのうち大きい方を採る
+        self.versions[name] = max(self.versions.get(name, 0), version)
+
+    async def start(self, run):
+        # テーブル作成と版の読み込みはワーカーで済ませてから受付を始める
+        await run(self.refresh)
+
+
+class SqliteTable:
+    # IngestLog と同じ口（signature / load / append / compact）で、SQLiteのテーブルを正本にする
+    # aggregates にはSQLで集計する派生テーブル（名前 → (SQL, 仕上げ関数)）を持つ（PostgresTable と同じ）
+    def __init__(self, name, store, csv_log, aggregates=None):
+        schema = DATASET_SCHEMAS[name]
+        self.name = name
+        self.store = store
+        self.csv = csv_log
+        self.path = csv_log.path
+        self.key_cols = schema["keys"]
+        self.columns = schema["columns"]
+        self.dates = schema["dates"]
+        self.numbers = schema["numbers"]
+        self.aggregates = aggregates or {}
+        self._csv_lock = threading.Lock()
+        self._preloaded = {}
+        cols = ", ".join(quote_ident(col) for col in self.columns)
+        updates = ", ".join(
+            f"{quote_ident(col)} = COALESCE(excluded.{quote_ident(col)}, {name}.{quote_ident(col)})"
+            for col in self.columns if col not in self.key_cols
+        )
+        self._select = f"SELECT {cols} FROM {name} ORDER BY rowid"
+        self._upsert = (
+            f"INSERT INTO {name} ({cols}) VALUES ({', '.join('?' for _ in self.columns)}) "
+            f"ON CONFLICT ({', '.join(quote_ident(col) for col in self.key_cols)}) DO UPDATE SET {updates}"
+        )
+
+    def read_table(self, conn):
+        frame = pd.read_sql_query(self._select, conn)
+        for col in self.key_cols:
+            frame[col] = frame[col].mask(frame[col] == "")
+        return frame
+
+    def segments(self):
+        return []
+
+    def csv_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    def signature(self):
+        self.store.check()
+        return (self.store.versions.get(self.name, 0), self.csv_signature())
+
+    def modified(self):
+        # 最後に書き込んだ時刻（どの台の書き込みでも同じ値）
+        return self.store.connect().execute("SELECT modified_at FROM store_state WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def rows(self, delta):
+        # 型を揃えてから渡す（日付はISO形式の文字列、数値は数値、欠損はNULL）
+        # キー列の欠損（明細の無い見積など）はNULL同士が一意制約で別扱いになるため空文字で持つ
+        delta = delta.reindex(columns=self.columns)
+        values = {}
+        for col in self.columns:
+            series = delta[col]
+            if col in self.key_cols:
+                series = series.astype(object).where(series.notna(), "")
+            elif col in self.dates:
+                series = pd.to_datetime(series, errors="coerce").dt.strftime("%Y-%m-%d")
+            elif col in self.numbers:
+                series = pd.to_numeric(series, errors="coerce")
+            values[col] = series.astype(object).where(series.notna(), None)
+        return list(zip(*(values[col] for col in self.columns)))
+
+    def _write(self, chunks, state_sql, params=(), skip_empty=False):
+        # チャンクごとの行をまとめて1トランザクションで反映する（skip_empty なら行が無い時は版を進めない）
+        conn = self.store.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            written = 0
+            for rows in chunks:
+                with timed("append"):
+                    conn.executemany(self._upsert, rows)
+                written += len(rows)
+            if skip_empty and not written:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute("UPDATE store_state SET modified_at = ? WHERE name = ?", (time.time(), self.name))
+            version = conn.execute(state_sql + " RETURNING version", params + (self.name,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.store.saw_version(self.name, version)
+        return version
+
+    def append(self, deltas):
+        # 取込分の全チャンクをUPSERTし、版を1つ進める（1回の取込＝1トランザクション）
+        # 戻り値は IngestLog.append と同じ（版は書き込みで進めた値から求める）
+        csv_signature = self.csv_signature()
+        version = self._write((self.rows(delta) for delta in deltas), "UPDATE store_state SET version = version + 1 WHERE name = ?", skip_empty=True)
+        if version is None:
+            return None
+        return (version - 1, csv_signature), (version, csv_signature)
+
+    def import_csv(self):
+        # CSV（＋CSV運用時の差分セグメント）が前回の取込・書き出しから変わっていれば、その内容をUPSERTで取り込む
+        with self._csv_lock:
+            if self.csv.segments() or self.csv.needs_rewrite():
+                self.csv.compact()
+            signature = self.csv_signature()
+            if signature == self.store.state(self.name)["csv_signature"]:
+                return False
+            frame = self.csv.read_base()
+            # 取り込む前にテーブルとCSVが一致していた（書き出し済みだった）なら、取込後も一致している
+            self._write([self.rows(frame)], """UPDATE store_state SET version = version + 1, csv_signature = ?,
+                exported_version = CASE WHEN exported_version = version THEN version + 1 ELSE exported_version END WHERE name = ?""", (signature,))
+            return True
+
+    def load(self):
+        self.import_csv()
+        with timed(f"sql-{self.name}"):
+            conn = self.store.connect()
+            # 行と集計を同じスナップショットで読む（読み取りトランザクションの間は他の書き込みが見えない）
+            conn.execute("BEGIN")
+            try:
+                frame = self.read_table(conn)
+                self._preloaded = {key: pd.read_sql_query(sql, conn) for key, (sql, _) in self.aggregates.items()}
+            finally:
+                conn.execute("COMMIT")
+            return frame
+
+    def preloaded(self, frame):
+        # load() と同じスナップショットでSQLで集計した派生テーブルを、読み込んだフレームに合わせて仕上げる
+        aggregates, self._preloaded = self._preloaded, {}
+        return {key: self.aggregates[key][1](cells, frame) for key, cells in aggregates.items() if not cells.empty}
+
+    def needs_rewrite(self):
+        return False
+
+    def compact(self):
+        # テーブルをCSVへ書き出す（前回の書き出し以降に変更があった場合のみ。日付は元データと同じ yyyy/mm/dd）
+        with self._csv_lock:
+            state = self.store.state(self.name)
+            if state["version"] == state["exported_version"] and state["csv_signature"] == self.csv_signature():
+                return False
+            conn = self.store.connect()
+            frame = self.read_table(conn)
+            for col in self.dates:
+                frame[col] = pd.to_datetime(frame[col], errors="coerce").dt.strftime("%Y/%m/%d")
+            write_csv_durable(frame, self.path)
+            conn.execute(
+                "UPDATE store_state SET exported_version = ?, csv_signature = ? WHERE name = ?",
+                (state["version"], self.csv_signature(), self.name)
+            )
+            return True
+
+
+# --- PostgreSQL（asyncpg） ---
+# 複数台のアプリで1つのデータを共有する。接続はイベントループ上の接続プールを使い、ワーカーからはループへ処理を渡して待つ。
+# 取込は一時テーブルへ COPY してから UPSERT、読込は COPY ... TO STDOUT（CSV）をそのまま read_csv する。
+# 版は store_state に持ち、更新は NOTIFY で他の台へ知らせる（取りこぼしに備えて定期的にも読み直す）。
+# 版の判定（signature）は通知で更新した手元の値を返すだけなので、イベントループ上で呼ばれても問い合わせはしない。
+# CSVは空のテーブルの初期投入・update_csv.py で差し替えたCSVの取り込み・GitHub向けの書き出しに使う。
+# 一度取り込んだ／書き出したCSVの内容（SHA-1）は記録しておき、古いCSVを持つ台が後から起動しても取り込み直さない。
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+PG_VERSION_POLL = float(os.getenv("PG_VERSION_POLL", "5"))
+PG_NOTIFY_CHANNEL = "kousu_store"
+
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def restore_integers(frame, cols):
+    # 数値列は double precision で持つため、欠損が無く全て整数なら read_csv と同じく整数列に戻す
+    for col in cols:
+        values = frame[col]
+        if values.notna().all() and (values % 1 == 0).all():
+            frame[col] = values.astype("int64")
+    return frame
+
+
+class PostgresStore:
+    def __init__(self, dsn, min_size, max_size):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.loop = None
+        self.pool = None
+        self.versions = {}
+        self.notifications = 0
+        self._listener = None
+        self._poller = None
+
+    async def start(self):
+        if not ASYNCPG_AVAILABLE:
+            raise RuntimeError("STORAGE_BACKEND=postgres には asyncpg が必要です（pip install asyncpg）")
+        if not self.dsn:
+            raise RuntimeError("STORAGE_BACKEND=postgres には DATABASE_URL の設定が必要です")
+        self.loop = asyncio.get_running_loop()
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # 複数台が同時に起動してもテーブル作成がぶつからないようにする
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('kousu_store_schema'))")
+                await self._create(conn)
+        await self._refresh()
+        await self._listen()
+        self._poller = self.loop.create_task(self._poll())
+
+    async def _create(self, conn):
+        await conn.execute("CREATE TABLE IF NOT EXISTS store_state (name TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0)")
+        await conn.execute("ALTER TABLE store_state ADD COLUMN IF NOT EXISTS modified_at TIMESTAMPTZ NOT NULL DEFAULT now()")
+        await conn.execute("CREATE TABLE IF NOT EXISTS store_csv_seen (name TEXT NOT NULL, sha1 TEXT NOT NULL, PRIMARY KEY (name, sha1))")
+        for name, schema in DATASET_SCHEMAS.items():
+            columns = ", ".join(
+                f"{quote_ident(col)} " + (
+                    "TEXT NOT NULL" if col in schema["keys"] else
+                    "DATE" if col in schema["dates"] else
+                    "DOUBLE PRECISION" if col in schema["numbers"] else "TEXT"
+                )
+                for col in schema["columns"]
+            )
+            keys = ", ".join(quote_ident(col) for col in schema["keys"])
+            await conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (_seq BIGSERIAL, {columns}, UNIQUE ({keys}))")
+            for cols in schema["indexes"]:
+                index = f"{name}_" + "_".join(cols)
+                await conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_ident(index)} ON {name} ({', '.join(quote_ident(c) for c in cols)})")
+            await conn.execute("INSERT INTO store_state (name) VALUES ($1) ON CONFLICT DO NOTHING", name)
+
+    async def _refresh(self):
+        async with self.pool.acquire() as conn:
+            for row in await conn.fetch("SELECT name, version FROM store_state"):
+                self.saw_version(row["name"], row["version"])
+
+    async def _listen(self):
+        self._listener = await asyncpg.connect(self.dsn)
+        await self._listener.add_listener(PG_NOTIFY_CHANNEL, self._notified)
+
+    def _notified(self, connection, pid, channel, payload):
+        name, _, version = payload.partition(":")
+        self.notifications += 1
+        self.saw_version(name, int(version))
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(PG_VERSION_POLL)
+            try:
+                if self._listener is None or self._listener.is_closed():
+                    await self._listen()
+                await self._refresh()
+            except Exception as e:
+                print(f"⚠️ PostgreSQLの版の確認に失敗しました: {e}")
+
+    def saw_version(self, name, version):
+        # 版は増える一方なので、通知・読み直し・自分の書き込みのうち大きい方を採る
+        self.versions[name] = max(self.versions.get(name, 0), version)
+
+    def call(self, coro_fn, *args):
+        # ワーカースレッドから、イベントループ上の接続プールで処理して結果を待つ
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            raise RuntimeError("PostgreSQLへの同期呼び出しはワーカーから行うこと")
+        return asyncio.run_coroutine_threadsafe(coro_fn(*args), self.loop).result()
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+        if self.pool is not None:
+            await self.pool.close()
+
+    def stats(self):
+        return {
+            "pool_size": self.pool.get_size() if self.pool else 0,
+            "pool_idle": self.pool.get_idle_size() if self.pool else 0,
+            "pool_max_size": self.max_size,
+            "listening": self._listener is not None and not self._listener.is_closed(),
+            "notifications": self.notifications,
+            "versions": dict(self.versions)
+        }
+
+
+class PostgresTable:
+    # SqliteTable と同じ口。aggregates にはサーバー側で集計する派生テーブル（名前 → (SQL, 仕上げ関数)）を持つ
+    def __init__(self, name, store, csv_log, aggregates=None):
+        schema = DATASET_SCHEMAS[name]
+        self.name = name
+        self.store = store
+        self.csv = csv_log
+        self.path = csv_log.path
+        self.key_cols = schema["keys"]
+        self.columns = schema["columns"]
+        self.dates = schema["dates"]
+        self.numbers = schema["numbers"]
+        self.aggregates = aggregates or {}
+        self._csv_lock = threading.Lock()
+        self._checked_csv = None
+        self._exported = None
+        self._preloaded = {}
+        cols = ", ".join(quote_ident(col) for col in self.columns)
+        updates = ", ".join(
+            f"{quote_ident(col)} = COALESCE(EXCLUDED.{quote_ident(col)}, {name}.{quote_ident(col)})"
+            for col in self.columns if col not in self.key_cols
+        )
+        self._stage = f"{name}_staging"
+        self._select = f"SELECT {cols} FROM {name} ORDER BY _seq"
+        self._create_stage = f"CREATE TEMP TABLE {self._stage} ON COMMIT DROP AS SELECT 0::bigint AS _n, {cols} FROM {name} WITH NO DATA"
+        self._merge = (
+            f"INSERT INTO {name} ({cols}) SELECT {cols} FROM {self._stage} ORDER BY _n "
+            f"ON CONFLICT ({', '.join(quote_ident(col) for col in self.key_cols)}) DO UPDATE SET {updates}"
+        )
+
+    def segments(self):
+        return []
+
+    def needs_rewrite(self):
+        return False
+
+    def csv_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    def signature(self):
+        return (self.store.versions.get(self.name, 0), self.csv_signature())
+
+    async def _modified(self):
+        async with self.store.pool.acquire() as conn:
+            return await conn.fetchval("SELECT extract(epoch FROM modified_at)::double precision FROM store_state WHERE name = $1", self.name)
+
+    def modified(self):
+        # 最後に書き込んだ時刻（どの台の書き込みでも同じ値）
+        return self.store.call(self._modified)
+
+    def records(self, delta):
+        # COPY（バイナリ）に渡す行。キー列の欠損は空文字、同じキーは最後の行を採る（_n は元の並び）
+        delta = delta.reindex(columns=self.columns)
+        for col in self.key_cols:
+            delta[col] = delta[col].astype(object).where(delta[col].notna(), "").map(str)
+        delta = delta.drop_duplicates(subset=self.key_cols, keep="last")
+        values = []
+        for col in self.columns:
+            series = delta[col]
+            if col in self.dates:
+                series = pd.Series(pd.to_datetime(series, errors="coerce").dt.date, index=delta.index)
+            elif col in self.numbers:
+                series = pd.to_numeric(series, errors="coerce").astype(float)
+            elif col not in self.key_cols:
+                series = series.astype(object).where(series.isna(), series.astype(str))
+            values.append(series.astype(object).where(series.notna(), None))
+        return [(i,) + row for i, row in enumerate(zip(*values))]
+
+    async def _begin(self):
+        conn = await self.store.pool.acquire()
+        transaction = conn.transaction()
+        try:
+            await transaction.start()
+            await conn.execute(self._create_stage)
+        except BaseException:
+            await self.store.pool.release(conn)
+            raise
+        return conn, transaction
+
+    async def _upsert(self, conn, records):
+        # 一時テーブルへCOPYしてからUPSERTする（チャンクごとに空にして、同じキーが別のチャンクにあっても順に上書きする）
+        await conn.copy_records_to_table(self._stage, records=records, columns=["_n"] + self.columns)
+        await conn.execute(self._merge)
+        await conn.execute(f"TRUNCATE {self._stage}")
+
+    async def _commit(self, conn, transaction, digest):
+        if digest is not None:
+            await conn.execute("INSERT INTO store_csv_seen (name, sha1) VALUES ($1, $2) ON CONFLICT DO NOTHING", self.name, digest)
+        version = await conn.fetchval("UPDATE store_state SET version = version + 1, modified_at = now() WHERE name = $1 RETURNING version", self.name)
+        await conn.execute("SELECT pg_notify($1, $2)", PG_NOTIFY_CHANNEL, f"{self.name}:{version}")
+        await transaction.commit()
+        return version
+
+    async def _release(self, conn, transaction, committed):
+        # コミットしていなければロールバックしてから接続を返す
+        try:
+            if not committed:
+                await transaction.rollback()
+        except asyncpg.InterfaceError:
+            pass  # コミット自体に失敗した後など（接続を返す時に片付く）
+        finally:
+            await self.store.pool.release(conn)
+
+    def _write(self, chunks, digest=None, skip_empty=False):
+        # 1回の取込の全チャンクを1トランザクションで反映し、版を1つ進めて通知する（途中で失敗すれば何も反映しない）
+        # チャンクの読み込みはワーカーで行い、その間この取込が接続を1つ持つ
+        conn, transaction = self.store.call(self._begin)
+        version = None
+        try:
+            written = 0
+            for records in chunks:
+                with timed("append"):
+                    self.store.call(self._upsert, conn, records)
+                written += len(records)
+            if written or not skip_empty:
+                version = self.store.call(self._commit, conn, transaction, digest)
+        finally:
+            self.store.call(self._release, conn, transaction, version is not None)
+        if version is not None:
+            self.store.saw_version(self.name, version)
+        return version
+
+    def append(self, deltas):
+        # 戻り値は IngestLog.append と同じ。手元の版は通知待ちで古いことがあるため、書き込みで進めた版から求める
+        csv_signature = self.csv_signature()
+        version = self._write((self.records(delta) for delta in deltas), skip_empty=True)
+        if version is None:
+            return None
+        return (version - 1, csv_signature), (version, csv_signature)
+
+    async def _seen(self, digest):
+        async with self.store.pool.acquire() as conn:
+            return await conn.fetchval("SELECT 1 FROM store_csv_seen WHERE name = $1 AND sha1 = $2", self.name, digest) is not None
+
+    async def _mark_seen(self, digest):
+        async with self.store.pool.acquire() as conn:
+            await conn.execute("INSERT INTO store_csv_seen (name, sha1) VALUES ($1, $2) ON CONFLICT DO NOTHING", self.name, digest)
+
+    def import_csv(self):
+        # まだ取り込んでも書き出してもいない内容のCSVであれば、UPSERTで取り込む
+        with self._csv_lock:
+            if self.csv.segments() or self.csv.needs_rewrite():
+                self.csv.compact()
+            signature = self.csv_signature()
+            if signature is None or signature == self._checked_csv:
+                return False
+            digest = file_sha1(self.path)
+            imported = False
+            if not self.store.call(self._seen, digest):
+                self._write([self.records(self.csv.read_base())], digest)
+                imported = True
+            self._checked_csv = signature
+            return imported
+
+    async def _read(self, with_aggregates):
+        # 行と版（と集計）を同じスナップショットで読む
+        buf = io.BytesIO()
+        async with self.store.pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                version = await conn.fetchval("SELECT version FROM store_state WHERE name = $1", self.name)
+                await conn.copy_from_query(self._select, output=buf, format="csv", header=True)
+                aggregates = {}
+                if with_aggregates:
+                    for key, (sql, _) in self.aggregates.items():
+                        rows = await conn.fetch(sql)
+                        aggregates[key] = pd.DataFrame([dict(row) for row in rows], columns=list(rows[0].keys()) if rows else None)
+        buf.seek(0)
+        frame = pd.read_csv(buf, encoding="utf-8")
+        return restore_integers(frame, self.numbers), version, aggregates
+
+    def load(self):
+        self.import_csv()
+        with timed(f"sql-{self.name}"):
+            frame, version, self._preloaded = self.store.call(self._read, True)
+        self.store.saw_version(self.name, version)
+        return frame
+
+    def preloaded(self, frame):
+        # load() と同じスナップショットでサーバー側集計した派生テーブルを、読み込んだフレームに合わせて仕上げる
+        aggregates, self._preloaded = self._preloaded, {}
+        return {key: self.aggregates[key][1](cells, frame) for key, cells in aggregates.items() if not cells.empty}
+
+    def compact(self):
+        # テーブルをCSVへ書き出す（この台で前回書き出してから版が進んだ場合のみ）
+        with self._csv_lock:
+            version = self.store.versions.get(self.name, 0)
+            if self._exported == (version, self.csv_signature()):
+                return False
+            frame, version, _ = self.store.call(self._read, False)
+            for col in self.dates:
+                frame[col] = pd.to_datetime(frame[col], errors="coerce").dt.strftime("%Y/%m/%d")
+            write_csv_durable(frame, self.path)
+            self.store.call(self._mark_seen, file_sha1(self.path))
+            self._checked_csv = self.csv_signature()
+            self._exported = (version, self._checked_csv)
+            return True
+
+
+# 工数キューブ（年月×作業者×作業種別）と見積ヘッダーは保存先のSQLで集計する
+# （仕上げは工数キューブの節の finish_kousu_cells、見積の節の finish_estimate_headers）。
+# 見積ヘッダーは値そのものではなく、読み込んだフレーム（作成日順・同日は保存順）での行番号を返す：
+# 見積ごとの先頭の行と、列ごとに最後の非空値を持つ行（build_estimate_tables の groupby.last と同じ選び方）。
+ESTIMATE_HEADER_COLUMNS = ["作成日", "決定日", "担当者名", "建物名", "小計"]
+KOUSU_CUBE_FILTER = """WHERE "作業日" IS NOT NULL AND "作業実施者" IS NOT NULL AND "作業種別" IS NOT NULL AND "作業時間" IS NOT NULL"""
+ESTIMATE_HEADER_SQL = """SELECT MIN(pos) - 1 AS "行", """ + ", ".join(
+    f"""MAX(CASE WHEN {quote_ident(col)} IS NOT NULL THEN pos END) - 1 AS {quote_ident(col)}"""
+    for col in ESTIMATE_HEADER_COLUMNS
+) + """
+    FROM (SELECT *, ROW_NUMBER() OVER (ORDER BY "作成日" IS NULL, "作成日", {order}) AS pos FROM general) AS ordered
+    GROUP BY NULLIF("工事見積No.", '')
+    ORDER BY MIN(pos)"""
+
+SQLITE_AGGREGATES = {
+    "kousu": {
+        "cube": (
+            """SELECT CAST(substr("作業日", 1, 4) AS INTEGER) * 12 + CAST(substr("作業日", 6, 2) AS INTEGER) - 1 AS "年月",
+                      "作業実施者" AS "作業者", "作業種別", SUM("作業時間") AS "時間合計", COUNT(*) AS "件数"
+               FROM kousu """ + KOUSU_CUBE_FILTER + """
+               GROUP BY 1, 2, 3""",
+            lambda cells, frame: finish_kousu_cells(cells, frame)
+        )
+    },
+    "general": {
+        "estimates": (ESTIMATE_HEADER_SQL.format(order="rowid"), lambda cells, frame: finish_estimate_headers(cells, frame))
+    }
+}
+
+POSTGRES_AGGREGATES = {
+    "kousu": {
+        "cube": (
+            """SELECT (EXTRACT(YEAR FROM "作業日")::int * 12 + EXTRACT(MONTH FROM "作業日")::int - 1)::bigint AS "年月",
+                      "作業実施者" AS "作業者", "作業種別", SUM("作業時間") AS "時間合計", COUNT(*) AS "件数"
+               FROM kousu """ + KOUSU_CUBE_FILTER + """
+               GROUP BY 1, 2, 3""",
+            lambda cells, frame: finish_kousu_cells(cells, frame)
+        )
+    },
+    "general": {
+        "estimates": (ESTIMATE_HEADER_SQL.format(order="_seq"), lambda cells, frame: finish_estimate_headers(cells, frame))
+    }
+}
+
+
+csv_logs = {
+    name: IngestLog(name, schema["path"], schema["keys"], schema["columns"])
+    for name, schema in DATASET_SCHEMAS.items()
+}
+sqlite_store = None
+postgres_store = None
+if STORAGE_BACKEND == "sqlite":
+    sqlite_store = SqliteStore(SQLITE_PATH)
+    ingest_logs = {name: SqliteTable(name, sqlite_store, log, SQLITE_AGGREGATES.get(name)) for name, log in csv_logs.items()}
+elif STORAGE_BACKEND == "postgres":
+    postgres_store = PostgresStore(DATABASE_URL, PG_POOL_MIN_SIZE, PG_POOL_MAX_SIZE)
+    ingest_logs = {name: PostgresTable(name, postgres_store, log, POSTGRES_AGGREGATES.get(name)) for name, log in csv_logs.items()}
+else:
+    ingest_logs = csv_logs
+
+dataset_cache = DatasetRegistry()
+dataset_cache.register("kousu", ingest_logs["kousu"], normalize_kousu)
+dataset_cache.register("kensa", ingest_logs["kensa"], normalize_kensa)
+dataset_cache.register("general", ingest_logs["general"], normalize_general)
+
+
+# === 会計期カレンダー（5月始まり・4月締め） ===
+# 年月は整数の月キー（年*12+月-1）、期は期首の年（2024 → 2024年5月～2025年4月）で持つ。
+# 「2024-06」「2024年5月～2025年4月」といった表示用の文字列は描画直前にだけ作る。
+FISCAL_START_MONTH = 5
+
+
+def month_key(year, month):
+    return year * 12 + month - 1
+
+
+def month_keys(dates):
+    # 日付列 → 月キー列（NaTは事前に除いておくこと）
+    return dates.dt.year * 12 + dates.dt.month - 1
+
+
+def fiscal_terms(keys):
+    # 月キー（列・配列・整数）→ 期
+    return (keys - (FISCAL_START_MONTH - 1)) // 12
+
+
+def date_terms(dates):
+    return fiscal_terms(month_keys(dates))
+
+
+def term_label(term):
+    return f"{term}年{FISCAL_START_MONTH}月～{term + 1}年{FISCAL_START_MONTH - 1}月"
+
+
+def parse_term_label(label):
+    # 「2024年5月～2025年4月」→ 2024。表記が一致しなければNone（どの期にも一致しない）
+    m = re.match(r"(\d{4})年", label or "")
+    if m and term_label(int(m.group(1))) == label:
+        return int(m.group(1))
+    return None
+
+
+def term_months(term):
+    # 期 → (期首, 期末) の月キー
+    first = month_key(term, FISCAL_START_MONTH)
+    return first, first + 11
+
+
+def month_dates(first_key, last_key):
+    # 月キーの範囲 → (初日, 末日) の日付
+    start = pd.Timestamp(first_key // 12, first_key % 12 + 1, 1)
+    return start, pd.Timestamp(last_key // 12, last_key % 12 + 1, 1) + pd.offsets.MonthEnd(0)
+
+
+def month_label(key):
+    return f"{key // 12:04d}-{key % 12 + 1:02d}"
+
+
+def month_dimension(keys):
+    # 月キー → 年・月・期と表示ラベルの対応表（出現した月キーの分だけ作る）
+    index = pd.Index(sorted(set(int(k) for k in keys)), dtype="int64", name="月キー")
+    return pd.DataFrame({
+        "年": index // 12,
+        "月": index % 12 + 1,
+        "期": fiscal_terms(index),
+        "年月": [month_label(k) for k in index],
+        "期ラベル": [term_label(t) for t in fiscal_terms(index)]
+    }, index=index)
+
+
+# === 工数キューブ（年月×作業者×作業種別） ===
+# 期・月・個人別の工数グラフは全てこの粒度の集計で答えられるため、
+# データ版ごとに一度だけ集計しておき、リクエスト時はキューブを絞り込むだけにする。
+# 年月・期は会計期カレンダーの整数キー。
+KOUSU_CUBE_KEYS = ["年月", "作業者", "作業種別"]
+
+
+def aggregate_kousu_cells(df):
+    df = df.dropna(subset=["日付", "作業者", "作業種別", "時間"])
+    return df.groupby([month_keys(df["日付"]).astype("int64").rename("年月"), "作業者", "作業種別"], observed=True).agg(
+        時間合計=("時間", "sum"),
+        件数=("時間", "size")
+    ).reset_index()
+
+
+def finish_kousu_cube(cube):
+    cube["時間合計"] = cube["時間合計"].astype(float)
+    cube["件数"] = cube["件数"].astype(int)
+    cube["期"] = fiscal_terms(cube["年月"])
+    cube["削除済み"] = category_flags(cube["作業者"], "削除済み")
+    # 年月順に並べ、期・月・期間の絞り込みを sorted_slice で取れるようにする
+    return cube.sort_values(KOUSU_CUBE_KEYS, kind="stable", ignore_index=True)
+
+
+def build_kousu_cube(df):
+    return finish_kousu_cube(aggregate_kousu_cells(df))
+
+
+def finish_kousu_cells(cells, df):
+    # 保存先（SQLite / PostgreSQL）で集計したセルを、読み込んだフレームと同じコード表のキューブにする
+    cells["年月"] = cells["年月"].astype("int64")
+    for col in KOUSU_CATEGORY_COLUMNS:
+        cells[col] = cells[col].astype(df[col].dtype)
+    return finish_kousu_cube(cells)
+
+
+def update_kousu_cube(cube, old_rows, new_rows):
+    # 上書きされる行の旧値を差し引き、新しい行を加算する（影響セルのみ）
+    old_cells = aggregate_kousu_cells(old_rows).set_index(KOUSU_CUBE_KEYS)
+    new_cells = aggregate_kousu_cells(new_rows).set_index(KOUSU_CUBE_KEYS)
+    delta = new_cells.sub(old_cells, fill_value=0)
+    merged = cube.set_index(KOUSU_CUBE_KEYS)[["時間合計", "件数"]].add(delta, fill_value=0)
+    merged = merged[merged["件数"] > 0].reset_index()
+    # 連結でカテゴリが外れるので、取込後のコード表（new_rowsの型）に戻す
+    for col in KOUSU_CATEGORY_COLUMNS:
+        merged[col] = merged[col].astype(new_rows[col].dtype)
+    return finish_kousu_cube(merged)
+
+
+def get_kousu_cube():
+    return dataset_cache.derived("kousu", "cube", build_kousu_cube)
+
+
+# === 見積ヘッダー・明細（一般工事売上データ） ===
+# 集計は見積1件＝1行のヘッダー表で行い、詳細は明細表から引く（データ版ごとに一度だけ作る）
+# ヘッダーの値は列ごとに明細の最後の非空値（差分取込で一部の明細だけ決定日が入った見積も拾う）
+# ヘッダー表は作成日順・決定日順の2通りに並べて持ち、どちらの日付でも期間をスライスで取る。
+# ヘッダーの列（ESTIMATE_HEADER_COLUMNS）は保存先のSQLでの集計と共有するため、保存先の節で定義している。
+ESTIMATE_DATE_COLUMNS = ["作成日", "決定日"]
+
+
+def estimate_tables(headers, df):
+    return {
+        "headers": {col: sort_by_date(headers, col) for col in ESTIMATE_DATE_COLUMNS},
+        "items": df[["工事見積No.", "詳細"]].dropna(subset=["詳細"])
+    }
+
+
+def build_estimate_tables(df):
+    headers = df.groupby("工事見積No.", sort=False, dropna=False)[ESTIMATE_HEADER_COLUMNS].last().reset_index()
+    return estimate_tables(headers, df)
+
+
+def finish_estimate_headers(cells, df):
+    # 保存先で求めた行番号（見積ごとの先頭の行・列ごとの最後の非空値の行）から、読み込んだフレームの値を引いてヘッダー表にする
+    # 値・型（カテゴリのコード表・日付）はフレームのものをそのまま使う（非空値の無い列は欠損）
+    headers = pd.DataFrame({"工事見積No.": df["工事見積No."].array.take(cells["行"].astype("int64").to_numpy())})
+    for col in ESTIMATE_HEADER_COLUMNS:
+        rows = cells[col].fillna(-1).astype("int64").to_numpy()
+        headers[col] = df[col].array.take(rows, allow_fill=True)
+    return estimate_tables(headers, df)
+
+
+def get_estimate_tables():
+    return dataset_cache.derived("general", "estimates", build_estimate_tables)
+
+
+def term_dates(term):
+    # 期の表示ラベル → (期首の日, 期末の日)。表記が不正なら400のエラーにする
+    term_value = parse_term_label(term)
+    if term_value is None:
+        raise ReportError(f"<h3>期の指定が不正です: {term}</h3>", 400)
+    return month_dates(*term_months(term_value))
+
+
+def estimate_rows(headers, date_column, start, end, person=None):
+    # date_column が期間内の見積（担当者指定時はその担当者分のみ）
+    rows = sorted_slice(headers[date_column], date_column, start, end)
+    if person is not None:
+        rows = rows[rows["担当者名"] == person]
+    return rows
+
+
+def estimate_monthly(headers, date_column, start, end, months_range, person=None):
+    # 期間内の見積を月ごとに金額合計・件数へ集計（months_range に揃えて0埋め）
+    rows = estimate_rows(headers, date_column, start, end, person)
+    summary = rows.groupby(rows[date_column].dt.to_period("M").dt.to_timestamp().rename("年月")).agg(
+        金額合計=("小計", "sum"),
+        件数=("工事見積No.", "count")
+    ).reindex(months_range, fill_value=0)
+    return summary["金額合計"].astype(int).tolist(), summary["件数"].astype(int).tolist()
+
+
+def estimate_records(items, rows, date_column):
+    # 一覧表の行（工事見積No.順）。詳細は該当見積の明細を「・」で連結
+    rows = rows.sort_values("工事見積No.")
+    lines = items[items["工事見積No."].isin(rows["工事見積No."])]
+    details = lines.groupby("工事見積No.", sort=False)["詳細"].agg(lambda s: "・".join(s.astype(str)))
+    return [
+        {
+            "date": date.strftime("%Y年%m月%d日"),
+            "id": no,
+            "name": name,
+            "details": details.get(no, ""),
+            "amount": int(amount)
+        }
+        for no, date, name, amount in zip(rows["工事見積No."], rows[date_column], rows["建物名"], rows["小計"])
+    ]
+
+
+# === 選択肢インデックス（メニュー画面用） ===
+# 年・月・期・担当者・作業種別の選択肢はデータ版ごとに一度だけ作り、各メニュー画面はそれを返すだけにする。
+# 各画面の従来の抽出条件（どの列の欠損を除くか）はそのまま保つ。
+def build_kousu_options(df):
+    typed = df.dropna(subset=["日付", "作業種別"])
+    manned = df.dropna(subset=["日付", "作業者"])
+    complete = df.dropna(subset=["日付", "作業者", "作業種別"])
+    return {
+        "terms": [term_label(t) for t in sorted(date_terms(typed["日付"]).unique(), reverse=True)],
+        "years": sorted(typed["日付"].dt.year.unique(), reverse=True),
+        "months": sorted(typed["日付"].dt.month.unique()),
+        "work_types": sorted([w for w in typed["作業種別"].unique() if w != "小計"]),
+        "person_years": sorted(manned["日付"].dt.year.unique(), reverse=True),
+        "person_users": [u for u in sorted(manned["作業者"].unique()) if "削除済み" not in u],
+        "period_years": sorted(complete["日付"].dt.year.unique(), reverse=True),
+        "period_users": [u for u in sorted(complete["作業者"].unique()) if "削除済み" not in u],
+        "period_work_types": [w for w in sorted(complete["作業種別"].unique()) if w != "小計"]
+    }
+
+
+def build_general_options(df):
+    df = df.dropna(subset=["作成日"])
+    return {
+        "periods": [term_label(t) for t in sorted(date_terms(df["作成日"]).unique())],
+        "months": [f"{m.year}年{m.month}月" for m in sorted(df["作成日"].dt.to_period("M").unique())],
+        "persons": sorted([p for p in df["担当者名"].dropna().unique() if "削除済み" not in p])
+    }
+
+
+def get_kousu_options():
+    return dataset_cache.derived("kousu", "options", build_kousu_options)
+
+
+def get_general_options():
+    return dataset_cache.derived("general", "options", build_general_options)
+
+
+# === グラフ集計カーネル ===
+# 縦持ちの集計結果を (ラベル×系列) の密行列にし、列をそのままChart.jsの系列にする。
+# 応答は列持ち（系列定義は1回・配色は番号・値は系列ごとの配列）で送り、datasets への展開は描画側で行う。
+KENSA_ITEMS = ["法定検査", "社内検査"]
+KENSA_COLORS = {"法定検査": "rgba(255, 127, 14, 0.7)", "社内検査": "rgba(44, 160, 44, 0.7)"}
+
+
+def dense_matrix(frame, row_key, col_key, rows, cols, value=None):
+    # value省略時は行数を数える。無いセルは0
+    grouped = frame.groupby([row_key, col_key], observed=True)
+    table = grouped.size() if value is None else grouped[value].sum()
+    return table.unstack(col_key, fill_value=0).reindex(index=rows, columns=cols, fill_value=0)
+
+
+def series_values(matrix):
+    # 系列（列）ごとの値リスト。整数値だけなら整数で送る（12.0 → 12）
+    values = matrix.to_numpy()
+    if np.array_equal(values, np.floor(values)):
+        values = values.astype(np.int64)
+    return values.T.tolist()
+
+
+def stacked_chart(time_matrix, count_matrix, colors):
+    # 主系列（作業種別）。系列名の「（時間）」「（件数）」は描画側で付ける
+    return {
+        "palette": list(colors),
+        "series": [{"label": col, "stack": "main", "color": idx % len(colors)} for idx, col in enumerate(time_matrix.columns)],
+        "time": series_values(time_matrix),
+        "count": series_values(count_matrix)
+    }
+
+
+def kensa_overlay(chart, kensa_df, row_key, rows):
+    # 法定検査・社内検査の系列（時間・件数）をグラフに足し、ラベル順の検査合計を返す
+    times = dense_matrix(kensa_df, row_key, "項目", rows, KENSA_ITEMS, "時間")
+    counts = dense_matrix(kensa_df, row_key, "項目", rows, KENSA_ITEMS)
+    for item in KENSA_ITEMS:
+        chart["series"].append({"label": item, "stack": "検査", "color": len(chart["palette"])})
+        chart["palette"].append(KENSA_COLORS[item])
+    chart["time"] += series_values(times)
+    chart["count"] += series_values(counts)
+    return {"時間合計": times.sum(axis=1).tolist(), "件数合計": counts.sum(axis=1).tolist()}
+
+
+def upsert_kousu_rows(frame, cube, delta):
+    # 取込前のフレーム・工数キューブに対し、取込分(delta)の作業IDの行だけを差し替えたものを返す
+    # （取込分の空欄は既存値を残す。取込ログを読み込んだ時と同じ上書き規則）
+    frame, new = align_categories(frame, normalize_kousu(delta.copy()), KOUSU_CATEGORY_COLUMNS)
+    new = new.set_index("作業ID")
+    touched = frame["作業ID"].isin(new.index)
+    old_rows = frame[touched]
+    upserted = old_rows.set_index("作業ID").combine_first(new)
+    upserted.update(new)
+    new_rows = upserted.reset_index()[frame.columns]
+    if cube is not None:
+        cube = update_kousu_cube(cube, old_rows, new_rows)
+    return sort_by_date(pd.concat([frame[~touched], new_rows], ignore_index=True), "日付"), cube
+
+
+def apply_kousu_upsert(base, pending, written):
+    # 取込分を全て保存した後、差し替え済みのフレーム（とキューブ）をキャッシュに登録する
+    # 取込前のキャッシュがこの書き込みの直前の版でなければ（他の台の取込・CSVの差し替えが挟まった）、差分では追えないので読み直させる
+    previous, current = written
+    if pending is None or base.signature != previous:
+        dataset_cache.invalidate("kousu")
+        return None
+    frame, cube = pending
+    return dataset_cache.replace("kousu", frame, current, {"cube": cube} if cube is not None else {})
+
+# === ワーカープール ===
+# pandasの読込・集計・CSV書込はイベントループを止めないよう、上限付きのスレッドプールで実行する。
+# データセットキャッシュを共有するためプロセスではなくスレッドを使う。
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "4"))
+
+
+class WorkerPool:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kousu-worker")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _task(self, submitted_at, func, args):
+        waited = time.perf_counter() - submitted_at
+        timing = request_timing.get()
+        if timing is not None:
+            timing.add("queue", waited)
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, func, *args):
+        with self._lock:
+            self.queued += 1
+        # 呼び出し元のコンテキスト（処理区間の計測先）のままワーカーで実行する
+        future = self._executor.submit(contextvars.copy_context().run, self._task, time.perf_counter(), func, args)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            started = self.completed + self.running
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / started, 6) if started else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6)
+            }
+
+
+worker_pool = WorkerPool(WORKER_POOL_SIZE)
+
+
+class ReportError(Exception):
+    # グラフ処理（ワーカー側）からエラーページを返すための例外
+    def __init__(self, content, status_code=500):
+        super().__init__(content)
+        self.content = content
+        self.status_code = status_code
+
+
+class IngestError(Exception):
+    # 取込処理（ワーカー側）から400応答を返すための例外
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+# === 条件付きリクエスト（ETag）・応答キャッシュ ===
+# 応答は参照するデータセットの版と要求（パス・クエリ）だけで決まるので、その組からETagを作る。
+# If-None-Match が一致すれば集計も描画もせずに304を返す。
+# 版番号はプロセス内の連番のため、再起動で同じ番号が別の内容を指さないよう起動IDも混ぜる。
+BOOT_ID = os.urandom(8).hex()
+
+
+async def dataset_entries(names):
+    entries = [dataset_cache.peek(name) for name in names]
+    if any(entry is None for entry in entries):
+        # 未読込・更新ありの時だけワーカーで読み込む
+        entries = await worker_pool.run(lambda: [dataset_cache.entry(name) for name in names])
+    return entries
+
+
+def report_etag(request, entries):
+    # 同じキーのクエリ値は順序に意味がある（work_types の並び＝系列の並び）ので、キーだけで安定ソートする
+    query = sorted(request.query_params.multi_items(), key=lambda item: item[0])
+    key = repr((BOOT_ID, request.url.path, query, [entry.version for entry in entries]))
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+# 同じETag（＝同じ経路・条件・データ版）の応答本文は使い回せるので、上限付きのLRUで保持する。
+# 圧縮した本文も (ETag, Content-Encoding) ごとに同じ項目へ持ち、ヒットのたびに圧縮し直さない（容量は両方で数える）。
+# データ版が上がったデータセットを参照する古い応答は、新しい版を初めて見た時点でまとめて捨てる。
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "512"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class ReportCache:
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.encoded_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        item = self._items.pop(key)
+        self.bytes -= len(item["body"]) + sum(len(body) for body in item["encoded"].values())
+
+    def _evict(self):
+        while len(self._items) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self._items)))
+            self.evictions += 1
+
+    def observe(self, entries):
+        # 参照データセットの新しい版を見たら、旧版を参照している応答を捨てる
+        with self._lock:
+            for name, version in entries:
+                if version <= self._latest.get(name, 0):
+                    continue
+                self._latest[name] = version
+                stale = [key for key, item in self._items.items() if item["versions"].get(name, version) < version]
+                for key in stale:
+                    self._drop(key)
+                self.invalidations += len(stale)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key, versions, body, media_type):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if any(version < self._latest.get(name, 0) for name, version in versions):
+                return  # 集計中に取込で版が上がった（もう誰も引かない）
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = {"versions": dict(versions), "body": body, "media_type": media_type, "encoded": {}}
+            self.bytes += len(body)
+            self._evict()
+
+    def encoded(self, key, body, encoding):
+        # 圧縮済みの本文を返す（初回だけ圧縮して項目に足す。項目が無い・差し替わった場合は保持しない）
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item["body"] is body and encoding in item["encoded"]:
+                self.encoded_hits += 1
+                return item["encoded"][encoding]
+        compressed = compress_body(body, encoding)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item["body"] is body and encoding not in item["encoded"]:
+                item["encoded"][encoding] = compressed
+                self.bytes += len(compressed)
+                self._evict()
+        return compressed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "encoded_hits": self.encoded_hits,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+report_cache = ReportCache(REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_MAX_BYTES)
+
+
+# キャッシュに無い同じ応答（同じETag）を同時に求められた場合は、1件だけ集計して残りはその結果を待つ。
+# 先頭の要求が切断されても集計は止めない（待っている要求があるため）。
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn):
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.leaders += 1
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+
+report_flights = SingleFlight()
+
+
+def cached_response(request, key, body, media_type, headers):
+    # 圧縮はここで済ませて Content-Encoding を付ける（CompressionMiddleware は符号化済みの応答に手を出さない。
+    # 圧縮しない応答の Vary はミドルウェアが付ける）
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    if encoding is not None and should_compress(body, media_type):
+        body = report_cache.encoded(key, body, encoding)
+        headers = {**headers, "Content-Encoding": encoding, "ETag": f"W/{headers['ETag']}", "Vary": "Accept-Encoding"}
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+async def conditional(request, datasets, respond):
+    entries = await dataset_entries(datasets)
+    versions = [(name, entry.version) for name, entry in zip(datasets, entries)]
+    timing_note(datasets={name: {"version": entry.version, "rows": len(entry.frame)} for name, entry in zip(datasets, entries)})
+    report_cache.observe(versions)
+    headers = {
+        "ETag": report_etag(request, entries),
+        "Last-Modified": formatdate(max(entry.modified for entry in entries), usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        timing_note(cache="not_modified")
+        return Response(status_code=304, headers=headers)
+    cached = report_cache.get(headers["ETag"])
+    if cached is not None:
+        timing_note(cache="hit")
+        return cached_response(request, headers["ETag"], cached["body"], cached["media_type"], headers)
+
+    async def compute():
+        timing_note(cache="miss")
+        response = await respond()
+        if response.status_code == 200:
+            report_cache.put(headers["ETag"], versions, response.body, response.media_type)
+        return response.status_code, response.body, response.media_type
+
+    timing_note(cache="coalesced")
+    status_code, body, media_type = await report_flights.run(headers["ETag"], compute)
+    if status_code != 200:
+        return Response(content=body, status_code=status_code, media_type=media_type)
+    return cached_response(request, headers["ETag"], body, media_type, headers)
+
+
+async def render_report(request, template_name, builder, *args, datasets=()):
+    async def respond():
+        try:
+            context = await worker_pool.run(timed_call, "build", builder, *args)
+        except ReportError as e:
+            return HTMLResponse(content=e.content, status_code=e.status_code)
+        return templates.TemplateResponse(template_name, {"request": request, **context})
+    if datasets:
+        return await conditional(request, datasets, respond)
+    return await respond()
+
+
+# 結果ページの枠はテンプレートと入力条件だけで決まる（データに依らない）ので、
+# テンプレート一式の内容から作った版と入力条件でETagを付ける（再起動・別の台でも同じ値）。
+def templates_version(directory):
+    digest = hashlib.sha1()
+    modified = 0.0
+    for root, _, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            modified = max(modified, os.path.getmtime(path))
+    return digest.hexdigest(), modified
+
+
+TEMPLATES_VERSION, TEMPLATES_MODIFIED = templates_version("templates")
+
+
+def render_shell(request, template_name, api_path, **params):
+    # 結果ページは画面の枠（入力条件）だけを返し、グラフ・表の数値はブラウザが /api/v1 から取得する
+    query = {key: value for key, value in params.items() if value is not None}
+    timing_note(params=query)
+    key = repr((TEMPLATES_VERSION, template_name, api_path, sorted(query.items())))
+    headers = {
+        "ETag": '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"',
+        "Last-Modified": formatdate(TEMPLATES_MODIFIED, usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+    # POST（フォーム送信）の結果は条件付きで返さない（If-None-Match はGETの詳細ページだけで使う）
+    if request.method in ("GET", "HEAD") and etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        timing_note(cache="not_modified")
+        return Response(status_code=304, headers=headers)
+    return templates.TemplateResponse(template_name, {
+        "request": request,
+        "api_url": f"{api_path}?{urlencode(query, doseq=True)}",
+        **params
+    }, headers=headers)
+
+
+async def report_json(request, datasets, builder, *args):
+    # render_report のJSON版（/api/v1）。エラーは {"error": メッセージ} で返す
+    async def respond():
+        try:
+            data = await worker_pool.run(timed_call, "build", builder, *args)
+        except ReportError as e:
+            return JSONResponse({"error": re.sub(r"<[^>]+>", "", e.content)}, status_code=e.status_code)
+        with timed("render"):
+            return JSONResponse(data)
+    return await conditional(request, datasets, respond)
+
+
+# 同一データセットへの取込（セグメント追記・コンパクション）はワーカー上で直列化する
+ingest_locks = {name: threading.RLock() for name in ("kousu", "kensa", "general")}
+
+
+def run_ingest(name, merge, upload):
+    with ingest_locks[name]:
+        started = time.perf_counter()
+        count = merge(upload)
+        ingest_merge_seconds.observe(time.perf_counter() - started, name)
+        ingest_rows_per_call.observe(count, name)
+        timing_note(dataset=name, ingested_rows=count)
+        if len(ingest_logs[name].segments()) >= INGEST_COMPACT_SEGMENTS:
+            compact_dataset(name)
+        return count
+
+
+def compact_dataset(name):
+    # 内容は変わらないので、キャッシュは捨てずに署名だけ付け替える
+    with ingest_locks[name]:
+        log = ingest_logs[name]
+        previous = log.signature()
+        rewritten = log.compact()
+        if rewritten:
+            dataset_cache.resign(name, previous)
+        return rewritten
+
+
+def write_csv_durable(df, path):
+    # 一時ファイルに書いてfsyncしてから置き換える（応答した時点で保存済みにする）
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+        df.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# === 外部HTTPクライアント ===
+# 外部API呼び出しはアプリ共通の非同期クライアント1つを使い回す（keep-alive・接続プール）。
+# h2 パッケージが入っていればHTTP/2で接続する。呼び出しごとの所要時間を記録する。
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "10"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class OutboundHttp:
+    def __init__(self):
+        self._client = None
+        self._loop = None
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+            )
+        return self._client
+
+    def _record(self, key, seconds, error):
+        with self._lock:
+            stat = self.calls.setdefault(key, {"count": 0, "errors": 0, "seconds_total": 0.0, "seconds_max": 0.0, "last_seconds": 0.0})
+            stat["count"] += 1
+            stat["errors"] += int(error)
+            stat["seconds_total"] += seconds
+            stat["seconds_max"] = max(stat["seconds_max"], seconds)
+            stat["last_seconds"] = seconds
+
+    async def request(self, method, url, **kwargs):
+        key = f"{method} {httpx.URL(url).host}"
+        started = time.perf_counter()
+        error = True
+        try:
+            resp = await self.client().request(method, url, **kwargs)
+            error = resp.status_code >= 500
+            return resp
+        finally:
+            self._record(key, time.perf_counter() - started, error)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "http2": HTTP2_AVAILABLE,
+                "calls": {
+                    key: {**stat, "seconds_avg": stat["seconds_total"] / stat["count"] if stat["count"] else 0.0}
+                    for key, stat in self.calls.items()
+                }
+            }
+
+
+http_client = OutboundHttp()
+
+
+# === GitHub同期キュー ===
+# 取込APIはローカル保存が終わった時点で応答し、GitHubへの反映はバックグラウンドで行う。
+# 同じファイルへの連続した取込は待機時間内にまとめて1コミットにし、失敗時は間隔を広げて再試行する。
+# GITHUB_API_URL を差し替えればローカルの偽APIに対して動作確認できる。
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_REPO = os.getenv("GITHUB_REPO", "otameshi-web/kousu-app")
+GITHUB_BRANCH = os.getenv("GITHUB_BRANCH", "master")
+GITHUB_SYNC_DEBOUNCE = float(os.getenv("GITHUB_SYNC_DEBOUNCE", "10"))
+GITHUB_SYNC_MAX_DELAY = float(os.getenv("GITHUB_SYNC_MAX_DELAY", "60"))
+GITHUB_SYNC_MAX_RETRIES = int(os.getenv("GITHUB_SYNC_MAX_RETRIES", "5"))
+GITHUB_SYNC_RETRY_BASE = float(os.getenv("GITHUB_SYNC_RETRY_BASE", "2"))
+GITHUB_RETRYABLE_STATUS = {409, 422, 429, 500, 502, 503, 504}
+
+
+class GitHubSyncError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def read_file_base64(path):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+async def push_file_to_github(repo_path, local_path, label):
+    api_url = f"{GITHUB_API_URL}/repos/{GITHUB_REPO}/contents/{repo_path}"
+    headers = {
+        "Authorization": f"Bearer {os.getenv('GITHUB_TOKEN')}",
+        "Accept": "application/vnd.github+json"
+    }
+    get_resp = await http_client.request("GET", api_url, headers=headers, params={"ref": GITHUB_BRANCH})
+    sha = get_resp.json().get("sha", None) if get_resp.status_code == 200 else None
+
+    encoded_content = await asyncio.to_thread(read_file_base64, local_path)
+
+    data = {
+        "message": f"自動更新: {label} ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})",
+        "content": encoded_content,
+        "branch": GITHUB_BRANCH
+    }
+    if sha:
+        data["sha"] = sha
+
+    put_resp = await http_client.request("PUT", api_url, headers=headers, json=data, timeout=httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT))
+    if put_resp.status_code not in [200, 201]:
+        raise GitHubSyncError(f"{put_resp.status_code}: {put_resp.text[:300]}", put_resp.status_code in GITHUB_RETRYABLE_STATUS)
+    return put_resp.json().get("commit", {}).get("sha")
+
+
+class GitHubSyncQueue:
+    def __init__(self, debounce, max_delay, max_retries, retry_base):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self._pending = {}
+        self._files = {}
+        self._syncing = set()
+        self._draining = False
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+
+    def _file_status(self, repo_path):
+        return self._files.setdefault(repo_path, {
+            "state": "idle",
+            "uploads": 0,
+            "commits": 0,
+            "failures": 0,
+            "attempts": 0,
+            "last_error": None,
+            "last_commit": None,
+            "last_synced_at": None,
+            "last_lag_seconds": None
+        })
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    def enqueue(self, repo_path, local_path, label, prepare=None):
+        # prepare: 送信直前に呼ぶコルーチン関数（取込ログのコンパクション等）
+        now = time.time()
+        job = self._pending.get(repo_path)
+        if job is None:
+            job = {"local_path": local_path, "label": label, "first_at": now, "uploads": 0}
+            self._pending[repo_path] = job
+        job["prepare"] = prepare
+        job["uploads"] += 1
+        job["attempts"] = 0
+        job["due"] = min(now + self.debounce, job["first_at"] + self.max_delay)
+        status = self._file_status(repo_path)
+        status["state"] = "pending"
+        status["uploads"] += 1
+        self._ensure_worker()
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            repo_path, job = min(self._pending.items(), key=lambda item: item[1]["due"])
+            delay = job["due"] - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            del self._pending[repo_path]
+            await self._sync(repo_path, job)
+
+    async def _sync(self, repo_path, job):
+        status = self._file_status(repo_path)
+        status["state"] = "syncing"
+        self._syncing.add(repo_path)
+        try:
+            if job.get("prepare") is not None:
+                await job["prepare"]()
+            commit = await push_file_to_github(repo_path, job["local_path"], job["label"])
+        except Exception as e:
+            job["attempts"] += 1
+            status["failures"] += 1
+            status["attempts"] = job["attempts"]
+            status["last_error"] = str(e)
+            newer = self._pending.get(repo_path)
+            if newer is not None:
+                # 失敗中に次の取込が来た場合は、そちらで最新内容をまとめて送る
+                newer["first_at"] = min(newer["first_at"], job["first_at"])
+                status["state"] = "pending"
+            elif getattr(e, "retryable", True) and job["attempts"] <= self.max_retries and not self._draining:
+                job["due"] = time.time() + self.retry_base * 2 ** (job["attempts"] - 1)
+                self._pending[repo_path] = job
+                status["state"] = "retrying"
+            else:
+                status["state"] = "failed"
+            return
+        finally:
+            self._syncing.discard(repo_path)
+
+        now = time.time()
+        status["state"] = "pending" if repo_path in self._pending else "synced"
+        status["commits"] += 1
+        status["attempts"] = 0
+        status["last_error"] = None
+        status["last_commit"] = commit
+        status["last_synced_at"] = datetime.fromtimestamp(now).isoformat(timespec="seconds")
+        status["last_lag_seconds"] = round(now - job["first_at"], 3)
+
+    async def drain(self, timeout=30.0):
+        if self._task is None or self._task.done():
+            return
+        self._draining = True
+        for job in self._pending.values():
+            job["due"] = 0
+        self._wakeup.set()
+        deadline = time.time() + timeout
+        while (self._pending or self._syncing) and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        self._draining = False
+
+    def status(self):
+        now = time.time()
+        return {
+            "debounce_seconds": self.debounce,
+            "max_delay_seconds": self.max_delay,
+            "pending": {
+                repo_path: {
+                    "uploads": job["uploads"],
+                    "due_in_seconds": round(max(job["due"] - now, 0.0), 3),
+                    "waiting_seconds": round(now - job["first_at"], 3)
+                }
+                for repo_path, job in self._pending.items()
+            },
+            "files": self._files
+        }
+
+
+github_sync = GitHubSyncQueue(GITHUB_SYNC_DEBOUNCE, GITHUB_SYNC_MAX_DELAY, GITHUB_SYNC_MAX_RETRIES, GITHUB_SYNC_RETRY_BASE)
+
 
 # === グラフUI系ルート ===
 @app.get("/", response_class=HTMLResponse)
@@ -41,108 +2329,43 @@ async def graph_estimate_person_menu(request: Request):
 async def graph_estimate_total_menu(request: Request):
     return templates.TemplateResponse("graph_estimate_total_menu.html", {"request": request})
 
-@app.get("/graph/estimate/person/term", response_class=HTMLResponse)
-async def graph_estimate_person_term(request: Request):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
-
-    # ▼ CSV読み込み（文字コードの自動切替）
-    try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
-
-    # ▼ 作成日列から有効な期（データが存在する）だけを選択肢に追加
+def build_graph_estimate_person_term():
+    # ▼ 選択肢インデックス（作成日のある期・担当者（削除済み除外））
     try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df = df.dropna(subset=["作成日"])  # 作成日が無効な行は除外
-
-        min_date = df["作成日"].min()
-        max_date = df["作成日"].max()
-
-        start_year = min_date.year if min_date.month >= 5 else min_date.year - 1
-        end_year = max_date.year if max_date.month >= 5 else max_date.year - 1
-
-        periods = []
-        for year in range(start_year, end_year + 1):
-            term_start = pd.Timestamp(year=year, month=5, day=1)
-            term_end = pd.Timestamp(year=year + 1, month=4, day=30)
-            if not df[(df["作成日"] >= term_start) & (df["作成日"] <= term_end)].empty:
-                periods.append(f"{year}年5月～{year+1}年4月")
-
+        options = get_general_options()
     except Exception as e:
-        return HTMLResponse(content=f"<h3>期情報の取得失敗: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>期情報の取得失敗: {e}</h3>", 500)
 
-    # ▼ 担当者プルダウン生成（削除済み除外）
-    if "担当者名" in df.columns:
-        persons = sorted([p for p in df["担当者名"].dropna().unique() if "削除済み" not in p])
-    else:
-        persons = []
+    return {
+        "periods": options["periods"],
+        "persons": options["persons"]
+    }
 
-    return templates.TemplateResponse("graph_estimate_person_term.html", {
-        "request": request,
-        "periods": periods,
-        "persons": persons
-    })
+@app.get("/graph/estimate/person/term", response_class=HTMLResponse)
+async def graph_estimate_person_term(request: Request):
+    return await render_report(request, "graph_estimate_person_term.html", build_graph_estimate_person_term, datasets=("general",))
 
 # エンドポイント：期毎グラフ（見積金額集計）
-@app.post("/graph/estimate/person/term/result", response_class=HTMLResponse)
-async def graph_estimate_person_term_result(request: Request):
-    form = await request.form()
-    term = form.get("term")
-    person = form.get("person")
-
+def build_graph_estimate_person_term_result(term, person):
     if not term or not person:
-        return HTMLResponse(content="<h3>フォームデータの取得失敗: term または person が空です</h3>", status_code=400)
+        raise ReportError("<h3>フォームデータの取得失敗: term または person が空です</h3>", 400)
 
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
     try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
+        df = get_estimate_tables()["headers"]
     except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>CSV読み込みエラー: {e}</h3>", 500)
 
-    try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
-        y1 = int(term[:4])
-        start = pd.Timestamp(f"{y1}-05-01")
-        end = pd.Timestamp(f"{y1 + 1}-04-30")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>日付処理失敗: {e}</h3>", status_code=500)
-
-    # ▼ 担当者フィルタ共通
-    df = df[df["担当者名"] == person]
+    start, end = term_dates(term)
 
     # ▼ 月ラベル
     months_range = pd.date_range(start=start, periods=12, freq="MS")
     months = [f"{d.year}年{d.month}月" for d in months_range]
 
     # ▼ 金額集計：見積（作成日）
-    df_est = df[(df["作成日"] >= start) & (df["作成日"] <= end)].sort_values("作成日")
-    df_est = df_est.drop_duplicates("工事見積No.", keep="last")
-    df_est["年月"] = df_est["作成日"].dt.to_period("M").dt.to_timestamp()
-
-    summary_est = df_est.groupby("年月").agg(金額合計=("小計", "sum"), 件数=("工事見積No.", "count"))
-    summary_est = summary_est.reindex(months_range, fill_value=0)
-
-    estimate_amounts = summary_est["金額合計"].astype(int).tolist()
-    estimate_counts = summary_est["件数"].astype(int).tolist()
+    estimate_amounts, estimate_counts = estimate_monthly(df, "作成日", start, end, months_range, person)
 
     # ▼ 金額集計：決定（決定日）
-    df_dec = df[(df["決定日"].notna()) & (df["決定日"] >= start) & (df["決定日"] <= end)]
-    df_dec = df_dec.sort_values("決定日").drop_duplicates("工事見積No.", keep="last")
-    df_dec["年月"] = df_dec["決定日"].dt.to_period("M").dt.to_timestamp()
-
-    summary_dec = df_dec.groupby("年月").agg(金額合計=("小計", "sum"), 件数=("工事見積No.", "count"))
-    summary_dec = summary_dec.reindex(months_range, fill_value=0)
-
-    decision_amounts = summary_dec["金額合計"].astype(int).tolist()
-    decision_counts = summary_dec["件数"].astype(int).tolist()
+    decision_amounts, decision_counts = estimate_monthly(df, "決定日", start, end, months_range, person)
 
     # ▼ 合計金額と平均単価（フォーマット付き）
     estimate_total_raw = sum(estimate_amounts)
@@ -160,8 +2383,7 @@ async def graph_estimate_person_term_result(request: Request):
     count_decision_rate = f"{(total_decision_count / total_estimate_count * 100):.1f}%" if total_estimate_count > 0 else "0%"
 
 
-    return templates.TemplateResponse("graph_estimate_person_term_result.html", {
-        "request": request,
+    return {
         "term": term,
         "person": person,
         "months": months,
@@ -175,124 +2397,79 @@ async def graph_estimate_person_term_result(request: Request):
         "money_decision_rate": money_decision_rate,
         "count_decision_rate": count_decision_rate
 
-    })
-
-# --- 追加：月別棒グラフクリック時の詳細ページ表示 ---
+    }
 
-@app.get("/graph/estimate/person/term/detail", response_class=HTMLResponse)
-async def graph_estimate_detail_result(
-    request: Request,
-    term: str,
-    person: str,
-    year: int,
-    month: int,
-    type: str  # "estimate" または "decision"
-):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+@app.post("/graph/estimate/person/term/result", response_class=HTMLResponse)
+async def graph_estimate_person_term_result(request: Request):
+    form = await request.form()
+    term = form.get("term")
+    person = form.get("person")
+    return render_shell(request, "graph_estimate_person_term_result.html", "/api/v1/estimate/person/term", term=term, person=person)
 
-    try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+# --- 追加：月別棒グラフクリック時の詳細ページ表示 ---
 
+def build_graph_estimate_detail_result(term: str, person: str, year: int, month: int, type: str):
     try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
+        tables = get_estimate_tables()
+        df = tables["headers"]
     except Exception as e:
-        return HTMLResponse(content=f"<h3>日付変換エラー: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>CSV読み込みエラー: {e}</h3>", 500)
 
     # ▼ 期を日付で範囲化
-    y1 = int(term[:4])
-    start = pd.Timestamp(f"{y1}-05-01")
-    end = pd.Timestamp(f"{y1 + 1}-04-30")
+    start, end = term_dates(term)
 
     # ▼ 抽出用カラム
     date_column = "作成日" if type == "estimate" else "決定日"
     label_prefix = "見積作成" if type == "estimate" else "決定見積"
     date_label = "作成日" if type == "estimate" else "決定日"
 
-    # ▼ 担当者・日付・期フィルタ
-    df_month = df[
-        (df["担当者名"] == person) &
-        (df[date_column].notna()) &
-        (df[date_column].dt.year == year) &
-        (df[date_column].dt.month == month) &
-        (df[date_column] >= start) &
-        (df[date_column] <= end)
-    ]
+    # ▼ 担当者・日付・期フィルタ（該当月と期の重なる範囲）
+    month_start, month_end = month_dates(month_key(year, month), month_key(year, month))
+    df_month = estimate_rows(df, date_column, max(start, month_start), min(end, month_end), person)
 
     # ▼ 工事見積No単位で詳細と小計を結合
-    grouped = df_month.groupby("工事見積No.")
-
-    records = []
-    for no, group in grouped:
-        row = group.iloc[0]
-        record = {
-            "date": row[date_column].strftime("%Y年%m月%d日"),
-            "id": row["工事見積No."],
-            "name": row["建物名"],
-            "details": "・".join(group["詳細"].dropna().astype(str)),
-            "amount": int(row["小計"])
-        }
-        records.append(record)
+    records = estimate_records(tables["items"], df_month, date_column)
 
     # ▼ タイトル
     title = f"{year}年{month}月の{label_prefix}データ一覧（{person}）"
 
-    return templates.TemplateResponse("graph_estimate_detail_result.html", {
-        "request": request,
+    return {
         "title": title,
         "records": records,
         "total_amount": sum(r["amount"] for r in records),
         "date_label": date_label  # ← 表ヘッダーに表示する日付種別
-    })
-
-@app.get("/graph/estimate/person/period", response_class=HTMLResponse)
-async def graph_estimate_person_period(request: Request):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+    }
 
-    # ▼ CSV読み込み（文字コードの自動切替）
-    try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+@app.get("/graph/estimate/person/term/detail", response_class=HTMLResponse)
+async def graph_estimate_detail_result(
+    request: Request,
+    term: str,
+    person: str,
+    year: int,
+    month: int,
+    type: str  # "estimate" または "decision"
+):
+    return render_shell(request, "graph_estimate_detail_result.html", "/api/v1/estimate/person/term/detail", term=term, person=person, year=year, month=month, type=type)
 
-    # ▼ 作成日から年月リスト生成（yyyy年m月 形式）
+def build_graph_estimate_person_period():
+    # ▼ 選択肢インデックス（作成日の年月（yyyy年m月 形式）・担当者（削除済み除外））
     try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df = df.dropna(subset=["作成日"])
-        months = sorted(df["作成日"].dt.to_period("M").unique())
-        all_months = [f"{m.year}年{m.month}月" for m in months]
+        options = get_general_options()
     except Exception as e:
-        return HTMLResponse(content=f"<h3>年月リストの生成失敗: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>年月リストの生成失敗: {e}</h3>", 500)
 
-    # ▼ 担当者名（削除済みは除外）
-    if "担当者名" in df.columns:
-        persons = sorted([p for p in df["担当者名"].dropna().unique() if "削除済み" not in p])
-    else:
-        persons = []
-
-    return templates.TemplateResponse("graph_estimate_person_period.html", {
-        "request": request,
-        "all_months": all_months,
-        "persons": persons
-    })
+    return {
+        "all_months": options["months"],
+        "persons": options["persons"]
+    }
 
-@app.post("/graph/estimate/person/period/result", response_class=HTMLResponse)
-async def graph_estimate_person_period_result(request: Request):
-    form = await request.form()
-    start_str = form.get("start_month")  # 例: 2024年6月
-    end_str = form.get("end_month")
-    person = form.get("person")
+@app.get("/graph/estimate/person/period", response_class=HTMLResponse)
+async def graph_estimate_person_period(request: Request):
+    return await render_report(request, "graph_estimate_person_period.html", build_graph_estimate_person_period, datasets=("general",))
 
+def build_graph_estimate_person_period_result(start_str, end_str, person):
     if not start_str or not end_str or not person:
-        return HTMLResponse(content="<h3>フォームデータの取得失敗: start, end, person のいずれかが空です</h3>", status_code=400)
+        raise ReportError("<h3>フォームデータの取得失敗: start, end, person のいずれかが空です</h3>", 400)
 
     # 「2025年7月」→ Timestamp("2025-07-01")
     def parse_ym_to_date(ym: str) -> pd.Timestamp:
@@ -307,49 +2484,21 @@ async def graph_estimate_person_period_result(request: Request):
         start = parse_ym_to_date(start_str)
         end = parse_ym_to_date(end_str) + pd.offsets.MonthEnd(0)  # 月末日まで含める
     except Exception as e:
-        return HTMLResponse(content=f"<h3>日付変換エラー: {e}</h3>", status_code=400)
-
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
-    try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>日付変換エラー: {e}</h3>", 400)
 
     try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
+        df = get_estimate_tables()["headers"]
     except Exception as e:
-        return HTMLResponse(content=f"<h3>日付処理失敗: {e}</h3>", status_code=500)
-
-    df = df[df["担当者名"] == person]
+        raise ReportError(f"<h3>CSV読み込みエラー: {e}</h3>", 500)
 
     months_range = pd.date_range(start=start, end=end, freq="MS")
     months = [f"{d.year}年{d.month}月" for d in months_range]
 
     # ▼ 見積金額（作成日）
-    df_est = df[(df["作成日"] >= start) & (df["作成日"] <= end)].sort_values("作成日")
-    df_est = df_est.drop_duplicates("工事見積No.", keep="last")
-    df_est["年月"] = df_est["作成日"].dt.to_period("M").dt.to_timestamp()
-
-    summary_est = df_est.groupby("年月").agg(金額合計=("小計", "sum"), 件数=("工事見積No.", "count"))
-    summary_est = summary_est.reindex(months_range, fill_value=0)
-
-    estimate_amounts = summary_est["金額合計"].astype(int).tolist()
-    estimate_counts = summary_est["件数"].astype(int).tolist()
+    estimate_amounts, estimate_counts = estimate_monthly(df, "作成日", start, end, months_range, person)
 
     # ▼ 決定金額（決定日）
-    df_dec = df[(df["決定日"].notna()) & (df["決定日"] >= start) & (df["決定日"] <= end)]
-    df_dec = df_dec.sort_values("決定日").drop_duplicates("工事見積No.", keep="last")
-    df_dec["年月"] = df_dec["決定日"].dt.to_period("M").dt.to_timestamp()
-
-    summary_dec = df_dec.groupby("年月").agg(金額合計=("小計", "sum"), 件数=("工事見積No.", "count"))
-    summary_dec = summary_dec.reindex(months_range, fill_value=0)
-
-    decision_amounts = summary_dec["金額合計"].astype(int).tolist()
-    decision_counts = summary_dec["件数"].astype(int).tolist()
+    decision_amounts, decision_counts = estimate_monthly(df, "決定日", start, end, months_range, person)
 
     # ▼ 合計金額・平均単価
     estimate_total_raw = sum(estimate_amounts)
@@ -365,8 +2514,7 @@ async def graph_estimate_person_period_result(request: Request):
     money_decision_rate = f"{(decision_total_raw / estimate_total_raw * 100):.1f}%" if estimate_total_raw > 0 else "0%"
     count_decision_rate = f"{(total_decision_count / total_estimate_count * 100):.1f}%" if total_estimate_count > 0 else "0%"
 
-    return templates.TemplateResponse("graph_estimate_person_period_result.html", {
-        "request": request,
+    return {
         "start": start_str,
         "end": end_str,
         "start_month": start_str,
@@ -382,32 +2530,23 @@ async def graph_estimate_person_period_result(request: Request):
         "estimate_per_case": estimate_per_case,
         "money_decision_rate": money_decision_rate,
         "count_decision_rate": count_decision_rate
-    })
+    }
 
-@app.get("/graph/estimate/person/period/detail", response_class=HTMLResponse)
-async def graph_estimate_person_period_detail(
-    request: Request,
-    start: str,
-    end: str,
-    year: int,
-    month: int,
-    person: str,
-    type: str  # 'estimate' または 'decision'
-):
-    import os
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+@app.post("/graph/estimate/person/period/result", response_class=HTMLResponse)
+async def graph_estimate_person_period_result(request: Request):
+    form = await request.form()
+    start_str = form.get("start_month")  # 例: 2024年6月
+    end_str = form.get("end_month")
+    person = form.get("person")
+    return render_shell(request, "graph_estimate_person_period_result.html", "/api/v1/estimate/person/period", start_month=start_str, end_month=end_str, person=person)
 
+def build_graph_estimate_person_period_detail(start: str, end: str, year: int, month: int, person: str, type: str):
     # CSV読み込み（エンコーディング対応）
     try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
+        tables = get_estimate_tables()
+        df = tables["headers"]
     except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
-
-    df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-    df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
+        raise ReportError(f"<h3>CSV読み込みエラー: {e}</h3>", 500)
 
     # ▼ 動的に日付・タイトル設定
     date_column = "作成日" if type == "estimate" else "決定日"
@@ -415,125 +2554,67 @@ async def graph_estimate_person_period_detail(
     date_label = "作成日" if type == "estimate" else "決定日"
 
     # ▼ 担当者・年月フィルタ
-    df = df[
-        (df["担当者名"] == person) &
-        (df[date_column].notna()) &
-        (df[date_column].dt.year == year) &
-        (df[date_column].dt.month == month)
-    ]
+    df = estimate_rows(df, date_column, *month_dates(month_key(year, month), month_key(year, month)), person)
 
     # ▼ 工事見積No単位で集計
-    grouped = df.groupby("工事見積No.")
-
-    records = []
-    for no, group in grouped:
-        row = group.iloc[0]
-        record = {
-            "date": row[date_column].strftime("%Y年%m月%d日"),
-            "id": row["工事見積No."],
-            "name": row["建物名"],
-            "details": "・".join(group["詳細"].dropna().astype(str)),
-            "amount": int(row["小計"])
-        }
-        records.append(record)
+    records = estimate_records(tables["items"], df, date_column)
 
     title = f"{year}年{month}月の{label_prefix}データ一覧（{person}）"
 
-    return templates.TemplateResponse("graph_estimate_person_period_detail_result.html", {
-        "request": request,
+    return {
         "title": title,
         "records": records,
         "total_amount": sum([r["amount"] for r in records]),
         "start": start,
         "end": end,
         "date_label": date_label  # ← テンプレートに渡す
-    })
-
-@app.get("/graph/estimate/total/term", response_class=HTMLResponse)
-async def graph_estimate_total_term(request: Request):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+    }
 
-    try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+@app.get("/graph/estimate/person/period/detail", response_class=HTMLResponse)
+async def graph_estimate_person_period_detail(
+    request: Request,
+    start: str,
+    end: str,
+    year: int,
+    month: int,
+    person: str,
+    type: str  # 'estimate' または 'decision'
+):
+    return render_shell(request, "graph_estimate_person_period_detail_result.html", "/api/v1/estimate/person/period/detail", start=start, end=end, year=year, month=month, person=person, type=type)
 
+def build_graph_estimate_total_term():
     try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df = df.dropna(subset=["作成日"])
-
-        min_date = df["作成日"].min()
-        max_date = df["作成日"].max()
-
-        start_year = min_date.year if min_date.month >= 5 else min_date.year - 1
-        end_year = max_date.year if max_date.month >= 5 else max_date.year - 1
-
-        periods = []
-        for year in range(start_year, end_year + 1):
-            term_start = pd.Timestamp(year=year, month=5, day=1)
-            term_end = pd.Timestamp(year=year + 1, month=4, day=30)
-            if not df[(df["作成日"] >= term_start) & (df["作成日"] <= term_end)].empty:
-                periods.append(f"{year}年5月～{year+1}年4月")
+        options = get_general_options()
     except Exception as e:
-        return HTMLResponse(content=f"<h3>期情報の取得失敗: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>期情報の取得失敗: {e}</h3>", 500)
 
-    return templates.TemplateResponse("graph_estimate_total_term.html", {
-        "request": request,
-        "periods": periods
-    })
+    return {
+        "periods": options["periods"]
+    }
 
-@app.post("/graph/estimate/total/term/result", response_class=HTMLResponse)
-async def graph_estimate_total_term_result(request: Request, term: str = Form(...)):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+@app.get("/graph/estimate/total/term", response_class=HTMLResponse)
+async def graph_estimate_total_term(request: Request):
+    return await render_report(request, "graph_estimate_total_term.html", build_graph_estimate_total_term, datasets=("general",))
 
+def build_graph_estimate_total_term_result(term: str):
     # ▼ CSV読み込み（文字コードの自動切替）
     try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
+        df = get_estimate_tables()["headers"]
     except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>CSV読み込みエラー: {e}</h3>", 500)
 
     # ▼ 日付・期間変換
-    try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
-
-        y1 = int(term[:4])
-        start = pd.Timestamp(f"{y1}-05-01")
-        end = pd.Timestamp(f"{y1 + 1}-04-30")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>日付処理失敗: {e}</h3>", status_code=500)
+    start, end = term_dates(term)
 
     # ▼ 月ラベル（5月～翌年4月）
     months_range = pd.date_range(start=start, periods=12, freq="MS")
     months = [f"{d.year}年{d.month}月" for d in months_range]
 
-    # ▼ 見積金額集計（作業日が対象）
-    df_est = df[(df["作成日"] >= start) & (df["作成日"] <= end)].sort_values("作成日")
-    df_est = df_est.drop_duplicates("工事見積No.", keep="last")
-    df_est["年月"] = df_est["作成日"].dt.to_period("M").dt.to_timestamp()
-
-    summary_est = df_est.groupby("年月").agg(金額合計=("小計", "sum"), 件数=("工事見積No.", "count"))
-    summary_est = summary_est.reindex(months_range, fill_value=0)
-
-    estimate_amounts = summary_est["金額合計"].astype(int).tolist()
-    estimate_counts = summary_est["件数"].astype(int).tolist()
+    # ▼ 見積金額集計（作成日が対象）
+    estimate_amounts, estimate_counts = estimate_monthly(df, "作成日", start, end, months_range)
 
     # ▼ 決定金額集計（決定日が対象）
-    df_dec = df[(df["決定日"].notna()) & (df["決定日"] >= start) & (df["決定日"] <= end)]
-    df_dec = df_dec.sort_values("決定日").drop_duplicates("工事見積No.", keep="last")
-    df_dec["年月"] = df_dec["決定日"].dt.to_period("M").dt.to_timestamp()
-
-    summary_dec = df_dec.groupby("年月").agg(金額合計=("小計", "sum"), 件数=("工事見積No.", "count"))
-    summary_dec = summary_dec.reindex(months_range, fill_value=0)
-
-    decision_amounts = summary_dec["金額合計"].astype(int).tolist()
-    decision_counts = summary_dec["件数"].astype(int).tolist()
+    decision_amounts, decision_counts = estimate_monthly(df, "決定日", start, end, months_range)
 
     # ▼ 合計・平均・決定率の計算
     estimate_total_raw = sum(estimate_amounts)
@@ -549,8 +2630,7 @@ async def graph_estimate_total_term_result(request: Request, term: str = Form(..
     money_decision_rate = f"{(decision_total_raw / estimate_total_raw * 100):.1f}%" if estimate_total_raw > 0 else "0%"
     count_decision_rate = f"{(total_decision_count / total_estimate_count * 100):.1f}%" if total_estimate_count > 0 else "0%"
 
-    return templates.TemplateResponse("graph_estimate_total_term_result.html", {
-        "request": request,
+    return {
         "term": term,
         "months": months,
         "estimate_amounts": estimate_amounts,
@@ -562,82 +2642,51 @@ async def graph_estimate_total_term_result(request: Request, term: str = Form(..
         "estimate_per_case": estimate_per_case,
         "money_decision_rate": money_decision_rate,
         "count_decision_rate": count_decision_rate
-    })
-
-@app.get("/graph/estimate/total/compare", response_class=HTMLResponse)
-async def graph_estimate_total_compare(request: Request):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+    }
 
-    try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
-    except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+@app.post("/graph/estimate/total/term/result", response_class=HTMLResponse)
+async def graph_estimate_total_term_result(request: Request, term: str = Form(...)):
+    return render_shell(request, "graph_estimate_total_term_result.html", "/api/v1/estimate/total/term", term=term)
 
+def build_graph_estimate_total_compare():
     try:
-        df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-        df = df.dropna(subset=["作成日"])
-
-        min_date = df["作成日"].min()
-        max_date = df["作成日"].max()
-
-        start_year = min_date.year if min_date.month >= 5 else min_date.year - 1
-        end_year = max_date.year if max_date.month >= 5 else max_date.year - 1
-
-        periods = []
-        for year in range(start_year, end_year + 1):
-            term_start = pd.Timestamp(year=year, month=5, day=1)
-            term_end = pd.Timestamp(year=year + 1, month=4, day=30)
-            if not df[(df["作成日"] >= term_start) & (df["作成日"] <= term_end)].empty:
-                periods.append(f"{year}年5月～{year+1}年4月")
+        options = get_general_options()
     except Exception as e:
-        return HTMLResponse(content=f"<h3>期情報の取得失敗: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>期情報の取得失敗: {e}</h3>", 500)
 
-    return templates.TemplateResponse("graph_estimate_total_compare.html", {
-        "request": request,
-        "periods": periods
-    })
+    return {
+        "periods": options["periods"]
+    }
 
-@app.post("/graph/estimate/total/compare/result", response_class=HTMLResponse)
-async def graph_estimate_total_compare_result(request: Request, term: str = Form(...)):
-    csv_path = os.path.join("data", "一般工事売上データ.csv")
+@app.get("/graph/estimate/total/compare", response_class=HTMLResponse)
+async def graph_estimate_total_compare(request: Request):
+    return await render_report(request, "graph_estimate_total_compare.html", build_graph_estimate_total_compare, datasets=("general",))
 
+def build_graph_estimate_total_compare_result(term: str):
     # CSV読み込み
     try:
-        try:
-            df = pd.read_csv(csv_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            df = pd.read_csv(csv_path, encoding="cp932")
+        df = get_estimate_tables()["headers"]
     except Exception as e:
-        return HTMLResponse(content=f"<h3>CSV読み込みエラー: {e}</h3>", status_code=500)
+        raise ReportError(f"<h3>CSV読み込みエラー: {e}</h3>", 500)
 
-    # 日付変換と期間設定
-    df["作成日"] = pd.to_datetime(df["作成日"], errors="coerce")
-    df["決定日"] = pd.to_datetime(df["決定日"], errors="coerce")
-
-    y1 = int(term[:4])
-    start = pd.Timestamp(f"{y1}-05-01")
-    end = pd.Timestamp(f"{y1 + 1}-04-30")
+    # 期間設定
+    start, end = term_dates(term)
 
     # 担当者一覧
-    if "担当者名" not in df.columns:
-        return HTMLResponse(content="<h3>CSVに担当者名列が存在しません</h3>", status_code=500)
-    persons = sorted([p for p in df["担当者名"].dropna().unique() if "削除済み" not in p])
+    if "担当者名" not in df["作成日"].columns:
+        raise ReportError("<h3>CSVに担当者名列が存在しません</h3>", 500)
+    persons = sorted([p for p in df["作成日"]["担当者名"].dropna().unique() if "削除済み" not in p])
 
     # ▼ 見積集計（作成日）
-    df_est = df[(df["作成日"] >= start) & (df["作成日"] <= end)].copy()
-    df_est = df_est.sort_values("作成日").drop_duplicates("工事見積No.", keep="last")
-    est_summary = df_est.groupby("担当者名").agg(
+    df_est = estimate_rows(df, "作成日", start, end)
+    est_summary = df_est.groupby("担当者名", observed=True).agg(
         見積金額合計=("小計", "sum"),
         見積件数=("工事見積No.", "count")
     ).reindex(persons, fill_value=0)
 
     # ▼ 決定集計（決定日）
-    df_dec = df[(df["決定日"].notna()) & (df["決定日"] >= start) & (df["決定日"] <= end)].copy()
-    df_dec = df_dec.sort_values("決定日").drop_duplicates("工事見積No.", keep="last")
-    dec_summary = df_dec.groupby("担当者名").agg(
+    df_dec = estimate_rows(df, "決定日", start, end)
+    dec_summary = df_dec.groupby("担当者名", observed=True).agg(
         決定金額合計=("小計", "sum"),
         決定件数=("工事見積No.", "count")
     ).reindex(persons, fill_value=0)
@@ -661,8 +2710,7 @@ async def graph_estimate_total_compare_result(request: Request, term: str = Form
     money_decision_rate = f"{(decision_total_raw / estimate_total_raw * 100):.1f}%" if estimate_total_raw > 0 else "0%"
     count_decision_rate = f"{(total_decision_count / total_estimate_count * 100):.1f}%" if total_estimate_count > 0 else "0%"
 
-    return templates.TemplateResponse("graph_estimate_total_compare_result.html", {
-        "request": request,
+    return {
         "term": term,
         "persons": persons,
         "estimate_amounts": estimate_amounts,
@@ -674,7 +2722,11 @@ async def graph_estimate_total_compare_result(request: Request, term: str = Form
         "estimate_per_case": estimate_per_case,
         "money_decision_rate": money_decision_rate,
         "count_decision_rate": count_decision_rate
-    })
+    }
+
+@app.post("/graph/estimate/total/compare/result", response_class=HTMLResponse)
+async def graph_estimate_total_compare_result(request: Request, term: str = Form(...)):
+    return render_shell(request, "graph_estimate_total_compare_result.html", "/api/v1/estimate/total/compare", term=term)
 
 
 @app.get("/graph/menu", response_class=HTMLResponse)
@@ -699,39 +2751,20 @@ async def graph_menu(request: Request):
 @app.get("/graph/all", response_class=HTMLResponse)
 async def graph_all_menu(request: Request):
     return templates.TemplateResponse("graph_all_menu.html", {"request": request})
+def build_graph_term():
+    options = get_kousu_options()
+    return {
+        "terms": options["terms"],
+        "work_types": options["work_types"]
+    }
+
 @app.get("/graph/term", response_class=HTMLResponse)
 async def graph_term(request: Request):
-    try:
-        df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    except UnicodeDecodeError:
-        df = pd.read_csv(CSV_PATH, encoding="cp932")
-    df.columns = [col.strip() for col in df.columns]
-    df = df.rename(columns={"作業日": "日付", "作業実施者": "作業者", "作業種別": "作業種別", "作業時間": "時間"})
-    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-    df = df.dropna(subset=["日付", "作業種別"])
-
-    def get_term(date):
-        y = date.year
-        return f"{y-1}年5月～{y}年4月" if date.month < 5 else f"{y}年5月～{y+1}年4月"
-    df["期"] = df["日付"].apply(get_term)
-
-    term_list = sorted(df["期"].unique(), reverse=True)
-    work_types = sorted([w for w in df["作業種別"].unique() if w != "小計"])
-
-    return templates.TemplateResponse("graph_term.html", {
-        "request": request,
-        "terms": term_list,
-        "work_types": work_types
-    })
+    return await render_report(request, "graph_term.html", build_graph_term, datasets=("kousu",))
 from collections import defaultdict
 import os
 
-@app.post("/graph/term/result", response_class=HTMLResponse)
-async def graph_term_result(
-    request: Request,
-    term: str = Form(...),
-    work_types: List[str] = Form(...)
-):
+def build_graph_term_result(term: str, work_types: List[str]):
     # カラーパレット（10色）
     color_list_rgba = [
         "rgba(31, 119, 180, 0.7)", "rgba(255, 127, 14, 0.7)",
@@ -741,171 +2774,72 @@ async def graph_term_result(
         "rgba(188, 189, 34, 0.7)", "rgba(23, 190, 207, 0.7)"
     ]
 
-    # ▼ 通常作業データ読み込み
-    try:
-        df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    except UnicodeDecodeError:
-        df = pd.read_csv(CSV_PATH, encoding="cp932")
-
-    df.columns = [col.strip() for col in df.columns]
-    df = df.rename(columns={
-        "作業日": "日付",
-        "作業実施者": "作業者",
-        "作業種別": "作業種別",
-        "作業時間": "時間"
-    })
-    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-    df = df.dropna(subset=["日付", "作業種別", "作業者", "時間"])
-    df["時間"] = pd.to_numeric(df["時間"], errors="coerce")
-    df = df.dropna()
-
-    def get_term(date):
-        y = date.year
-        return f"{y-1}年5月～{y}年4月" if date.month < 5 else f"{y}年5月～{y+1}年4月"
-
-    df["期"] = df["日付"].apply(get_term)
-    df = df[df["期"] == term]
-    df = df[df["作業種別"].isin(work_types)]
-    df = df[~df["作業者"].str.contains("削除済み", na=False)]
-
-    df["年月"] = df["日付"].dt.strftime("%Y-%m")
-    grouped = df.groupby(["年月", "作業種別"])
-
-    result = defaultdict(lambda: {"時間合計": 0.0, "件数": 0})
-    for (ym, wt), group in grouped:
-        result[(ym, wt)]["時間合計"] += group["時間"].sum()
-        result[(ym, wt)]["件数"] += len(group)
-
-    labels = sorted(set(ym for ym, _ in result))
-    time_datasets = []
-    count_datasets = []
-
-    for idx, wt in enumerate(work_types):
-        color = color_list_rgba[idx % len(color_list_rgba)]
-        time_data = [result[(ym, wt)]["時間合計"] if (ym, wt) in result else 0 for ym in labels]
-        count_data = [result[(ym, wt)]["件数"] if (ym, wt) in result else 0 for ym in labels]
-        time_datasets.append({"label": f"{wt}（時間）", "data": time_data, "stack": "main", "backgroundColor": color})
-        count_datasets.append({"label": f"{wt}（件数）", "data": count_data, "stack": "main", "backgroundColor": color})
+    # ▼ 通常作業データ（工数キューブから該当期の月キー範囲をスライス。表記が不正な期は空）
+    term_value = parse_term_label(term)
+    first, last = term_months(term_value) if term_value is not None else (0, -1)
+    cube = sorted_slice(get_kousu_cube(), "年月", first, last)
+    cube = cube[cube["作業種別"].isin(work_types) & ~cube["削除済み"]]
+    # ▼ (年月×作業種別) の密行列に集計してそのまま系列にする
+    labels = sorted(cube["年月"].unique())
+    chart = stacked_chart(
+        dense_matrix(cube, "年月", "作業種別", labels, work_types, "時間合計"),
+        dense_matrix(cube, "年月", "作業種別", labels, work_types, "件数"),
+        color_list_rgba
+    )
 
     # ▼ 検査工数データ読み込み（点検及び検査のみ）
     kensa_totals = {}
     if work_types == ["点検及び検査"]:
-        kensa_path = os.path.join("data", "検査工数データ.csv")
-        try:
-            kensa_df = pd.read_csv(kensa_path, encoding="utf-8")
-        except UnicodeDecodeError:
-            kensa_df = pd.read_csv(kensa_path, encoding="cp932")
-
-        kensa_df.columns = [col.strip() for col in kensa_df.columns]
-        kensa_df = kensa_df.rename(columns={
-            "作業日": "日付",
-            "作業ID": "作業ID",
-            "作業実施者": "作業者",
-            "作業項目(箇所)": "項目",
-            "作業時間": "時間"
-        })
-        kensa_df["日付"] = pd.to_datetime(kensa_df["日付"], errors="coerce")
-        kensa_df["時間"] = pd.to_numeric(kensa_df["時間"], errors="coerce")
+        kensa_df = dataset_cache.get("kensa")
+        if term_value is not None:
+            kensa_df = sorted_slice(kensa_df, "日付", *month_dates(first, last))
         kensa_df = kensa_df.dropna(subset=["日付", "項目", "作業ID"])
-        kensa_df["年月"] = kensa_df["日付"].dt.strftime("%Y-%m")
-        kensa_df = kensa_df[kensa_df["項目"].isin(["法定検査", "社内検査"])]
+        kensa_df["年月"] = month_keys(kensa_df["日付"])
+        kensa_df = kensa_df[kensa_df["項目"].isin(KENSA_ITEMS)]
         kensa_df = kensa_df.drop_duplicates(subset=["作業ID", "項目"])
 
-        grouped_kensa = kensa_df.groupby(["年月", "項目"]).agg(
-            件数=("作業ID", "count"),
-            合計時間=("時間", "sum")
-        ).reset_index()
-
-        result_kensa = defaultdict(lambda: {"法定検査_件数": 0, "法定検査_時間": 0, "社内検査_件数": 0, "社内検査_時間": 0})
-        for _, row in grouped_kensa.iterrows():
-            ym = row["年月"]
-            if row["項目"] == "法定検査":
-                result_kensa[ym]["法定検査_件数"] = row["件数"]
-                result_kensa[ym]["法定検査_時間"] = row["合計時間"]
-            elif row["項目"] == "社内検査":
-                result_kensa[ym]["社内検査_件数"] = row["件数"]
-                result_kensa[ym]["社内検査_時間"] = row["合計時間"]
-
-        for ym in labels:
-            total_time = result_kensa[ym]["法定検査_時間"] + result_kensa[ym]["社内検査_時間"]
-            total_count = result_kensa[ym]["法定検査_件数"] + result_kensa[ym]["社内検査_件数"]
-            kensa_totals[ym] = {"時間合計": total_time, "件数合計": total_count}
-
         # 検査データは2色固定
-        time_datasets.append({
-            "label": "法定検査",
-            "data": [result_kensa[ym]["法定検査_時間"] if ym in result_kensa else 0 for ym in labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(255, 127, 14, 0.7)"
-        })
-        time_datasets.append({
-            "label": "社内検査",
-            "data": [result_kensa[ym]["社内検査_時間"] if ym in result_kensa else 0 for ym in labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(44, 160, 44, 0.7)"
-        })
-        count_datasets.append({
-            "label": "法定検査",
-            "data": [result_kensa[ym]["法定検査_件数"] if ym in result_kensa else 0 for ym in labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(255, 127, 14, 0.7)"
-        })
-        count_datasets.append({
-            "label": "社内検査",
-            "data": [result_kensa[ym]["社内検査_件数"] if ym in result_kensa else 0 for ym in labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(44, 160, 44, 0.7)"
-        })
+        kensa_totals = kensa_overlay(chart, kensa_df, "年月", labels)
 
-    return templates.TemplateResponse("graph_term_result.html", {
-        "request": request,
+    # ▼ 月キー → 表示ラベル
+    ym_text = month_dimension(labels)["年月"]
+    return {
         "term": term,
-        "labels": labels,
-        "time_datasets": time_datasets,
-        "count_datasets": count_datasets,
+        "labels": [ym_text[ym] for ym in labels],
+        "chart": chart,
         "work_types": work_types,
         "kensa_totals": kensa_totals
-    })
+    }
+
+@app.post("/graph/term/result", response_class=HTMLResponse)
+async def graph_term_result(
+    request: Request,
+    term: str = Form(...),
+    work_types: List[str] = Form(...)
+):
+    return render_shell(request, "graph_term_result.html", "/api/v1/kousu/term", term=term, work_types=work_types)
 
 
 # ==========================
 # Part 3: 月別・個人比較関連
 # ==========================
 
+def build_graph_month():
+    options = get_kousu_options()
+    return {
+        "years": options["years"],
+        "months": options["months"],
+        "work_types": options["work_types"]
+    }
+
 @app.get("/graph/month", response_class=HTMLResponse)
 async def graph_month(request: Request):
-    try:
-        df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    except UnicodeDecodeError:
-        df = pd.read_csv(CSV_PATH, encoding="cp932")
-    df.columns = [col.strip() for col in df.columns]
-    df = df.rename(columns={"作業日": "日付", "作業実施者": "作業者", "作業種別": "作業種別", "作業時間": "時間"})
-    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-    df = df.dropna(subset=["日付", "作業種別"])
-
-    df["年"] = df["日付"].dt.year
-    df["月"] = df["日付"].dt.month
-    work_types = sorted([w for w in df["作業種別"].unique() if w != "小計"])
-    years = sorted(df["年"].unique(), reverse=True)
-    months = sorted(df["月"].unique())
-
-    return templates.TemplateResponse("graph_month.html", {
-        "request": request,
-        "years": years,
-        "months": months,
-        "work_types": work_types
-    })
+    return await render_report(request, "graph_month.html", build_graph_month, datasets=("kousu",))
 
 from collections import defaultdict
 import os
 
-@app.post("/graph/month/result", response_class=HTMLResponse)
-async def graph_month_result(
-    request: Request,
-    year: int = Form(...),
-    month: int = Form(...),
-    work_types: List[str] = Form(...)
-):
+def build_graph_month_result(year: int, month: int, work_types: List[str]):
     # ▼ カラーパレット
     color_list_rgba = [
         "rgba(31, 119, 180, 0.7)", "rgba(255, 127, 14, 0.7)",
@@ -915,120 +2849,47 @@ async def graph_month_result(
         "rgba(188, 189, 34, 0.7)", "rgba(23, 190, 207, 0.7)"
     ]
 
-    # ▼ CSV読み込み（通常作業データ）
-    try:
-        df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    except UnicodeDecodeError:
-        df = pd.read_csv(CSV_PATH, encoding="cp932")
-
-    df.columns = [col.strip() for col in df.columns]
-    df = df.rename(columns={"作業日": "日付", "作業実施者": "作業者", "作業種別": "作業種別", "作業時間": "時間"})
-    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-    df["時間"] = pd.to_numeric(df["時間"], errors="coerce")
-    df = df.dropna(subset=["日付", "作業者", "作業種別", "時間"])
-
-    df = df[(df["日付"].dt.year == year) & (df["日付"].dt.month == month)]
-    df = df[df["作業種別"].isin(work_types)]
-    df = df[~df["作業者"].str.contains("削除済み", na=False)]
+    # ▼ 通常作業データ（工数キューブから該当月をスライス）
+    key = month_key(year, month)
+    cube = sorted_slice(get_kousu_cube(), "年月", key, key)
+    cube = cube[cube["作業種別"].isin(work_types) & ~cube["削除済み"]]
 
-    # ▼ 通常作業集計
-    result = defaultdict(lambda: {"時間合計": 0.0, "件数": 0})
-    for _, row in df.iterrows():
-        key = (row["作業者"], row["作業種別"])
-        result[key]["時間合計"] += row["時間"]
-        result[key]["件数"] += 1
-
-    users = sorted(set(k[0] for k in result))
-    time_datasets = []
-    count_datasets = []
-
-    for idx, wt in enumerate(work_types):
-        color = color_list_rgba[idx % len(color_list_rgba)]
-        time_data = [result[(u, wt)]["時間合計"] if (u, wt) in result else 0 for u in users]
-        count_data = [result[(u, wt)]["件数"] if (u, wt) in result else 0 for u in users]
-        time_datasets.append({"label": f"{wt}（時間）", "data": time_data, "stack": "main", "backgroundColor": color})
-        count_datasets.append({"label": f"{wt}（件数）", "data": count_data, "stack": "main", "backgroundColor": color})
+    # ▼ 通常作業集計（作業者×作業種別の密行列）
+    users = sorted(cube["作業者"].unique())
+    chart = stacked_chart(
+        dense_matrix(cube, "作業者", "作業種別", users, work_types, "時間合計"),
+        dense_matrix(cube, "作業者", "作業種別", users, work_types, "件数"),
+        color_list_rgba
+    )
 
     # ▼ 【点検及び検査】のみ選択時の検査データ集計
     kensa_totals = {}
     if work_types == ["点検及び検査"]:
-        kensa_path = os.path.join("data", "検査工数データ.csv")
-        try:
-            kensa_df = pd.read_csv(kensa_path, encoding="utf-8")
-        except UnicodeDecodeError:
-            kensa_df = pd.read_csv(kensa_path, encoding="cp932")
-
-        kensa_df.columns = [col.strip() for col in kensa_df.columns]
-        kensa_df = kensa_df.rename(columns={
-            "作業日": "日付",
-            "作業ID": "作業ID",
-            "作業実施者": "作業者",
-            "作業項目(箇所)": "項目",
-            "作業時間": "時間"
-        })
-        kensa_df["日付"] = pd.to_datetime(kensa_df["日付"], errors="coerce")
-        kensa_df["時間"] = pd.to_numeric(kensa_df["時間"], errors="coerce")
+        kensa_df = sorted_slice(dataset_cache.get("kensa"), "日付", *month_dates(key, key))
         kensa_df = kensa_df.dropna(subset=["日付", "作業者", "項目", "時間", "作業ID"])
-        kensa_df = kensa_df[(kensa_df["日付"].dt.year == year) & (kensa_df["日付"].dt.month == month)]
-        kensa_df = kensa_df[kensa_df["項目"].isin(["法定検査", "社内検査"])]
+        kensa_df = kensa_df[kensa_df["項目"].isin(KENSA_ITEMS)]
         kensa_df = kensa_df.drop_duplicates(subset=["作業ID", "項目"])
 
-        grouped_kensa = kensa_df.groupby(["作業者", "項目"]).agg(
-            件数=("作業ID", "count"),
-            合計時間=("時間", "sum")
-        ).reset_index()
-
-        kensa_data = defaultdict(lambda: {"法定検査_時間": 0, "社内検査_時間": 0, "法定検査_件数": 0, "社内検査_件数": 0})
-        for _, row in grouped_kensa.iterrows():
-            user = row["作業者"]
-            if row["項目"] == "法定検査":
-                kensa_data[user]["法定検査_時間"] = row["合計時間"]
-                kensa_data[user]["法定検査_件数"] = row["件数"]
-            elif row["項目"] == "社内検査":
-                kensa_data[user]["社内検査_時間"] = row["合計時間"]
-                kensa_data[user]["社内検査_件数"] = row["件数"]
-
-        for u in users:
-            total_time = kensa_data[u]["法定検査_時間"] + kensa_data[u]["社内検査_時間"]
-            total_count = kensa_data[u]["法定検査_件数"] + kensa_data[u]["社内検査_件数"]
-            kensa_totals[u] = {"時間合計": total_time, "件数合計": total_count}
-
         # 検査データは2色固定
-        time_datasets.append({
-            "label": "法定検査",
-            "data": [kensa_data[u]["法定検査_時間"] if u in kensa_data else 0 for u in users],
-            "stack": "検査",
-            "backgroundColor": "rgba(255, 127, 14, 0.7)"
-        })
-        time_datasets.append({
-            "label": "社内検査",
-            "data": [kensa_data[u]["社内検査_時間"] if u in kensa_data else 0 for u in users],
-            "stack": "検査",
-            "backgroundColor": "rgba(44, 160, 44, 0.7)"
-        })
-        count_datasets.append({
-            "label": "法定検査",
-            "data": [kensa_data[u]["法定検査_件数"] if u in kensa_data else 0 for u in users],
-            "stack": "検査",
-            "backgroundColor": "rgba(255, 127, 14, 0.7)"
-        })
-        count_datasets.append({
-            "label": "社内検査",
-            "data": [kensa_data[u]["社内検査_件数"] if u in kensa_data else 0 for u in users],
-            "stack": "検査",
-            "backgroundColor": "rgba(44, 160, 44, 0.7)"
-        })
+        kensa_totals = kensa_overlay(chart, kensa_df, "作業者", users)
 
-    return templates.TemplateResponse("graph_month_result.html", {
-        "request": request,
+    return {
         "year": year,
         "month": month,
         "labels": users,
-        "time_datasets": time_datasets,
-        "count_datasets": count_datasets,
+        "chart": chart,
         "work_types": work_types,
         "kensa_totals": kensa_totals
-    })
+    }
+
+@app.post("/graph/month/result", response_class=HTMLResponse)
+async def graph_month_result(
+    request: Request,
+    year: int = Form(...),
+    month: int = Form(...),
+    work_types: List[str] = Form(...)
+):
+    return render_shell(request, "graph_month_result.html", "/api/v1/kousu/month", year=year, month=month, work_types=work_types)
 
 
 # ==========================
@@ -1039,79 +2900,36 @@ async def graph_month_result(
 async def graph_person_menu(request: Request):
     return templates.TemplateResponse("graph_person_menu.html", {"request": request})
 
-@app.get("/graph/person/type", response_class=HTMLResponse)
-async def graph_person_type_input(request: Request):
+def build_graph_person_type_input():
     try:
-        try:
-            df = pd.read_csv(CSV_PATH, encoding="utf-8")
-        except UnicodeDecodeError:
-            df = pd.read_csv(CSV_PATH, encoding="cp932")
-
-        df.columns = [col.strip() for col in df.columns]
-        df = df.rename(columns={
-            "作業日": "日付",
-            "作業実施者": "作業者",
-            "作業種別": "作業種別",
-            "作業時間": "時間"
-        })
-
-        df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-        df = df.dropna(subset=["日付", "作業者"])
-
-        df["年"] = df["日付"].dt.year
-        df["月"] = df["日付"].dt.month
-
-        years = sorted(df["年"].unique(), reverse=True)
-        months = list(range(1, 13))
-        users = sorted(df["作業者"].dropna().unique())
-        users = [u for u in users if "削除済み" not in u]
-
-        return templates.TemplateResponse("graph_person_type.html", {
-            "request": request,
-            "years": years,
-            "months": months,
-            "users": users
-        })
+        options = get_kousu_options()
+        return {
+            "years": options["person_years"],
+            "months": list(range(1, 13)),
+            "users": options["person_users"]
+        }
 
     except Exception as e:
-        return HTMLResponse(f"エラー: {e}", status_code=500)
+        raise ReportError(f"エラー: {e}", 500)
+
+@app.get("/graph/person/type", response_class=HTMLResponse)
+async def graph_person_type_input(request: Request):
+    return await render_report(request, "graph_person_type.html", build_graph_person_type_input, datasets=("kousu",))
 
 
 # 作業種別比較表（表示）
 # 作業種別比較表（表示）
-@app.post("/graph/person/type/result", response_class=HTMLResponse)
-async def graph_person_type_result(
-    request: Request,
-    year: int = Form(...),
-    month: int = Form(...),
-    user: str = Form(...)
-):
-    try:
-        df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    except UnicodeDecodeError:
-        df = pd.read_csv(CSV_PATH, encoding="cp932")
-
-    df.columns = [col.strip() for col in df.columns]
-    df = df.rename(columns={
-        "作業日": "日付", "作業実施者": "作業者",
-        "作業種別": "作業種別", "作業時間": "時間"
-    })
-    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-    df["時間"] = pd.to_numeric(df["時間"], errors="coerce")
-    df = df.dropna(subset=["日付", "作業者", "作業種別", "時間"])
-
-    df = df[
-        (df["日付"].dt.year == year) &
-        (df["日付"].dt.month == month) &
-        (df["作業者"] == user)
-    ]
-    df = df[df["作業種別"] != "小計"]
+def build_graph_person_type_result(year: int, month: int, user: str):
+    key = month_key(year, month)
+    cube = sorted_slice(get_kousu_cube(), "年月", key, key)
+    cube = cube[cube["作業者"] == user]
+    cube = cube[cube["作業種別"] != "小計"]
 
-    grouped = df.groupby("作業種別")
+    grouped = cube.groupby("作業種別", observed=True)
     result = {
         wt: {
-            "時間合計": float(group["時間"].sum()),
-            "件数": int(len(group))
+            "時間合計": float(group["時間合計"].sum()),
+            "件数": int(group["件数"].sum())
         }
         for wt, group in grouped
     }
@@ -1133,71 +2951,46 @@ async def graph_person_type_result(
         {"label": "件数（件）", "data": count_data}
     ]
 
-    return templates.TemplateResponse("graph_person_type_result.html", {
-        "request": request,
+    return {
         "labels": labels,
         "datasets": datasets,
         "year": year,
         "month": month,
         "user": user
-    })
-
-@app.get("/graph/person/period", response_class=HTMLResponse)
-async def graph_person_period_input(request: Request):
-    try:
-        try:
-            df = pd.read_csv(CSV_PATH, encoding="utf-8")
-        except UnicodeDecodeError:
-            df = pd.read_csv(CSV_PATH, encoding="cp932")
-
-        df.columns = [col.strip() for col in df.columns]
-        df = df.rename(columns={
-            "作業日": "日付",
-            "作業実施者": "作業者",
-            "作業種別": "作業種別",
-            "作業時間": "時間"
-        })
-
-        df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-        df = df.dropna(subset=["日付", "作業者", "作業種別"])
-
-        df["年"] = df["日付"].dt.year
-        df["月"] = df["日付"].dt.month
-
-        years = sorted(df["年"].unique(), reverse=True)
-        months = list(range(1, 13))
-        users = sorted(df["作業者"].dropna().unique())
-        users = [u for u in users if "削除済み" not in u]
+    }
 
-        work_types = sorted(df["作業種別"].unique())
-        work_types = [w for w in work_types if w != "小計"]
+@app.post("/graph/person/type/result", response_class=HTMLResponse)
+async def graph_person_type_result(
+    request: Request,
+    year: int = Form(...),
+    month: int = Form(...),
+    user: str = Form(...)
+):
+    return render_shell(request, "graph_person_type_result.html", "/api/v1/kousu/person/type", year=year, month=month, user=user)
 
-        return templates.TemplateResponse("graph_person_period.html", {
-            "request": request,
-            "years": years,
-            "months": months,
-            "users": users,
-            "work_types": work_types
-        })
+def build_graph_person_period_input():
+    try:
+        options = get_kousu_options()
+        return {
+            "years": options["period_years"],
+            "months": list(range(1, 13)),
+            "users": options["period_users"],
+            "work_types": options["period_work_types"]
+        }
 
     except Exception as e:
-        return HTMLResponse(f"エラー：{e}", status_code=500)
+        raise ReportError(f"エラー：{e}", 500)
+
+@app.get("/graph/person/period", response_class=HTMLResponse)
+async def graph_person_period_input(request: Request):
+    return await render_report(request, "graph_person_period.html", build_graph_person_period_input, datasets=("kousu",))
 
 # 期間指定比較表（表示）
 from collections import defaultdict
 import os
 from pandas.tseries.offsets import MonthEnd  # 追加
 
-@app.post("/graph/person/period/result", response_class=HTMLResponse)
-async def graph_person_period_result(
-    request: Request,
-    start_year: int = Form(...),
-    start_month: int = Form(...),
-    end_year: int = Form(...),
-    end_month: int = Form(...),
-    user: str = Form(...),
-    work_types: List[str] = Form(...)
-):
+def build_graph_person_period_result(start_year: int, start_month: int, end_year: int, end_month: int, user: str, work_types: List[str]):
     # ▼ カラーパレット
     color_list_rgba = [
         "rgba(31, 119, 180, 0.7)", "rgba(255, 127, 14, 0.7)",
@@ -1208,432 +3001,305 @@ async def graph_person_period_result(
     ]
 
     # ▼ 通常作業データ読み込み
-    try:
-        df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    except UnicodeDecodeError:
-        df = pd.read_csv(CSV_PATH, encoding="cp932")
-
-    df.columns = [col.strip() for col in df.columns]
-    df = df.rename(columns={
-        "作業日": "日付", "作業実施者": "作業者",
-        "作業種別": "作業種別", "作業時間": "時間"
-    })
-    df["日付"] = pd.to_datetime(df["日付"], errors="coerce")
-    df["時間"] = pd.to_numeric(df["時間"], errors="coerce")
-    df = df.dropna(subset=["日付", "作業者", "作業種別", "時間"])
-
-    df = df[df["作業者"] == user]
-    df = df[df["作業種別"].isin(work_types)]
-    df = df[df["作業種別"] != "小計"]
-
-    df["年月"] = df["日付"].dt.strftime("%Y-%m")
     start = pd.to_datetime(f"{start_year}-{start_month:02d}")
     end = pd.to_datetime(f"{end_year}-{end_month:02d}") + MonthEnd(0)  # 修正ポイント！
-    df = df[(df["日付"] >= start) & (df["日付"] <= end)]
-
-    grouped = df.groupby(["年月", "作業種別"])
-    result = defaultdict(lambda: {"時間合計": 0.0, "件数": 0})
-    for (ym, wt), group in grouped:
-        result[(ym, wt)]["時間合計"] += group["時間"].sum()
-        result[(ym, wt)]["件数"] += len(group)
 
-    ym_labels = sorted(set(ym for ym, _ in result))
-    time_datasets = []
-    count_datasets = []
+    cube = sorted_slice(get_kousu_cube(), "年月", month_key(start.year, start.month), month_key(end.year, end.month))
+    cube = cube[cube["作業者"] == user]
+    cube = cube[cube["作業種別"].isin(work_types)]
+    cube = cube[cube["作業種別"] != "小計"]
 
-    for idx, wt in enumerate(work_types):
-        color = color_list_rgba[idx % len(color_list_rgba)]
-        time_data = [result[(ym, wt)]["時間合計"] if (ym, wt) in result else 0 for ym in ym_labels]
-        count_data = [result[(ym, wt)]["件数"] if (ym, wt) in result else 0 for ym in ym_labels]
-        time_datasets.append({"label": f"{wt}（時間）", "data": time_data, "stack": "main", "backgroundColor": color})
-        count_datasets.append({"label": f"{wt}（件数）", "data": count_data, "stack": "main", "backgroundColor": color})
+    # ▼ (年月×作業種別) の密行列に集計してそのまま系列にする
+    ym_labels = sorted(cube["年月"].unique())
+    chart = stacked_chart(
+        dense_matrix(cube, "年月", "作業種別", ym_labels, work_types, "時間合計"),
+        dense_matrix(cube, "年月", "作業種別", ym_labels, work_types, "件数"),
+        color_list_rgba
+    )
 
     # ▼ 検査工数データ読み込み（点検及び検査のみ）
     kensa_totals = {}
     if work_types == ["点検及び検査"]:
-        kensa_path = os.path.join("data", "検査工数データ.csv")
-        try:
-            kensa_df = pd.read_csv(kensa_path, encoding="utf-8")
-        except UnicodeDecodeError:
-            kensa_df = pd.read_csv(kensa_path, encoding="cp932")
-
-        kensa_df.columns = [col.strip() for col in kensa_df.columns]
-        kensa_df = kensa_df.rename(columns={
-            "作業日": "日付",
-            "作業ID": "作業ID",
-            "作業実施者": "作業者",
-            "作業項目(箇所)": "項目",
-            "作業時間": "時間"
-        })
-        kensa_df["日付"] = pd.to_datetime(kensa_df["日付"], errors="coerce")
-        kensa_df["時間"] = pd.to_numeric(kensa_df["時間"], errors="coerce")
+        kensa_df = sorted_slice(dataset_cache.get("kensa"), "日付", start, end)
         kensa_df = kensa_df.dropna(subset=["日付", "項目", "作業ID"])
-        kensa_df["年月"] = kensa_df["日付"].dt.strftime("%Y-%m")
-        kensa_df = kensa_df[kensa_df["項目"].isin(["法定検査", "社内検査"])]
+        kensa_df["年月"] = month_keys(kensa_df["日付"])
+        kensa_df = kensa_df[kensa_df["項目"].isin(KENSA_ITEMS)]
         kensa_df = kensa_df[kensa_df["作業者"] == user]
-        kensa_df = kensa_df[(kensa_df["日付"] >= start) & (kensa_df["日付"] <= end)]
         kensa_df = kensa_df.drop_duplicates(subset=["作業ID", "項目"])
 
-        grouped_kensa = kensa_df.groupby(["年月", "項目"]).agg(
-            件数=("作業ID", "count"),
-            合計時間=("時間", "sum")
-        ).reset_index()
-
-        result_kensa = defaultdict(lambda: {"法定検査_件数": 0, "法定検査_時間": 0, "社内検査_件数": 0, "社内検査_時間": 0})
-        for _, row in grouped_kensa.iterrows():
-            ym = row["年月"]
-            if row["項目"] == "法定検査":
-                result_kensa[ym]["法定検査_件数"] = row["件数"]
-                result_kensa[ym]["法定検査_時間"] = row["合計時間"]
-            elif row["項目"] == "社内検査":
-                result_kensa[ym]["社内検査_件数"] = row["件数"]
-                result_kensa[ym]["社内検査_時間"] = row["合計時間"]
-
-        for ym in ym_labels:
-            total_time = result_kensa[ym]["法定検査_時間"] + result_kensa[ym]["社内検査_時間"]
-            total_count = result_kensa[ym]["法定検査_件数"] + result_kensa[ym]["社内検査_件数"]
-            kensa_totals[ym] = {"時間合計": total_time, "件数合計": total_count}
-
         # 検査データ（2色固定）
-        time_datasets.append({
-            "label": "法定検査",
-            "data": [result_kensa[ym]["法定検査_時間"] if ym in result_kensa else 0 for ym in ym_labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(255, 127, 14, 0.7)"
-        })
-        time_datasets.append({
-            "label": "社内検査",
-            "data": [result_kensa[ym]["社内検査_時間"] if ym in result_kensa else 0 for ym in ym_labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(44, 160, 44, 0.7)"
-        })
-        count_datasets.append({
-            "label": "法定検査",
-            "data": [result_kensa[ym]["法定検査_件数"] if ym in result_kensa else 0 for ym in ym_labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(255, 127, 14, 0.7)"
-        })
-        count_datasets.append({
-            "label": "社内検査",
-            "data": [result_kensa[ym]["社内検査_件数"] if ym in result_kensa else 0 for ym in ym_labels],
-            "stack": "検査",
-            "backgroundColor": "rgba(44, 160, 44, 0.7)"
-        })
+        kensa_totals = kensa_overlay(chart, kensa_df, "年月", ym_labels)
 
-    return templates.TemplateResponse("graph_person_period_result.html", {
-        "request": request,
-        "labels": ym_labels,
-        "time_datasets": time_datasets,
-        "count_datasets": count_datasets,
+    # ▼ 月キー → 表示ラベル
+    ym_text = month_dimension(ym_labels)["年月"]
+    return {
+        "labels": [ym_text[ym] for ym in ym_labels],
+        "chart": chart,
         "user": user,
         "start": f"{start_year}年{start_month}月",
         "end": f"{end_year}年{end_month}月",
         "work_types": work_types,
         "kensa_totals": kensa_totals
-    })
+    }
+
+@app.post("/graph/person/period/result", response_class=HTMLResponse)
+async def graph_person_period_result(
+    request: Request,
+    start_year: int = Form(...),
+    start_month: int = Form(...),
+    end_year: int = Form(...),
+    end_month: int = Form(...),
+    user: str = Form(...),
+    work_types: List[str] = Form(...)
+):
+    return render_shell(request, "graph_person_period_result.html", "/api/v1/kousu/person/period", start_year=start_year, start_month=start_month, end_year=end_year, end_month=end_month, user=user, work_types=work_types)
 
 # ==========================
-#       API連携
+#    JSON API（/api/v1）
 # ==========================
-@app.post("/api/receive_data")
-async def receive_data(records: UploadFile = File(...)):
-    contents = await records.read()
-
-    # CSV読み込み
-    try:
-        new_df = pd.read_csv(io.BytesIO(contents), encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        new_df = pd.read_csv(io.BytesIO(contents), encoding="cp932")
-
-    # カラム名正規化（全角カッコ→半角）
-    new_df.columns = [col.strip().replace("（", "(").replace("）", ")").replace('"', "").replace("'", "") for col in new_df.columns]
-
-    print("📋 修正後カラム:", new_df.columns.tolist())
-
-    # 作業時間処理
-    time_col = next((col for col in new_df.columns if "作業時間" in col), None)
-    new_df["作業時間"] = pd.to_numeric(new_df[time_col], errors="coerce") if time_col else 0.0
-
-    expected_cols = ["作業ID", "作業日", "作業実施者", "作業項目(箇所)", "作業時間"]
-    new_df = new_df[[col for col in new_df.columns if col in expected_cols]]
-    new_df = new_df.reindex(columns=expected_cols)
-
-    os.makedirs("data", exist_ok=True)
-    save_path = os.path.join("data", "検査工数データ.csv")
-
-    if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-        try:
-            existing_df = pd.read_csv(save_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            existing_df = pd.read_csv(save_path, encoding="cp932")
-    else:
-        existing_df = pd.DataFrame(columns=expected_cols)
+# 各グラフ・一覧の数値をJSONで返す。結果ページはこれを取得して描画する（他ツールからの利用も可）。
+# パラメータ名は各入力フォームの項目名と同じ。参照するデータセットの版でETagを付ける。
 
-    existing_df.columns = [col.strip().replace("（", "(").replace("）", ")") for col in existing_df.columns]
-    existing_df = existing_df[[col for col in existing_df.columns if col in expected_cols]]
-    existing_df = existing_df.reindex(columns=expected_cols)
+@app.get("/api/v1/kousu/term")
+async def api_kousu_term(request: Request, term: str, work_types: List[str] = Query(...)):
+    return await report_json(request, ("kousu", "kensa"), build_graph_term_result, term, work_types)
 
-    # 重複排除した上で MultiIndex を作成
-    key_cols = ["作業ID", "作業項目(箇所)"]
-    new_df = new_df.drop_duplicates(subset=key_cols, keep="last")
-    existing_df = existing_df.drop_duplicates(subset=key_cols, keep="last")
+@app.get("/api/v1/kousu/month")
+async def api_kousu_month(request: Request, year: int, month: int, work_types: List[str] = Query(...)):
+    return await report_json(request, ("kousu", "kensa"), build_graph_month_result, year, month, work_types)
 
-    try:
-        new_df.set_index(key_cols, inplace=True)
-        existing_df.set_index(key_cols, inplace=True)
-    except KeyError:
-        return JSONResponse(status_code=400, content={"status": "error", "message": "必要なキー列が存在しません。"})
+@app.get("/api/v1/kousu/person/type")
+async def api_kousu_person_type(request: Request, year: int, month: int, user: str):
+    return await report_json(request, ("kousu",), build_graph_person_type_result, year, month, user)
 
-    # 更新処理：新規追加 + 内容更新
-    updated_df = existing_df.combine_first(new_df)
-    updated_df.update(new_df)
+@app.get("/api/v1/kousu/person/period")
+async def api_kousu_person_period(
+    request: Request,
+    start_year: int,
+    start_month: int,
+    end_year: int,
+    end_month: int,
+    user: str,
+    work_types: List[str] = Query(...)
+):
+    return await report_json(request, ("kousu", "kensa"), build_graph_person_period_result, start_year, start_month, end_year, end_month, user, work_types)
 
-    # 保存とGitHub反映
-    updated_df.reset_index(inplace=True)
-    updated_df.to_csv(save_path, index=False, encoding="utf-8-sig")
+@app.get("/api/v1/estimate/person/term")
+async def api_estimate_person_term(request: Request, term: str = None, person: str = None):
+    return await report_json(request, ("general",), build_graph_estimate_person_term_result, term, person)
 
-    try:
-        GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-        repo_owner = "otameshi-web"
-        repo_name = "kousu-app"
-        branch = "master"
-        file_path = "data/検査工数データ.csv"
-        api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contents/{file_path}"
-
-        headers = {
-            "Authorization": f"Bearer {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github+json"
-        }
-        get_resp = requests.get(api_url, headers=headers, params={"ref": branch})
-        sha = get_resp.json().get("sha", None)
+@app.get("/api/v1/estimate/person/term/detail")
+async def api_estimate_person_term_detail(request: Request, term: str, person: str, year: int, month: int, type: str):
+    return await report_json(request, ("general",), build_graph_estimate_detail_result, term, person, year, month, type)
 
-        with open(save_path, "rb") as f:
-            encoded_content = base64.b64encode(f.read()).decode("utf-8")
+@app.get("/api/v1/estimate/person/period")
+async def api_estimate_person_period(request: Request, start_month: str = None, end_month: str = None, person: str = None):
+    return await report_json(request, ("general",), build_graph_estimate_person_period_result, start_month, end_month, person)
 
-        commit_message = f"自動更新: 検査工数データ ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})"
-        data = {
-            "message": commit_message,
-            "content": encoded_content,
-            "branch": branch
-        }
-        if sha:
-            data["sha"] = sha
+@app.get("/api/v1/estimate/person/period/detail")
+async def api_estimate_person_period_detail(request: Request, start: str, end: str, year: int, month: int, person: str, type: str):
+    return await report_json(request, ("general",), build_graph_estimate_person_period_detail, start, end, year, month, person, type)
 
-        put_resp = requests.put(api_url, headers=headers, json=data)
+@app.get("/api/v1/estimate/total/term")
+async def api_estimate_total_term(request: Request, term: str):
+    return await report_json(request, ("general",), build_graph_estimate_total_term_result, term)
 
-        if put_resp.status_code in [200, 201]:
-            return JSONResponse(content={
-                "status": "success",
-                "message": f"{len(new_df)} 件のレコードを更新・追加して保存しました"
-            })
-        else:
-            return JSONResponse(content={
-                "status": "partial_success",
-                "message": f"保存成功・GitHub反映失敗: {put_resp.json()}"
-            }, status_code=500)
+@app.get("/api/v1/estimate/total/compare")
+async def api_estimate_total_compare(request: Request, term: str):
+    return await report_json(request, ("general",), build_graph_estimate_total_compare_result, term)
 
-    except Exception as e:
-        return JSONResponse(content={
-            "status": "error",
-            "message": f"保存成功・GitHub連携失敗: {str(e)}"
-        }, status_code=500)
+# ==========================
+#       API連携
+# ==========================
+# アップロードは一時ファイル（SpooledTemporaryFile）のまま、一定行数ずつ読み込んで取込ログへ追記する。
+# 生のバイト列・デコード済み文字列・全体のDataFrameを同時に持たないため、メモリ使用量は行数に依らない。
+# 1回の取込は全チャンクを書き終えてから1つのセグメント（1トランザクション）として反映し、途中で読めない行があれば何も保存しない。
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "50000"))
 
-@app.post("/api/receive_kousu_data")
-async def receive_kousu_data(records: UploadFile = File(...)):
-    contents = await records.read()
 
-    # CSV読み込み
+def sniff_upload_encoding(upload):
+    # BOMか全体がUTF-8として読めればUTF-8、読めなければcp932（Excel/楽楽精算の出力）
+    # 先頭サンプルだけで決めると、先頭がASCIIのみのcp932ファイルをUTF-8と誤判定するため、アップロード全体を確かめる
     try:
-        new_df = pd.read_csv(io.BytesIO(contents), encoding="utf-8-sig")
+        head = upload.read(len(codecs.BOM_UTF8))
+        if head == codecs.BOM_UTF8:
+            return "utf-8-sig"
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        decoder.decode(head)
+        for block in iter(lambda: upload.read(SNIFF_BYTES), b""):
+            decoder.decode(block)
+        decoder.decode(b"", final=True)
+        return "utf-8-sig"
     except UnicodeDecodeError:
-        new_df = pd.read_csv(io.BytesIO(contents), encoding="cp932")
-
-    # ✅ カラム名の前後スペース削除＋全角カッコ→半角へ正規化
-    new_df.columns = [col.strip().replace("（", "(").replace("）", ")").replace('"', "").replace("'", "") for col in new_df.columns]
-    print("📋 修正後カラム:", new_df.columns.tolist())
-
-    # ✅ 作業時間列の処理（「作業時間」や「作業時間(m)」に対応）
-    time_col = next((col for col in new_df.columns if "作業時間" in col), None)
-    if time_col:
-        new_df["作業時間"] = pd.to_numeric(new_df[time_col], errors="coerce")
-    else:
-        new_df["作業時間"] = 0.0
-
-    # ✅ 期待カラムを抽出・整形
-    expected_cols = ["作業ID", "作業日", "作業実施者", "作業種別", "作業時間"]
-    new_df = new_df[[col for col in new_df.columns if col in expected_cols]]
-    new_df = new_df.reindex(columns=expected_cols)
-
-    # ✅ 保存先のCSVを読み込み（なければ空のDataFrameを用意）
-    os.makedirs("data", exist_ok=True)
-    save_path = os.path.join("data", "工数データ.csv")
-    # ファイルが存在し、サイズが0でないことを確認してから読み込む
-    if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-        try:
-            existing_df = pd.read_csv(save_path, encoding="utf-8-sig")
-        except UnicodeDecodeError:
-            try:
-                existing_df = pd.read_csv(save_path, encoding="cp932")
-            except Exception:
-                existing_df = pd.DataFrame(columns=expected_cols)
-    else:
-        existing_df = pd.DataFrame(columns=expected_cols)
-
+        return "cp932"
+    finally:
+        upload.seek(0)
 
-    # ✅ 確実に必要列だけにし、indexを作業IDに設定
-    existing_df.columns = [col.strip().replace("（", "(").replace("）", ")") for col in existing_df.columns]
-    existing_df = existing_df[[col for col in existing_df.columns if col in expected_cols]]
-    existing_df = existing_df.reindex(columns=expected_cols)
 
+def iter_upload_chunks(upload):
+    with timed("parse"):
+        encoding = sniff_upload_encoding(upload)
     try:
-        existing_df.set_index("作業ID", inplace=True)
-        new_df.set_index("作業ID", inplace=True)
-    except KeyError:
-        return JSONResponse(
-            status_code=400,
-            content={"status": "error", "message": "作業ID列が見つかりません。CSV列名をご確認ください。"}
-        )
-
-    # ✅ 上書き＋追加処理
-    updated_df = existing_df.combine_first(new_df)
-    updated_df.update(new_df)
-
-    # ✅ 保存・GitHubへPush
-    updated_df.reset_index(inplace=True)
-    updated_df.to_csv(save_path, index=False, encoding="utf-8-sig")
+        reader = pd.read_csv(upload, encoding=encoding, chunksize=UPLOAD_CHUNK_ROWS)
+        while True:
+            with timed("parse"):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+            timing_count("uploaded_rows", len(chunk))
+            # カラム名の前後スペース削除＋全角カッコ→半角へ正規化
+            chunk.columns = [col.strip().replace("（", "(").replace("）", ")").replace('"', "").replace("'", "") for col in chunk.columns]
+            yield chunk
+    except UnicodeDecodeError:
+        raise IngestError(f"文字コード（{encoding}）として読み込めない行があります。UTF-8かShift_JISで保存してください。")
 
-    # ✅ GitHub連携
-    try:
-        GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-        repo_owner = "otameshi-web"
-        repo_name = "kousu-app"
-        branch = "master"
-        file_path = "data/工数データ.csv"
-        api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contents/{file_path}"
-
-        headers = {
-            "Authorization": f"Bearer {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github+json"
-        }
 
-        get_resp = requests.get(api_url, headers=headers, params={"ref": branch})
-        sha = get_resp.json().get("sha", None)
+def merge_kensa_upload(upload):
+    log = ingest_logs["kensa"]
+    count = 0
 
-        with open(save_path, "rb") as f:
-            encoded_content = base64.b64encode(f.read()).decode("utf-8")
+    def deltas():
+        nonlocal count
+        for i, new_df in enumerate(iter_upload_chunks(upload)):
+            if i == 0:
+                print("📋 修正後カラム:", new_df.columns.tolist())
 
-        commit_message = f"自動更新: 工数データ ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})"
-        data = {
-            "message": commit_message,
-            "content": encoded_content,
-            "branch": branch
-        }
-        if sha:
-            data["sha"] = sha
+            # 作業時間処理
+            time_col = next((col for col in new_df.columns if "作業時間" in col), None)
+            new_df["作業時間"] = pd.to_numeric(new_df[time_col], errors="coerce") if time_col else 0.0
 
-        put_resp = requests.put(api_url, headers=headers, json=data)
+            new_df = new_df[[col for col in new_df.columns if col in log.columns]]
+            new_df = new_df.reindex(columns=log.columns)
 
-        if put_resp.status_code in [200, 201]:
-            return JSONResponse(content={
-                "status": "success",
-                "message": f"{len(new_df)} 件の新規・更新レコードを保存し、GitHub に反映しました"
-            })
-        else:
-            return JSONResponse(content={
-                "status": "partial_success",
-                "message": f"保存成功・GitHub反映失敗: {put_resp.json()}"
-            }, status_code=500)
+            # 重複排除（同じキーは最後の行を採用）
+            try:
+                new_df = new_df.drop_duplicates(subset=log.key_cols, keep="last")
+            except KeyError:
+                raise IngestError("必要なキー列が存在しません。")
 
-    except Exception as e:
-        return JSONResponse(content={
-            "status": "error",
-            "message": f"保存成功・GitHub連携失敗: {str(e)}"
-        }, status_code=500)
+            if not new_df.empty:
+                count += len(new_df)
+                yield new_df
 
-@app.post("/api/receive_general_construction")
-async def receive_general_construction(records: UploadFile = File(...)):
-    contents = await records.read()
+    # 差分セグメントとして追記（新規追加 + 内容更新は読込時・コンパクション時に反映）
+    log.append(deltas())
+    dataset_cache.invalidate("kensa")
+    return count
 
-    # CSVの読み込み
+@app.post("/api/receive_data")
+async def receive_data(records: UploadFile = File(...)):
     try:
-        new_df = pd.read_csv(io.BytesIO(contents), encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        new_df = pd.read_csv(io.BytesIO(contents), encoding="cp932")
-
-    # カラム正規化
-    new_df.columns = [col.strip().replace("（", "(").replace("）", ")").replace('"', "").replace("'", "") for col in new_df.columns]
-
-    # 保存対象カラムと順番
-    expected_cols = ["工事見積No.", "明細キー", "作成日", "決定日", "宛名", "建物名", "担当者名", "詳細", "小計", "消費税", "合計", "原価小計", "原価率", "利益率", "管理番号"]
-    new_df = new_df[[col for col in new_df.columns if col in expected_cols]]
-    new_df = new_df.reindex(columns=expected_cols)
-
-    # 保存先のCSV読み込み
-    os.makedirs("data", exist_ok=True)
-    save_path = os.path.join("data", "一般工事売上データ.csv")
-
-    if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-        try:
-            existing_df = pd.read_csv(save_path, encoding="utf-8-sig")
-        except:
-            existing_df = pd.DataFrame(columns=expected_cols)
-    else:
-        existing_df = pd.DataFrame(columns=expected_cols)
+        count = await worker_pool.run(run_ingest, "kensa", merge_kensa_upload, records.file)
+    except IngestError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": e.message})
+
+    # GitHubへの反映はバックグラウンドで（連続取込はまとめて1コミット。送る前に取込ログをCSVへ畳み込む）
+    github_sync.enqueue("data/検査工数データ.csv", KENSA_CSV_PATH, "検査工数データ", prepare=lambda: worker_pool.run(compact_dataset, "kensa"))
+    return JSONResponse(content={
+        "status": "success",
+        "message": f"{count} 件のレコードを更新・追加して保存しました（GitHubへは順次反映します）"
+    })
 
-    existing_df = existing_df[[col for col in existing_df.columns if col in expected_cols]]
-    existing_df = existing_df.reindex(columns=expected_cols)
+def merge_kousu_upload(upload):
+    log = ingest_logs["kousu"]
 
+    # ✅ 取込前のキャッシュ（工数キューブ差分更新の基準）
     try:
-        existing_df.set_index(["工事見積No.", "明細キー"], inplace=True)
-        new_df.set_index(["工事見積No.", "明細キー"], inplace=True)
-    except KeyError:
-        return JSONResponse(status_code=400, content={"status": "error", "message": "キー列が存在しません。"})
-
-    # 更新・追加のみ（削除なし）
-    updated_df = existing_df.combine_first(new_df)
-    updated_df.update(new_df)
+        base = dataset_cache.entry("kousu")
+    except Exception:
+        base = None
+
+    # ✅ キャッシュへの差分反映は手元で進め、全チャンクを保存できてから登録する
+    pending = (base.frame, base.derived.get("cube")) if base is not None else None
+    count = 0
+
+    def deltas():
+        nonlocal pending, count
+        for i, new_df in enumerate(iter_upload_chunks(upload)):
+            if i == 0:
+                print("📋 修正後カラム:", new_df.columns.tolist())
+
+            # ✅ 作業時間列の処理（「作業時間」や「作業時間(m)」に対応）
+            time_col = next((col for col in new_df.columns if "作業時間" in col), None)
+            if time_col:
+                new_df["作業時間"] = pd.to_numeric(new_df[time_col], errors="coerce")
+            else:
+                new_df["作業時間"] = 0.0
+
+            # ✅ 期待カラムを抽出・整形
+            new_df = new_df[[col for col in new_df.columns if col in log.columns]]
+            new_df = new_df.reindex(columns=log.columns)
 
-    updated_df.reset_index(inplace=True)
-    updated_df.to_csv(save_path, index=False, encoding="utf-8-sig")
+            try:
+                new_df = new_df.drop_duplicates(subset=log.key_cols, keep="last")
+            except KeyError:
+                raise IngestError("作業ID列が見つかりません。CSV列名をご確認ください。")
+
+            if not new_df.empty:
+                if pending is not None:
+                    with timed("upsert"):
+                        pending = upsert_kousu_rows(*pending, new_df)
+                count += len(new_df)
+                yield new_df
+
+    # ✅ 差分セグメントとして追記（上書き＋追加は読込時・コンパクション時に反映）
+    written = log.append(deltas())
+    if written is not None:
+        apply_kousu_upsert(base, pending, written)
+    return count
 
-    # GitHubへ反映
+@app.post("/api/receive_kousu_data")
+async def receive_kousu_data(records: UploadFile = File(...)):
     try:
-        GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-        repo_owner = "otameshi-web"
-        repo_name = "kousu-app"
-        branch = "master"
-        file_path = "data/一般工事売上データ.csv"
-        api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contents/{file_path}"
-
-        headers = {
-            "Authorization": f"Bearer {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github+json"
-        }
+        count = await worker_pool.run(run_ingest, "kousu", merge_kousu_upload, records.file)
+    except IngestError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": e.message})
+
+    # GitHubへの反映はバックグラウンドで（連続取込はまとめて1コミット。送る前に取込ログをCSVへ畳み込む）
+    github_sync.enqueue("data/工数データ.csv", CSV_PATH, "工数データ", prepare=lambda: worker_pool.run(compact_dataset, "kousu"))
+    return JSONResponse(content={
+        "status": "success",
+        "message": f"{count} 件の新規・更新レコードを保存しました（GitHubへは順次反映します）"
+    })
 
-        get_resp = requests.get(api_url, headers=headers, params={"ref": branch})
-        sha = get_resp.json().get("sha", None)
+def merge_general_upload(upload):
+    log = ingest_logs["general"]
+    count = 0
 
-        with open(save_path, "rb") as f:
-            encoded_content = base64.b64encode(f.read()).decode("utf-8")
+    def deltas():
+        nonlocal count
+        for new_df in iter_upload_chunks(upload):
+            # 保存対象カラムと順番
+            new_df = new_df[[col for col in new_df.columns if col in log.columns]]
+            new_df = new_df.reindex(columns=log.columns)
 
-        commit_message = f"自動更新: 一般工事売上データ ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})"
-        data = {
-            "message": commit_message,
-            "content": encoded_content,
-            "branch": branch
-        }
-        if sha:
-            data["sha"] = sha
+            try:
+                new_df = new_df.drop_duplicates(subset=log.key_cols, keep="last")
+            except KeyError:
+                raise IngestError("キー列が存在しません。")
 
-        put_resp = requests.put(api_url, headers=headers, json=data)
+            if not new_df.empty:
+                count += len(new_df)
+                yield new_df
 
-        if put_resp.status_code in [200, 201]:
-            return JSONResponse(content={"status": "success", "message": f"{len(new_df)} 件を保存・GitHubに反映しました"})
-        else:
-            return JSONResponse(content={"status": "partial_success", "message": f"保存成功・GitHub反映失敗: {put_resp.json()}"}, status_code=500)
+    # 更新・追加のみ（削除なし）。差分セグメントとして追記する
+    log.append(deltas())
+    dataset_cache.invalidate("general")
+    return count
 
-    except Exception as e:
-        return JSONResponse(content={"status": "error", "message": f"保存成功・GitHub連携失敗: {str(e)}"}, status_code=500)
+@app.post("/api/receive_general_construction")
+async def receive_general_construction(records: UploadFile = File(...)):
+    try:
+        count = await worker_pool.run(run_ingest, "general", merge_general_upload, records.file)
+    except IngestError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": e.message})
+
+    # GitHubへの反映はバックグラウンドで（連続取込はまとめて1コミット。送る前に取込ログをCSVへ畳み込む）
+    github_sync.enqueue("data/一般工事売上データ.csv", GENERAL_CSV_PATH, "一般工事売上データ", prepare=lambda: worker_pool.run(compact_dataset, "general"))
+    return JSONResponse(content={
+        "status": "success",
+        "message": f"{count} 件を保存しました（GitHubへは順次反映します）"
+    })
 
 
 # ==========================
@@ -1643,3 +3309,96 @@ async def receive_general_construction(records: UploadFile = File(...)):
 def healthcheck():
     return JSONResponse(content={"status": "ok", "message": "healthcheck successful"})
 
+
+# ==========================
+#    稼働状況
+# ==========================
+@app.get("/api/status/worker_pool")
+async def worker_pool_status():
+    return JSONResponse(content=worker_pool.stats())
+
+
+@app.get("/api/status/github_sync")
+async def github_sync_status():
+    return JSONResponse(content=github_sync.status())
+
+
+@app.get("/api/status/http_client")
+async def http_client_status():
+    return JSONResponse(content=http_client.stats())
+
+
+@app.get("/api/status/report_cache")
+async def report_cache_status():
+    return JSONResponse(content=report_cache.stats())
+
+
+@app.get("/api/status/single_flight")
+async def single_flight_status():
+    return JSONResponse(content=report_flights.stats())
+
+
+@app.get("/api/status/storage")
+async def storage_status():
+    if postgres_store is not None:
+        return JSONResponse(content={"backend": "postgres", **postgres_store.stats()})
+    if sqlite_store is None:
+        return JSONResponse(content={"backend": STORAGE_BACKEND})
+    tables = await worker_pool.run(lambda: {name: sqlite_store.state(name) for name in ingest_logs})
+    return JSONResponse(content={"backend": "sqlite", "path": SQLITE_PATH, "tables": tables})
+
+
+def dataset_sizes():
+    # データセットごとの (版, 行数, バイト数)。バイト数の計算はワーカーで行う
+    return {name: (entry.version, len(entry.frame), entry.nbytes()) for name, entry in dataset_cache.loaded().items()}
+
+
+def render_metrics(sizes):
+    lines = []
+    lines += http_request_seconds.lines()
+    lines += metric_lines("kousu_http_requests_in_flight", "gauge", "Requests currently being handled.", ("method", "route"),
+                          sorted(http_in_flight.items()))
+    lines += ingest_rows_per_call.lines()
+    lines += ingest_merge_seconds.lines()
+    lines += dataset_load_seconds.lines()
+    lines += metric_lines("kousu_dataset_rows", "gauge", "Rows in the loaded dataset.", ("dataset",),
+                          [((name,), rows) for name, (_, rows, _) in sorted(sizes.items())])
+    lines += metric_lines("kousu_dataset_bytes", "gauge", "In-memory size of the loaded dataset.", ("dataset",),
+                          [((name,), nbytes) for name, (_, _, nbytes) in sorted(sizes.items())])
+    lines += metric_lines("kousu_dataset_version", "gauge", "Version number of the loaded dataset.", ("dataset",),
+                          [((name,), version) for name, (version, _, _) in sorted(sizes.items())])
+
+    # ▼ GitHub同期（未送信の待ち時間＝同期の遅れ）
+    sync = github_sync.status()
+    files = sorted(sync["files"].items())
+    lines += metric_lines("kousu_github_sync_pending_seconds", "gauge", "Seconds since the oldest unsynced upload of a file.", ("file",),
+                          [((path,), job["waiting_seconds"]) for path, job in sorted(sync["pending"].items())])
+    lines += metric_lines("kousu_github_sync_last_lag_seconds", "gauge", "Upload-to-commit lag of the last successful sync.", ("file",),
+                          [((path,), status["last_lag_seconds"]) for path, status in files if status["last_lag_seconds"] is not None])
+    lines += metric_lines("kousu_github_sync_uploads_total", "counter", "Uploads queued for GitHub sync.", ("file",),
+                          [((path,), status["uploads"]) for path, status in files])
+    lines += metric_lines("kousu_github_sync_commits_total", "counter", "Successful GitHub commits.", ("file",),
+                          [((path,), status["commits"]) for path, status in files])
+    lines += metric_lines("kousu_github_sync_failures_total", "counter", "Failed GitHub sync attempts.", ("file",),
+                          [((path,), status["failures"]) for path, status in files])
+
+    # ▼ 応答キャッシュ・同時要求のまとめ・ワーカープール
+    cache = report_cache.stats()
+    for key, kind in [("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("invalidations", "counter"), ("entries", "gauge"), ("bytes", "gauge")]:
+        name = f"kousu_report_cache_{key}_total" if kind == "counter" else f"kousu_report_cache_{key}"
+        lines += metric_lines(name, kind, f"Report cache {key}.", (), [((), cache[key])])
+    flights = report_flights.stats()
+    lines += metric_lines("kousu_single_flight_leaders_total", "counter", "Report computations started.", (), [((), flights["leaders"])])
+    lines += metric_lines("kousu_single_flight_coalesced_total", "counter", "Requests that waited on an identical computation.", (), [((), flights["coalesced"])])
+    pool = worker_pool.stats()
+    lines += metric_lines("kousu_worker_pool_queued", "gauge", "Tasks waiting for a worker thread.", (), [((), pool["queued"])])
+    lines += metric_lines("kousu_worker_pool_running", "gauge", "Tasks running on worker threads.", (), [((), pool["running"])])
+    lines += metric_lines("kousu_worker_pool_completed_total", "counter", "Tasks completed by worker threads.", (), [((), pool["completed"])])
+    lines += metric_lines("kousu_worker_pool_wait_seconds_total", "counter", "Total time tasks waited for a worker thread.", (), [((), pool["wait_seconds_total"])])
+    return "\n".join(lines) + "\n"
+
+
+@app.get("/metrics")
+async def metrics():
+    sizes = await worker_pool.run(dataset_sizes)
+    return Response(content=render_metrics(sizes), media_type="text/plain; version=0.0.4; charset=utf-8")
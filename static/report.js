@@ -0,0 +1,29 @@
+// 結果ページ共通：/api/v1 からグラフ・一覧のJSONを取得する
+// 取得に失敗した場合は従来のエラーページと同じく、ページ本文をエラーメッセージに置き換える
+async function loadReport(url) {
+  const res = await fetch(url, { headers: { "Accept": "application/json" } });
+  const data = await res.json().catch(() => ({ error: `データ取得エラー（${res.status}）` }));
+  if (!res.ok) {
+    const message = document.createElement("h3");
+    message.textContent = data.error || `データ取得エラー（${res.status}）`;
+    document.body.replaceChildren(message);
+    throw new Error(message.textContent);
+  }
+  return data;
+}
+
+// 「1,234」形式（テンプレートの '{:,}'.format と同じ表記）
+function formatNumber(value) {
+  return Number(value).toLocaleString("en-US");
+}
+
+// 列持ちのグラフデータ（系列定義・配色番号・系列ごとの値）を Chart.js の datasets に展開する
+// 主系列（stack: "main"）の系列名には suffix（「（時間）」「（件数）」）を付ける
+function chartDatasets(chart, kind, suffix) {
+  return chart.series.map((series, i) => ({
+    label: series.stack === "main" ? `${series.label}${suffix}` : series.label,
+    data: chart[kind][i],
+    stack: series.stack,
+    backgroundColor: chart.palette[series.color]
+  }));
+}
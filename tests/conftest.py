@@ -0,0 +1,108 @@
+# テストは main.py と同じくリポジトリ直下で実行する（python -m pytest）。static/templates/data を相対パスで読むため
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+class LocalServer:
+    # テスト用のローカルHTTPサーバー。handle(method, path, body) -> (status, headers, body) を差し替えて使う
+    def __init__(self, handle):
+        self.handle = handle
+        self.requests = []
+        self.connections = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self):
+                server.connections.add(self.client_address)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                server.requests.append({"method": self.command, "path": self.path, "body": body, "client": self.client_address, "at": time.monotonic()})
+                status, headers, payload = server.handle(self.command, self.path, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_PUT = do_POST = _serve
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeContentsApi:
+    # GitHub contents API（GET/PUT /repos/{repo}/contents/{path}）の最小限の偽物
+    # fail_puts に積んだステータスを先頭から1つずつ PUT の応答に使う
+    def __init__(self):
+        self.files = {}
+        self.fail_puts = []
+        self.commits = 0
+        self.on_fail = None
+
+    def _path(self, raw):
+        path = urlparse(raw).path
+        return unquote(path.split("/contents/", 1)[1])
+
+    def handle(self, method, raw, body):
+        path = self._path(raw)
+        if method == "GET":
+            if path not in self.files:
+                return 404, {"Content-Type": "application/json"}, b'{"message": "Not Found"}'
+            return 200, {"Content-Type": "application/json"}, json.dumps({"sha": self.files[path]["sha"]}).encode()
+        data = json.loads(body)
+        if self.fail_puts:
+            status = self.fail_puts.pop(0)
+            if self.on_fail is not None:
+                self.on_fail(path)
+            return status, {"Content-Type": "application/json"}, json.dumps({"message": f"fail {status}"}).encode()
+        current = self.files.get(path)
+        if current is not None and data.get("sha") != current["sha"]:
+            return 409, {"Content-Type": "application/json"}, b'{"message": "sha mismatch"}'
+        self.put_file(path, base64.b64decode(data["content"]))
+        self.commits += 1
+        return 200, {"Content-Type": "application/json"}, json.dumps({"commit": {"sha": f"commit-{self.commits}"}}).encode()
+
+    def put_file(self, path, content):
+        # 他の誰かのコミットを模す場合にも使う
+        self.files[path] = {"sha": hashlib.sha1(content).hexdigest(), "content": content}
+
+
+@pytest.fixture
+def fake_github(monkeypatch):
+    import main
+
+    api = FakeContentsApi()
+    with LocalServer(api.handle) as server:
+        monkeypatch.setattr(main, "GITHUB_API_URL", server.url)
+        api.server = server
+        yield api
@@ -0,0 +1,168 @@
+# GitHubSyncQueue をローカルの偽 contents API に対して動かす（待機中の取込のまとめ・再試行・sha の取り直し・状態API）
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+
+REPO_PATH = "data/工数データ.csv"
+
+
+def run_queue(queue, steps, until, timeout=5.0, settle=0.0):
+    # steps(queue) で取込を積み、until() が真になるまで（最大 timeout 秒）キューを動かす
+    async def body():
+        try:
+            await steps(queue)
+            deadline = time.time() + timeout
+            while not until() and time.time() < deadline:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(settle)
+        finally:
+            if queue._task is not None:
+                queue._task.cancel()
+            await main.http_client.aclose()
+
+    asyncio.run(body())
+
+
+def state(queue, repo_path=REPO_PATH):
+    return queue.status()["files"].get(repo_path, {}).get("state")
+
+
+def puts(api):
+    return [r for r in api.server.requests if r["method"] == "PUT"]
+
+
+def test_uploads_within_debounce_are_coalesced_into_one_commit(fake_github, tmp_path):
+    local = tmp_path / "kousu.csv"
+    queue = main.GitHubSyncQueue(debounce=0.2, max_delay=5, max_retries=3, retry_base=0.01)
+
+    async def steps(q):
+        for i in range(3):
+            local.write_bytes(f"v{i}".encode())
+            q.enqueue(REPO_PATH, str(local), "工数データ")
+            await asyncio.sleep(0.05)
+
+    run_queue(queue, steps, lambda: state(queue) == "synced", settle=0.4)
+
+    assert fake_github.commits == 1
+    assert len(puts(fake_github)) == 1
+    assert fake_github.files[REPO_PATH]["content"] == b"v2"
+    status = queue.status()["files"][REPO_PATH]
+    assert status["state"] == "synced"
+    assert status["uploads"] == 3
+    assert status["commits"] == 1
+    assert status["last_commit"] == "commit-1"
+
+
+def test_max_delay_bounds_a_steady_stream_of_uploads(fake_github, tmp_path):
+    local = tmp_path / "kousu.csv"
+    local.write_bytes(b"v")
+    queue = main.GitHubSyncQueue(debounce=0.3, max_delay=0.5, max_retries=3, retry_base=0.01)
+    started = time.time()
+    first_commit = []
+
+    async def steps(q):
+        # 待機時間より短い間隔で取込が続いても、最初の取込から max_delay 経てば送る
+        for _ in range(12):
+            q.enqueue(REPO_PATH, str(local), "工数データ")
+            if fake_github.commits and not first_commit:
+                first_commit.append(time.time() - started)
+            await asyncio.sleep(0.1)
+
+    run_queue(queue, steps, lambda: True)
+
+    assert first_commit and first_commit[0] < 1.0
+
+
+def test_retryable_failures_back_off_and_refresh_the_sha(fake_github, tmp_path):
+    local = tmp_path / "kousu.csv"
+    local.write_bytes(b"ours")
+    fake_github.put_file(REPO_PATH, b"old")
+    fake_github.fail_puts = [409, 503]
+    # 失敗のたびに他所からコミットが入り、sha が進んだことにする
+    fake_github.on_fail = lambda path: fake_github.put_file(path, f"other{len(fake_github.fail_puts)}".encode())
+    queue = main.GitHubSyncQueue(debounce=0.0, max_delay=0.0, max_retries=3, retry_base=0.1)
+
+    async def steps(q):
+        q.enqueue(REPO_PATH, str(local), "工数データ")
+
+    run_queue(queue, steps, lambda: state(queue) == "synced")
+
+    assert fake_github.commits == 1
+    assert fake_github.files[REPO_PATH]["content"] == b"ours"
+    # 送るたびに直前の GET で sha を取り直している
+    assert [r["method"] for r in fake_github.server.requests] == ["GET", "PUT", "GET", "PUT", "GET", "PUT"]
+    sent = [json.loads(r["body"])["sha"] for r in puts(fake_github)]
+    assert len(set(sent)) == 3
+    # 再試行の間隔は retry_base から倍々に広がる
+    times = [r["at"] for r in puts(fake_github)]
+    assert times[1] - times[0] >= 0.1
+    assert times[2] - times[1] >= 0.2
+    status = queue.status()["files"][REPO_PATH]
+    assert status["state"] == "synced"
+    assert status["failures"] == 2
+    assert status["attempts"] == 0
+    assert status["last_error"] is None
+
+
+def test_non_retryable_failure_is_not_retried(fake_github, tmp_path):
+    local = tmp_path / "kousu.csv"
+    local.write_bytes(b"ours")
+    fake_github.fail_puts = [403]
+    queue = main.GitHubSyncQueue(debounce=0.0, max_delay=0.0, max_retries=3, retry_base=0.01)
+
+    async def steps(q):
+        q.enqueue(REPO_PATH, str(local), "工数データ")
+
+    run_queue(queue, steps, lambda: state(queue) == "failed", settle=0.1)
+
+    assert len(puts(fake_github)) == 1
+    status = queue.status()["files"][REPO_PATH]
+    assert status["state"] == "failed"
+    assert status["last_error"].startswith("403")
+
+
+def test_gives_up_after_max_retries(fake_github, tmp_path):
+    local = tmp_path / "kousu.csv"
+    local.write_bytes(b"ours")
+    fake_github.fail_puts = [503] * 5
+    queue = main.GitHubSyncQueue(debounce=0.0, max_delay=0.0, max_retries=2, retry_base=0.01)
+
+    async def steps(q):
+        q.enqueue(REPO_PATH, str(local), "工数データ")
+
+    run_queue(queue, steps, lambda: state(queue) == "failed", settle=0.1)
+
+    assert len(puts(fake_github)) == 3
+    assert fake_github.commits == 0
+    assert queue.status()["files"][REPO_PATH]["failures"] == 3
+
+
+def test_status_endpoint_reports_pending_and_synced_files(fake_github, tmp_path, monkeypatch):
+    local = tmp_path / "kousu.csv"
+    local.write_bytes(b"ours")
+    queue = main.GitHubSyncQueue(debounce=0.0, max_delay=0.0, max_retries=3, retry_base=0.01)
+    monkeypatch.setattr(main, "github_sync", queue)
+
+    async def steps(q):
+        q.enqueue(REPO_PATH, str(local), "工数データ")
+
+    run_queue(queue, steps, lambda: state(queue) == "synced")
+    queue.debounce = queue.max_delay = 60.0
+
+    async def later(q):
+        q.enqueue("data/検査工数データ.csv", str(local), "検査工数データ")
+
+    run_queue(queue, later, lambda: True)
+
+    body = TestClient(main.app).get("/api/status/github_sync").json()
+    assert body["debounce_seconds"] == 60.0
+    assert body["files"][REPO_PATH]["state"] == "synced"
+    assert body["files"][REPO_PATH]["last_commit"] == "commit-1"
+    assert body["files"]["data/検査工数データ.csv"]["state"] == "pending"
+    pending = body["pending"]["data/検査工数データ.csv"]
+    assert pending["uploads"] == 1
+    assert 0 < pending["due_in_seconds"] <= 60.0
@@ -0,0 +1,120 @@
+# OutboundHttp をローカルのHTTPサーバーに対して動かす（接続プールの再利用・タイムアウト・エラーの記録）
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+from conftest import LocalServer
+
+
+def ok(method, path, body):
+    if path.startswith("/slow"):
+        time.sleep(0.5)
+    if path.startswith("/error"):
+        return 502, {}, b"bad gateway"
+    return 200, {"Content-Type": "text/plain"}, b"ok"
+
+
+async def body_with(http, coro_fn, *args):
+    # 1つのイベントループで coro_fn(http) を動かし、最後に接続プールを閉じる
+    try:
+        return await coro_fn(http, *args)
+    finally:
+        await http.aclose()
+
+
+def test_requests_share_one_pooled_client_and_connection():
+    with LocalServer(ok) as server:
+        async def calls(http):
+            clients = set()
+            for _ in range(5):
+                resp = await http.request("GET", f"{server.url}/contents")
+                assert resp.status_code == 200
+                clients.add(id(http.client()))
+            return clients
+
+        http = main.OutboundHttp()
+        clients = asyncio.run(body_with(http, calls))
+
+    assert len(clients) == 1
+    # keep-alive で1本の接続を使い回している
+    assert len(server.requests) == 5
+    assert len({r["client"] for r in server.requests}) == 1
+    stat = http.stats()["calls"]["GET 127.0.0.1"]
+    assert stat["count"] == 5
+    assert stat["errors"] == 0
+
+
+def test_client_is_rebuilt_for_a_new_event_loop_and_after_close():
+    http = main.OutboundHttp()
+
+    async def grab(http):
+        client = http.client()
+        assert http.client() is client
+        return client
+
+    # 前のループの接続プールは使わず、新しいループで作り直す
+    first = asyncio.run(grab(http))
+    second = asyncio.run(body_with(http, grab))
+    assert first is not second
+    assert second.is_closed and http._client is None
+    asyncio.run(first.aclose())
+
+
+def test_default_timeout_raises_and_is_recorded(monkeypatch):
+    monkeypatch.setattr(main, "HTTP_TIMEOUT", 0.2)
+    with LocalServer(ok) as server:
+        async def slow(http):
+            started = time.perf_counter()
+            with pytest.raises(httpx.ReadTimeout):
+                await http.request("GET", f"{server.url}/slow")
+            return time.perf_counter() - started
+
+        http = main.OutboundHttp()
+        elapsed = asyncio.run(body_with(http, slow))
+
+    assert elapsed < 0.45
+    stat = http.stats()["calls"]["GET 127.0.0.1"]
+    assert stat["count"] == 1
+    assert stat["errors"] == 1
+
+
+def test_per_request_timeout_overrides_the_default():
+    with LocalServer(ok) as server:
+        async def slow(http):
+            resp = await http.request("PUT", f"{server.url}/slow", timeout=httpx.Timeout(2.0))
+            with pytest.raises(httpx.ReadTimeout):
+                await http.request("PUT", f"{server.url}/slow", timeout=httpx.Timeout(0.1))
+            return resp.status_code
+
+        http = main.OutboundHttp()
+        assert asyncio.run(body_with(http, slow)) == 200
+
+    stat = http.stats()["calls"]["PUT 127.0.0.1"]
+    assert stat["count"] == 2
+    assert stat["errors"] == 1
+
+
+def test_server_errors_and_refused_connections_are_counted():
+    with LocalServer(ok) as server:
+        url = server.url
+
+        async def errors(http):
+            resp = await http.request("GET", f"{url}/error")
+            return resp.status_code
+
+        http = main.OutboundHttp()
+        assert asyncio.run(body_with(http, errors)) == 502
+
+    async def refused(http):
+        # サーバーを止めた後のポートへは接続できない
+        with pytest.raises(httpx.ConnectError):
+            await http.request("GET", f"{url}/contents")
+
+    asyncio.run(body_with(http, refused))
+    stat = http.stats()["calls"]["GET 127.0.0.1"]
+    assert stat["count"] == 2
+    assert stat["errors"] == 2
+    assert stat["seconds_max"] >= stat["last_seconds"]
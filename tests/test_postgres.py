@@ -0,0 +1,193 @@
+# PostgresStore / PostgresTable を実際の PostgreSQL に対して動かす（DATABASE_URL が無ければ飛ばす）
+# テストごとに専用のスキーマを作り（search_path で切り替え）、終わったら消す
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pytest
+
+import main
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+pytestmark = [
+    pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL が未設定"),
+    pytest.mark.skipif(not main.ASYNCPG_AVAILABLE, reason="asyncpg が未インストール"),
+]
+
+
+class LoopThread:
+    # 接続プールを持つイベントループを別スレッドで回す（アプリのイベントループの代わり。テスト本体はワーカーの立場で呼ぶ）
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=30)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def wait_for(until, timeout=3.0):
+    deadline = time.time() + timeout
+    while not until() and time.time() < deadline:
+        time.sleep(0.01)
+    return until()
+
+
+@pytest.fixture
+def pg(monkeypatch):
+    import asyncpg
+
+    # 取りこぼし用の定期確認は止め、版の更新が NOTIFY で届くことを確かめる
+    monkeypatch.setattr(main, "PG_VERSION_POLL", 60.0)
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    dsn = DATABASE_URL + ("&" if "?" in DATABASE_URL else "?") + f"search_path={schema}"
+    loop = LoopThread()
+
+    async def admin(sql):
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    loop.run(admin(f"CREATE SCHEMA {schema}"))
+    stores = []
+
+    def store():
+        s = main.PostgresStore(dsn, 1, 4)
+        loop.run(s.start())
+        stores.append(s)
+        return s
+
+    try:
+        yield store
+    finally:
+        for s in stores:
+            loop.run(s.close())
+        loop.run(admin(f"DROP SCHEMA {schema} CASCADE"))
+        loop.stop()
+
+
+def table(store, name, tmp_path):
+    schema = main.DATASET_SCHEMAS[name]
+    log = main.IngestLog(name, str(tmp_path / f"{name}.csv"), schema["keys"], schema["columns"])
+    log.segment_dir = str(tmp_path / "_segments" / name)
+    return main.PostgresTable(name, store, log, main.POSTGRES_AGGREGATES.get(name))
+
+
+def kousu_rows(*rows):
+    return pd.DataFrame(rows, columns=["作業ID", "作業日", "作業実施者", "作業種別", "作業時間"])
+
+
+def test_copy_ingest_upserts_all_chunks_in_one_transaction(pg, tmp_path):
+    kousu = table(pg(), "kousu", tmp_path)
+    written = kousu.append([
+        kousu_rows((1, "2024/05/01", "平野司", "点検", 1.5), (2, "2024/05/02", "楠本敏紀", "修理", 2.0)),
+        # 後のチャンクの同じキーは空でない値だけ上書きする
+        kousu_rows((2, None, None, "調査", 3.0), (3, "2024/06/01", "平野司", "点検", 0.5)),
+    ])
+    assert written == ((0, None), (1, None))
+
+    frame = kousu.load().set_index("作業ID")
+    assert frame.index.tolist() == [1, 2, 3]
+    assert frame.loc[2].tolist() == ["2024-05-02", "楠本敏紀", "調査", 3.0]
+
+    def failing():
+        yield kousu_rows((4, "2024/07/01", "平野司", "点検", 1.0))
+        raise ValueError("途中で失敗")
+
+    # 途中のチャンクで失敗した取込は何も残さず、版も進めない
+    with pytest.raises(ValueError):
+        kousu.append(failing())
+    assert kousu.load()["作業ID"].tolist() == [1, 2, 3]
+    assert kousu.store.versions["kousu"] == 1
+    # 行の無い取込は版を進めない
+    assert kousu.append([kousu_rows()]) is None
+
+
+def test_notify_advances_the_version_on_other_instances(pg, tmp_path):
+    writer, reader = pg(), pg()
+    before = reader.notifications
+    table(writer, "kousu", tmp_path).append([kousu_rows((1, "2024/05/01", "平野司", "点検", 1.0))])
+
+    # 定期確認を待たずに、通知で他の台の版が進む
+    assert wait_for(lambda: reader.versions.get("kousu") == 1)
+    assert reader.notifications > before
+    assert table(reader, "kousu", tmp_path).signature() == (1, None)
+
+
+def test_cube_and_estimate_headers_are_finished_from_server_side_aggregates(pg, tmp_path):
+    store = pg()
+    kousu = table(store, "kousu", tmp_path)
+    kousu.append([kousu_rows(
+        (1, "2024/05/01", "平野司", "点検", 1.5), (2, "2024/05/20", "平野司", "点検", 2.0),
+        (3, "2024/06/01", "楠本敏紀", "修理", 0.5), (4, "bad", "楠本敏紀", "修理", 9.0),
+        (5, "2024/06/03", None, "修理", 1.0),
+    )])
+    general = table(store, "general", tmp_path)
+    general.append([pd.DataFrame({
+        "工事見積No.": [100, 100, 101, None, 102],
+        "明細キー": [1, 2, 1, 1, 1],
+        "作成日": ["2024/05/10", "2024/05/10", "2024/05/01", "2024/05/05", None],
+        "決定日": [None, "2024/06/01", None, None, None],
+        "建物名": ["森ビル", None, "田中病院", "前田会館", None],
+        "担当者名": ["森本健", "森本健", None, "田中誠", None],
+        "詳細": ["a", "b", "c", None, None],
+        "小計": [1000, None, 500, 20, None],
+    })])
+
+    for source, normalize, key, build in [
+        (kousu, main.normalize_kousu, "cube", main.build_kousu_cube),
+        (general, main.normalize_general, "estimates", main.build_estimate_tables),
+    ]:
+        frame = normalize(source.load())
+        preloaded = source.preloaded(frame)
+        # 集計はPostgreSQL側で済んでいて、読み込んだフレームから作った場合と同じ表になる
+        want = build(frame)
+        if key == "cube":
+            pd.testing.assert_frame_equal(preloaded["cube"], want)
+        else:
+            for col in main.ESTIMATE_DATE_COLUMNS:
+                pd.testing.assert_frame_equal(preloaded["estimates"]["headers"][col], want["headers"][col])
+        # 仕上げ後は次の読込まで持ち越さない
+        assert source.preloaded(frame) == {}
+
+
+def test_ingest_is_applied_incrementally_only_on_top_of_the_version_it_read(pg, tmp_path, monkeypatch):
+    store, other_store = pg(), pg()
+    kousu = table(store, "kousu", tmp_path)
+    other = table(other_store, "kousu", tmp_path)
+    kousu.append([kousu_rows((1, "2024/05/01", "平野司", "点検", 1.0))])
+    registry = main.DatasetRegistry()
+    registry.register("kousu", kousu, main.normalize_kousu)
+    monkeypatch.setattr(main, "dataset_cache", registry)
+
+    # 直前の版の上に書いた取込は、差し替えたフレームをそのまま登録する
+    base = registry.entry("kousu")
+    delta = kousu_rows((2, "2024/05/02", "平野司", "修理", 2.0))
+    pending = main.upsert_kousu_rows(base.frame, None, delta)
+    entry = main.apply_kousu_upsert(base, pending, kousu.append([delta]))
+    assert entry is not None
+    assert entry.signature == (2, None)
+    assert registry.peek("kousu") is entry
+    assert entry.frame["作業ID"].tolist() == [1, 2]
+
+    # 読んだ後に他の台の取込が挟まった場合は、差分で追えないので登録せずに読み直させる
+    base = registry.entry("kousu")
+    other.append([kousu_rows((3, "2024/05/03", "楠本敏紀", "点検", 0.5))])
+    delta = kousu_rows((4, "2024/05/04", "平野司", "点検", 1.0))
+    pending = main.upsert_kousu_rows(base.frame, None, delta)
+    assert main.apply_kousu_upsert(base, pending, kousu.append([delta])) is None
+    assert registry.peek("kousu") is None
+    reloaded = registry.entry("kousu")
+    assert reloaded.signature == (4, None)
+    assert sorted(reloaded.frame["作業ID"].tolist()) == [1, 2, 3, 4]